@@ -0,0 +1,32 @@
+# Pre-rendered zoom and rotate animations. Transforming a surface every
+# frame is slow; instead the frames of an animation are made once, when
+# the sprite is set up, and looked up by how far along the animation is.
+
+import pygame
+from constants import *
+
+class AnimStrip(object):
+  # make(p) returns the frame p of the way (0 to 1) through the
+  # animation; it's called for count evenly spaced values of p.
+  def __init__(self, count, make):
+    self.frames = [make(i / float(max(1, count - 1))) for i in range(count)]
+
+  # The frame closest to p of the way through the animation.
+  def get(self, p):
+    if p <= 0: return self.frames[0]
+    elif p >= 1: return self.frames[-1]
+    else: return self.frames[int(p * (len(self.frames) - 1) + 0.5)]
+
+  def __len__(self): return len(self.frames)
+
+# Zoom and rotate image from zoom z0 and angle a0 (at p = 0) to z1 and
+# a1 (at p = 1). If colorkey is true, the top left pixel of each frame
+# is made transparent.
+def zoom_strip(image, count, z0, z1, a0 = 0, a1 = 0, colorkey = False):
+  def make(p):
+    img = pygame.transform.rotozoom(image, a0 + (a1 - a0) * p,
+                                    max(0.001, z0 + (z1 - z0) * p))
+    if colorkey and img.get_width() and img.get_height():
+      img.set_colorkey(img.get_at([0, 0]), RLEACCEL)
+    return img
+  return AnimStrip(count, make)
@@ -43,10 +43,10 @@ class AbstractArrow(pygame.sprite.Sprite):
     self.battle = song.battle
     self.secret = secret
 
-    # This (mainconfig lookup) is slow.
-    if mainconfig['assist'] == 2 and self.dir in ArrowSprite.samples:
+    assist = player.options.assist
+    if assist == 2 and self.dir in ArrowSprite.samples:
       self.sample = ArrowSprite.samples[self.dir]
-    elif mainconfig['assist']:
+    elif assist:
       self.sample = ArrowSprite.samples["d"]
     else: self.sample = None
 
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# Headless dance benchmark - plays charts with no display or sound, a song
+# clock that moves exactly one frame per frame, and autoplay input, and
+# reports how much CPU time and memory each frame took.
+
+import os
+import sys
+from getopt import getopt
+
+# These have to be set before pygame is initialized (by constants).
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from constants import *
+
+import gc
+import time
+import random
+import threading
+import pygame
+import games
+import steps
+import dance
+import util
+import replay
+
+from player import Player
+from fileparsers import SongItem
+from frameprof import percentile
+from songclock import SongClock
+
+try: import json
+except ImportError: json = None
+
+try: import resource
+except ImportError: resource = None
+
+# How long (in seconds) autoplay holds a tap arrow down.
+TAP_LENGTH = 0.05
+
+# Modifier sets for --sweep: a name, the game mode (None keeps the mode
+# given on the command line), and player option changes.
+MODIFIERS = [
+  ("normal", None, {}),
+  ("speed4", None, {"speed": 4.0}),
+  ("spin", None, {"spin": 1}),
+  ("hidden", None, {"fade": 2}),
+  ("noholds", None, {"holds": 0}),
+  ("versus", "VERSUS", {}),
+  ("double", "DOUBLE", {}),
+  ]
+
+def print_help():
+  print "Usage: %s [options] file-directory-or-replay ..." % sys.argv[0]
+  print " -h, --help         display this help text and exit"
+  print " -m, --mode         the mode to play in (default SINGLE)"
+  print " -d, --difficulty   the difficulty to play (default: the easiest)"
+  print " -r, --fps          frames per song second (default 60)"
+  print " -s, --sweep        play every chart with every modifier set"
+  print " -o, --output       write results here, one JSON object per line"
+  raise SystemExit
+
+# A song clock that moves forward exactly one frame each time it's
+# updated, so every run draws the same frames at the same song times.
+# It also measures the CPU time and allocations between updates.
+class BenchClock(SongClock):
+  def __init__(self, fps):
+    self.step = 1.0 / fps
+    SongClock.__init__(self)
+
+  def start(self, correction = 1.0):
+    SongClock.start(self, correction)
+    self.cpu = []
+    self.allocs = []
+    self.collections = 0
+    self._cpu = None
+
+  def update(self):
+    cpu = time.clock()
+    count = gc.get_count()[0]
+    if self._cpu is not None:
+      self.cpu.append((cpu - self._cpu) * 1000)
+      # The generation 0 count is reset when the collector runs.
+      if count >= self._count: self.allocs.append(count - self._count)
+      else:
+        self.allocs.append(count)
+        self.collections += 1
+    self._cpu, self._count = cpu, count
+    self._now = len(self.cpu) * self.step
+    return self._now
+
+# Song data that doesn't touch the mixer; the song ends when the steps
+# do, rather than when the music stops.
+class BenchSongData(steps.SongData):
+  def __init__(self, song, config, fps):
+    steps.SongData.__init__(self, song, config)
+    self.clock = BenchClock(fps)
+    self.length = 0
+    self.killed = False
+
+  def init(self): pass
+
+  def play(self):
+    self.clock.start()
+
+  def kill(self):
+    self.killed = True
+
+  def is_over(self):
+    now = self.clock.now()
+    return (self.killed or now > self.length or
+            (self.endat and now > self.endat))
+
+# Presses every arrow exactly on time, and holds every hold until it ends.
+class AutoPlay(object):
+  def __init__(self, players, game):
+    presses = {}
+    for plr in players:
+      if game.double:
+        pads = [(plr.pid * 2 + i, plr.steps[i]) for i in range(2)]
+      else: pads = [(plr.pid, plr.steps)]
+
+      for pad, stps in pads:
+        holds = {}
+        for d, start, end in stps.holdinfo: holds[(d, start)] = end
+        for ev in stps.events:
+          if not ev.feet: continue
+          for i, f in enumerate(ev.feet):
+            if not f & 3 or f & 4: continue
+            end = holds.get((i, ev.when)) or ev.when
+            presses.setdefault((pad, game.dirs[i]), []).append(
+              (ev.when, end + TAP_LENGTH))
+
+    self._events = []
+    for (pad, dir), times in presses.items():
+      times.sort()
+      for i, (start, end) in enumerate(times):
+        # Let go before the next arrow in the same direction.
+        if i + 1 < len(times): end = min(end, times[i + 1][0] - 0.001)
+        self._events.append((start, pad, dir))
+        self._events.append((end, pad, "-" + dir))
+    self._events.sort()
+    self._idx = 0
+
+  def due(self, time):
+    start = self._idx
+    while (self._idx < len(self._events) and
+           self._events[self._idx][0] <= time):
+      self._idx += 1
+    return self._events[start:self._idx]
+
+def peak_memory():
+  if resource is None: return None
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Play one chart, and return the results as a dictionary. If a replay
+# is given, its song, mode, options, and steps are used instead of
+# autoplay.
+def run(screen, fn, mode, difficulty, fps, name = "normal", options = {},
+        rep = None):
+  if rep: fn, mode = rep.filename, rep.mode
+  result = { "file": fn, "mode": mode, "modifiers": name, "fps": fps }
+  song = SongItem(fn)
+  if mode not in song.difficulty:
+    result["error"] = "no steps for this mode"
+    return result
+
+  game = games.GAMES[mode]
+  if rep:
+    diffs, configs, songconf = rep.difficulties, rep.players, rep.songconf
+    random.seed(rep.seed)
+  else:
+    if difficulty not in song.difficulty[mode]:
+      difficulty = song.diff_list[mode][0]
+    diffs = [difficulty] * game.players
+    config = dict(player_config)
+    config.update(options)
+    configs = [config] * game.players
+    songconf = dict(game_config)
+    random.seed(0)
+  result["difficulty"] = diffs
+  result["title"] = song.info["title"]
+
+  songdata = BenchSongData(song, songconf, fps)
+  players = []
+  for pid in range(game.players):
+    plr = Player(pid, configs[pid], songconf, game)
+    plr.set_song(song, diffs[pid], songdata.lyricdisplay)
+    players.append(plr)
+  songdata.length = max([plr.length for plr in players])
+
+  prevscr = pygame.Surface([640, 480])
+  gc.collect()
+  start = time.time()
+  dance.dance(screen, songdata, players, prevscr, False, game,
+              inputs = rep or AutoPlay(players, game))
+  wall = time.time() - start
+
+  clock = songdata.clock
+  cpu = sorted(clock.cpu)
+  result["frames"] = len(cpu)
+  result["wall_s"] = round(wall, 3)
+  if cpu:
+    result["cpu_ms_mean"] = round(sum(cpu) / len(cpu), 3)
+    for p in (50, 95, 99):
+      result["cpu_ms_p%d" % p] = round(percentile(cpu, p), 3)
+    result["cpu_ms_max"] = round(cpu[-1], 3)
+    result["allocs_mean"] = round(sum(clock.allocs) / float(len(cpu)), 1)
+  result["gc_collections"] = clock.collections
+  result["peak_rss_kb"] = peak_memory()
+  result["score"] = [plr.score.score for plr in players]
+  return result
+
+def write_result(out, result):
+  if json: out.write(json.dumps(result) + "\n")
+  else: out.write(repr(result) + "\n")
+  out.flush()
+
+def main():
+  mode = "SINGLE"
+  difficulty = None
+  fps = 60
+  sweep = False
+  out = sys.stdout
+  opts, args = getopt(sys.argv[1:], "hm:d:r:so:",
+                      ["help", "mode=", "difficulty=", "fps=", "sweep",
+                       "output="])
+  for opt, arg in opts:
+    if opt in ["-h", "--help"]: print_help()
+    elif opt in ["-m", "--mode"]: mode = arg
+    elif opt in ["-d", "--difficulty"]: difficulty = arg
+    elif opt in ["-r", "--fps"]: fps = int(arg)
+    elif opt in ["-s", "--sweep"]: sweep = True
+    elif opt in ["-o", "--output"]: out = file(arg, "w")
+  if not args: print_help()
+
+  files = []
+  for arg in args:
+    if os.path.isdir(arg):
+      found = util.find(arg, ['*.dance', '*.sm', '*.dwi', '*/song.*'], 1)
+      found.sort()
+      files.extend(found)
+    else: files.append(arg)
+
+  # Nothing here is saved, so the benchmark never changes the config.
+  mainconfig["maxfps"] = 0
+  mainconfig["fpsdisplay"] = 0
+  mainconfig["profile"] = 0
+  mainconfig["autofail"] = 0
+
+  screen = pygame.display.set_mode([640, 480], 0, 16)
+
+  # pygame's mixer calls into Python from the audio thread when a sound
+  # (like the announcer) stops, which aborts the interpreter unless
+  # Python threads have been set up. The game always starts a thread
+  # before then; this doesn't, so start one.
+  t = threading.Thread(target = lambda: None)
+  t.start()
+  t.join()
+
+  if sweep: modifiers = MODIFIERS
+  else: modifiers = MODIFIERS[:1]
+
+  for fn in files:
+    if fn.endswith(replay.EXTENSION):
+      try: result = run(screen, None, None, None, fps, "replay",
+                        rep = replay.Replay(fn))
+      except Exception, e:
+        result = { "file": fn, "modifiers": "replay", "error": str(e) }
+      write_result(out, result)
+      continue
+
+    for name, mod_mode, options in modifiers:
+      try:
+        result = run(screen, fn, mod_mode or mode, difficulty, fps,
+                     name, options)
+      except Exception, e:
+        result = { "file": fn, "modifiers": name, "error": str(e) }
+      write_result(out, result)
+
+  pygame.quit()
+
+if __name__ == '__main__': main()
@@ -0,0 +1,96 @@
+# Timed background changes. Songs can list background images to switch
+# to at given song times (a BACKGROUND section in .dance files, or
+# #BGCHANGES in .sm files). The images are loaded, scaled, and dimmed on
+# a separate thread ahead of when they're needed, as many as fit in
+# MEMORY_BUDGET, so switching backgrounds during the song is just a
+# blit.
+
+import threading
+import pygame
+
+from constants import *
+
+# The most memory (in bytes) spent on loaded background images.
+MEMORY_BUDGET = 24 * 1024 * 1024
+
+# Load an image and make it a finished 640x480 background, dimmed to
+# the given brightness (0 - 255).
+def prepare(filename, brightness):
+  img = pygame.image.load(filename)
+  if img.get_size() == (320, 240): img = pygame.transform.scale2x(img)
+  elif img.get_size() != (640, 480):
+    img = pygame.transform.scale(img, [640, 480])
+  img.set_alpha(brightness)
+  bg = pygame.Surface([640, 480])
+  bg.fill([0, 0, 0])
+  bg.blit(img, [0, 0])
+  return bg.convert()
+
+# changes is a list of (song time, filename) pairs, in time order.
+class BGTrack(threading.Thread):
+  def __init__(self, changes, brightness):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self._changes = changes
+    self._brightness = brightness
+    self._images = {} # filename -> prepared image
+    self._bad = set() # filenames that couldn't be loaded
+    self._idx = -1 # The change due now
+    self._shown = None # The filename of the background on the screen
+    self._running = True
+    self._event = threading.Event()
+    self.start()
+
+  # Load the images for the changes from the current one on, until the
+  # budget is full, and drop the ones that aren't needed anymore.
+  def run(self):
+    limit = None
+    while self._running:
+      upcoming = []
+      for t, fn in self._changes[max(0, self._idx):]:
+        if fn not in upcoming and fn not in self._bad: upcoming.append(fn)
+      if limit is not None: upcoming = upcoming[:limit]
+
+      for fn in self._images.keys():
+        if fn not in upcoming: del(self._images[fn])
+
+      for fn in upcoming:
+        if not self._running: break
+        if fn in self._images: continue
+        # Don't decode an image there's no room to keep.
+        if limit is not None and len(self._images) >= limit: break
+        try: img = prepare(fn, self._brightness)
+        except pygame.error:
+          self._bad.add(fn)
+          continue
+        if limit is None:
+          size = img.get_bytesize() * 640 * 480
+          limit = max(1, MEMORY_BUDGET / size)
+        self._images[fn] = img
+
+      # Wait until the song moves on to another change.
+      self._event.wait()
+      self._event.clear()
+
+  # Return the new background if one is due at the song time and has
+  # been loaded, or None if the background stays the same. An image
+  # that isn't loaded yet is shown once it is.
+  def update(self, time):
+    idx = self._idx
+    while idx + 1 < len(self._changes) and self._changes[idx + 1][0] <= time:
+      idx += 1
+    if idx != self._idx:
+      self._idx = idx
+      self._event.set()
+    if idx < 0: return None
+
+    fn = self._changes[idx][1]
+    if fn == self._shown: return None
+    img = self._images.get(fn)
+    if img is not None: self._shown = fn
+    return img
+
+  def stop(self):
+    self._running = False
+    self._event.set()
+    self.join()
@@ -0,0 +1,135 @@
+# Screenshots and gameplay recording. Encoding and writing an image is
+# far too slow to do between two frames of a song, so the screen is
+# only copied into a buffer here; a thread saves the buffers, as
+# numbered files in rc_path.
+#
+# Recording saves every Nth frame of a song. If the thread falls behind,
+# frames are dropped rather than making the dance wait.
+
+import os
+import threading
+import pygame
+
+from constants import *
+
+# Recorded frames waiting to be written before new ones are dropped.
+QUEUE_SIZE = 8
+
+# PNG if this pygame can write it, BMP if not.
+def _extension():
+  if pygame.image.get_extended(): return ".png"
+  else: return ".bmp"
+
+# The first number not used by a file (or directory) named
+# prefix + number + suffix in dir.
+def _next_number(dir, prefix, suffix = ""):
+  n = 0
+  for fn in os.listdir(dir):
+    if fn.startswith(prefix) and fn.endswith(suffix):
+      try: n = max(n, int(fn[len(prefix):len(fn) - len(suffix)]) + 1)
+      except ValueError: pass
+  return n
+
+class Writer(threading.Thread):
+  def __init__(self):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self._queue = [] # (buffer, filename)
+    self._free = [] # buffers that have been written, to reuse
+    self._lock = threading.Condition()
+    self._busy = False
+    self.start()
+
+  # Copy surface, and queue the copy to be saved to filename. If
+  # droppable and the queue is full, don't, and return False.
+  def save(self, surface, filename, droppable = False):
+    self._lock.acquire()
+    try:
+      if droppable and len(self._queue) >= QUEUE_SIZE: return False
+      buf = None
+      while self._free and buf is None:
+        buf = self._free.pop()
+        if buf.get_size() != surface.get_size(): buf = None
+    finally: self._lock.release()
+
+    if buf is None: buf = pygame.Surface(surface.get_size(), 0, surface)
+    buf.blit(surface, [0, 0])
+
+    self._lock.acquire()
+    self._queue.append((buf, filename))
+    self._lock.notify()
+    self._lock.release()
+    return True
+
+  # Wait until everything queued has been written.
+  def flush(self):
+    self._lock.acquire()
+    while self._queue or self._busy: self._lock.wait()
+    self._lock.release()
+
+  def run(self):
+    while True:
+      self._lock.acquire()
+      while not self._queue: self._lock.wait()
+      buf, fn = self._queue.pop(0)
+      self._busy = True
+      self._lock.release()
+
+      try: pygame.image.save(buf, fn)
+      except (pygame.error, IOError, OSError), e:
+        print _("W: Unable to write %s") % fn
+        print e
+
+      self._lock.acquire()
+      self._free.append(buf)
+      self._busy = False
+      self._lock.notifyAll()
+      self._lock.release()
+
+_writer = None
+
+def _get_writer():
+  global _writer
+  if _writer is None: _writer = Writer()
+  return _writer
+
+# The number of the next screenshot, or None until the first one. Shots
+# are numbered here rather than by what's on disk, since queued ones
+# haven't been written yet.
+_shot = None
+
+# Save a copy of surface as the next numbered screenshot.
+def screenshot(surface):
+  global _shot
+  ext = _extension()
+  if _shot is None: _shot = _next_number(rc_path, "screenshot-", ext)
+  fn = os.path.join(rc_path, "screenshot-%04d%s" % (_shot, ext))
+  _shot += 1
+  print _("Saving a screenshot to"), fn
+  _get_writer().save(surface, fn)
+
+# Saves every Nth frame of a song into a new numbered directory.
+class Recording(object):
+  def __init__(self, every):
+    self.every = max(1, every)
+    self.dir = os.path.join(rc_path, "recording-%04d" %
+                            _next_number(rc_path, "recording-"))
+    os.mkdir(self.dir)
+    self._ext = _extension()
+    self._frame = 0
+    self._saved = 0
+    self.dropped = 0
+    self._writer = _get_writer()
+    print _("Recording gameplay to"), self.dir
+
+  # Call once for every frame drawn.
+  def frame(self, surface):
+    if self._frame % self.every == 0:
+      fn = os.path.join(self.dir, "%06d%s" % (self._saved, self._ext))
+      if self._writer.save(surface, fn, True): self._saved += 1
+      else: self.dropped += 1
+    self._frame += 1
+
+# Write all the queued images, before exiting.
+def flush():
+  if _writer is not None: _writer.flush()
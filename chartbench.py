@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# Chart loading benchmark - writes a synthetic song library in every
+# format pydance reads, then times the metadata scan, the full parse,
+# compiling the steps, and the step transforms for each format.
+
+import os
+import sys
+import shutil
+import tempfile
+from getopt import getopt
+
+# These have to be set before pygame is initialized (by constants).
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from constants import *
+
+import time
+import random
+import games
+import steps
+import stepfilters
+
+from fileparsers import SongItem
+
+try: import json
+except ImportError: json = None
+
+FORMATS = ["dance", "dwi", "sm", "ksf"]
+
+# Difficulty names, easiest first, and the mode charts are written for.
+DIFFICULTIES = {
+  "dance": ["BEGINNER", "LIGHT", "STANDARD", "HEAVY", "CHALLENGE"],
+  "dwi": ["BEGINNER", "BASIC", "ANOTHER", "MANIAC", "SMANIAC"],
+  "sm": ["Beginner", "Easy", "Medium", "Hard", "Challenge"],
+  "ksf": ["easy", "normal", "hard", "crazy"],
+  }
+
+MODES = { "dance": "SINGLE", "dwi": "SINGLE", "sm": "SINGLE",
+          "ksf": "5PANEL" }
+
+# Transforms timed on every chart, by name. Like in steps.Steps, they're
+# given a fresh copy of the compressed steps; compress itself gets the
+# steps from the file.
+TRANSFORMS = [
+  ("compress", lambda s, song, mode, diff:
+   stepfilters.compress(song.steps[mode][diff])),
+  ("mirror", lambda s, song, mode, diff:
+   stepfilters.MirrorTransform(mode).transform(s)),
+  ("shuffle", lambda s, song, mode, diff:
+   stepfilters.ShuffleTransform(mode).transform(s)),
+  ("noholds", lambda s, song, mode, diff:
+   stepfilters.RemoveHoldTransform().transform(s)),
+  ("nojumps", lambda s, song, mode, diff:
+   stepfilters.RemoveJumps().transform(s)),
+  ("wide", lambda s, song, mode, diff:
+   stepfilters.WideTransform().transform(s)),
+  ("little", lambda s, song, mode, diff: stepfilters.size(s, 2)),
+  ("big", lambda s, song, mode, diff: stepfilters.size(s, 3)),
+  ("6panel", lambda s, song, mode, diff:
+   stepfilters.generate_mode(song, diff, "6PANEL", 0)),
+  ]
+
+def print_help():
+  print "Usage: %s [options]" % sys.argv[0]
+  print " -h, --help         display this help text and exit"
+  print " -n, --songs        songs per format (default 50)"
+  print " -d, --difficulties charts per song (default 4)"
+  print " -b, --beats        chart length in beats (default 400)"
+  print " -c, --bpm-changes  BPM changes per 100 beats (default 1)"
+  print " -s, --stops        stops per 100 beats (default 1)"
+  print " -l, --lyrics       lyrics per song (default 20)"
+  print " -f, --formats      formats to test (default dance,dwi,sm,ksf)"
+  print " -o, --output       write results here as JSON"
+  print " -k, --keep DIR     write the library to DIR, and keep it"
+  raise SystemExit
+
+# The options Steps needs from a Player.
+class ChartOptions(object):
+  def __init__(self, **opts):
+    self.__dict__.update(player_config)
+    self.target_bpm = None
+    self.secret_kind = game_config["secret"]
+    self.__dict__.update(opts)
+
+# A chart independent of any file format: rows of eighth notes, each
+# a list with 0 (nothing), 1 (tap), 2 (hold start), or 3 (hold end) for
+# each panel, and BPM changes and stops as (row, value) lists.
+class Chart(object):
+  def __init__(self, rand, panels, beats, density, bpm, changes, stops):
+    self.panels = panels
+    self.bpm = bpm
+    self.rows = []
+    holds = {}
+    for r in range(beats * 2):
+      row = [0] * panels
+      for p, end in holds.items():
+        if end == r:
+          row[p] = 3
+          del(holds[p])
+      if rand.random() < density:
+        free = [p for p in range(panels) if p not in holds and not row[p]]
+        if free:
+          count = min(len(free), rand.choice([1, 1, 1, 2]))
+          for p in rand.sample(free, count):
+            if rand.random() < 0.05:
+              row[p] = 2
+              holds[p] = r + rand.randint(2, 8)
+            else: row[p] = 1
+      self.rows.append(row)
+    for p in holds: self.rows[-1][p] = 3
+
+    self.changes = [(rand.randrange(len(self.rows)),
+                     float(rand.randint(80, 250)))
+                    for i in range(int(beats * changes / 100.0))]
+    self.changes.sort()
+    self.stops = [(rand.randrange(len(self.rows)),
+                   rand.choice([0.1, 0.25, 0.5, 1.0]))
+                  for i in range(int(beats * stops / 100.0))]
+    self.stops.sort()
+
+  # The BPM changes and stops after each row.
+  def commands(self):
+    cmds = {}
+    for r, bpm in self.changes: cmds.setdefault(r, []).append(("B", bpm))
+    for r, wait in self.stops: cmds.setdefault(r, []).append(("S", wait))
+    return cmds
+
+def write_lrc(fn, lyrics):
+  f = file(fn, "w")
+  for t, text in lyrics:
+    f.write("[%d:%05.2f]%s\n" % (t / 60, t % 60, text))
+  f.close()
+
+def write_dance(path, title, artist, charts, diffs, lyrics):
+  fn = os.path.join(path, "song.dance")
+  f = file(fn, "w")
+  f.write("filename music.ogg\ntitle %s\nartist %s\nbpm %.3f\nend\n" %
+          (title, artist, charts[0].bpm))
+  if lyrics:
+    f.write("LYRICS\n")
+    for t, text in lyrics: f.write("%.3f 1 %s\n" % (t, text))
+    f.write("end\n")
+  for i, (chart, diff) in enumerate(zip(charts, diffs)):
+    f.write("SINGLE\n%s %d\n" % (diff, i * 2 + 1))
+    cmds = chart.commands()
+    for r, row in enumerate(chart.rows):
+      f.write("e %s\n" % "".join([str([0, 1, 3, 1][s]) for s in row]))
+      for c, v in cmds.get(r, []): f.write("%s %.3f\n" % (c, v))
+    f.write("end\n")
+  f.close()
+  return fn
+
+# DWI arrows for single and double panels, in left-down-up-right order.
+DWI_ARROWS = "4286"
+DWI_JUMPS = { (0, 1): "1", (0, 2): "7", (0, 3): "B", (1, 2): "A",
+              (1, 3): "3", (2, 3): "9" }
+
+def dwi_row(row):
+  taps = [p for p, s in enumerate(row) if s in (1, 3)]
+  holds = [p for p, s in enumerate(row) if s == 2]
+  if not taps and not holds: return "0"
+  elif not holds and len(taps) == 1: return DWI_ARROWS[taps[0]]
+  elif not holds and len(taps) == 2: return DWI_JUMPS[tuple(taps)]
+  else:
+    return "<%s>" % "".join([("!" * (p in holds)) + DWI_ARROWS[p]
+                             for p in taps + holds])
+
+def write_dwi(path, title, artist, charts, diffs, lyrics):
+  fn = os.path.join(path, "song.dwi")
+  f = file(fn, "w")
+  chart = charts[0]
+  f.write("#TITLE:%s;\n#ARTIST:%s;\n#BPM:%.3f;\n#GAP:0;\n" %
+          (title, artist, chart.bpm))
+  # DWI counts in sixteenths, and the rows are eighths.
+  if chart.changes:
+    f.write("#CHANGEBPM:%s;\n" % ",".join(["%d=%.3f" % (r * 2, b)
+                                           for r, b in chart.changes]))
+  if chart.stops:
+    f.write("#FREEZE:%s;\n" % ",".join(["%d=%d" % (r * 2, w * 1000)
+                                        for r, w in chart.stops]))
+  for i, (chart, diff) in enumerate(zip(charts, diffs)):
+    data = "".join([dwi_row(row) for row in chart.rows])
+    lines = [data[j:j + 64] for j in range(0, len(data), 64)]
+    f.write("#SINGLE:%s:%d:\n%s;\n" % (diff, i * 2 + 1, "\n".join(lines)))
+  f.close()
+  if lyrics: write_lrc(os.path.join(path, "song.lrc"), lyrics)
+  return fn
+
+def write_sm(path, title, artist, charts, diffs, lyrics):
+  fn = os.path.join(path, "song.sm")
+  f = file(fn, "w")
+  chart = charts[0]
+  bpms = [(0, chart.bpm)] + chart.changes
+  f.write("#TITLE:%s;\n#ARTIST:%s;\n#MUSIC:music.ogg;\n#OFFSET:0.000;\n" %
+          (title, artist))
+  # Stepmania counts in beats, and the rows are eighths.
+  f.write("#BPMS:%s;\n" % ",".join(["%.3f=%.3f" % (r / 2.0, b)
+                                    for r, b in bpms]))
+  f.write("#STOPS:%s;\n" % ",".join(["%.3f=%.3f" % (r / 2.0, w)
+                                     for r, w in chart.stops]))
+  for i, (chart, diff) in enumerate(zip(charts, diffs)):
+    f.write("#NOTES:\n     dance-single:\n     :\n     %s:\n     %d:\n"
+            "     0,0,0,0,0:\n" % (diff, i * 2 + 1))
+    rows = ["".join([str(s) for s in row]) for row in chart.rows]
+    while len(rows) % 8: rows.append("0" * chart.panels)
+    measures = ["\n".join(rows[j:j + 8]) for j in range(0, len(rows), 8)]
+    f.write("\n,\n".join(measures) + "\n;\n")
+  f.close()
+  if lyrics: write_lrc(os.path.join(path, "song.lrc"), lyrics)
+  return fn
+
+# KSF has one file per chart, and no BPM changes or stops.
+def write_ksf(path, title, artist, charts, diffs, lyrics):
+  for chart, diff in zip(charts, diffs):
+    f = file(os.path.join(path, "%s_1.ksf" % diff), "w")
+    f.write("#TITLE:%s - %s;\n#BPM:%.3f;\n#TICKCOUNT:2;\n#STARTTIME:0;\n"
+            "#STEP:\n" % (artist, title, chart.bpm))
+    # Holds are a run of 4s; the first 0 after them ends the hold.
+    holding = [False] * chart.panels
+    for row in chart.rows:
+      out = []
+      for p, s in enumerate(row):
+        if s == 2: holding[p] = True
+        elif s == 3: holding[p] = False
+        if holding[p]: out.append("4")
+        elif s == 1: out.append("1")
+        else: out.append("0")
+      f.write("".join(out) + "0" * (13 - chart.panels) + "\n")
+    f.write("2" * 13 + "\n")
+    f.close()
+  file(os.path.join(path, "song.ogg"), "w").close()
+  return os.path.join(path, "song.ogg")
+
+WRITERS = { "dance": write_dance, "dwi": write_dwi, "sm": write_sm,
+            "ksf": write_ksf }
+
+# Write a synthetic library to root, and return the step file names for
+# each format.
+def generate(root, fmts, songs, ndiffs, beats, changes, stops, nlyrics,
+             seed = 0):
+  rand = random.Random(seed)
+  files = {}
+  for fmt in fmts:
+    files[fmt] = []
+    panels = len(games.GAMES[MODES[fmt]].dirs)
+    diffs = DIFFICULTIES[fmt][:ndiffs]
+    for i in range(songs):
+      path = os.path.join(root, fmt, "song%04d" % i)
+      os.makedirs(path)
+      file(os.path.join(path, "music.ogg"), "w").close()
+      bpm = float(rand.randint(80, 250))
+      charts = [Chart(rand, panels, beats, 0.2 + 0.15 * d, bpm,
+                      changes, stops) for d in range(len(diffs))]
+      length = beats * 60.0 / bpm
+      lyrics = [(length * j / max(1, nlyrics), "Lyric line %d" % j)
+                for j in range(nlyrics)]
+      files[fmt].append(WRITERS[fmt](path, "Song %d" % i,
+                                     "Artist %d" % (i % 17), charts, diffs,
+                                     lyrics))
+  return files
+
+# Call f on each item, and return (seconds, results).
+def timed(f, items):
+  start = time.time()
+  results = [f(x) for x in items]
+  return time.time() - start, results
+
+def stage(name, seconds, count, unit):
+  r = { "stage": name, "seconds": round(seconds, 4), "count": count,
+        "unit": unit }
+  if seconds > 0: r["per_second"] = round(count / seconds, 1)
+  if count: r["ms_each"] = round(seconds * 1000 / count, 3)
+  return r
+
+def bench_format(fmt, fns):
+  results = []
+  mode = MODES[fmt]
+
+  t, songs = timed(lambda fn: SongItem(fn, False), fns)
+  results.append(stage("scan", t, len(fns), "songs"))
+
+  t, songs = timed(lambda fn: SongItem(fn, True), fns)
+  results.append(stage("parse", t, len(fns), "songs"))
+
+  charts = [(song, diff) for song in songs for diff in song.diff_list[mode]]
+  rows = sum([len(song.steps[mode][diff]) for song, diff in charts])
+  opts = ChartOptions()
+  random.seed(0)
+  t, compiled = timed(lambda (song, diff):
+                      steps.Steps(song, diff, opts, 0, None, mode, 0),
+                      charts)
+  results.append(stage("compile", t, len(charts), "charts"))
+  events = sum([len(s.events) for s in compiled])
+  results.append(stage("compile", t, events, "events"))
+
+  compressed = [stepfilters.compress([list(s) for s in song.steps[mode][diff]])
+                for song, diff in charts]
+  for name, T in TRANSFORMS:
+    inputs = [(song, diff, [list(s) for s in c])
+              for (song, diff), c in zip(charts, compressed)]
+    t, dummy = timed(lambda (song, diff, s): T(s, song, mode, diff), inputs)
+    results.append(stage("transform:" + name, t, rows, "rows"))
+
+  for r in results: r["format"] = fmt
+  return results
+
+def report(results):
+  print "%-6s %-18s %9s %8s %-7s %11s %9s" % (
+    "format", "stage", "seconds", "count", "unit", "per second", "ms each")
+  for r in results:
+    print "%-6s %-18s %9.3f %8d %-7s %11.1f %9.3f" % (
+      r["format"], r["stage"], r["seconds"], r["count"], r["unit"],
+      r.get("per_second", 0), r.get("ms_each", 0))
+
+def main():
+  songs, ndiffs, beats, changes, stops, nlyrics = 50, 4, 400, 1, 1, 20
+  fmts = FORMATS
+  out = None
+  keep = None
+  opts, args = getopt(sys.argv[1:], "hn:d:b:c:s:l:f:o:k:",
+                      ["help", "songs=", "difficulties=", "beats=",
+                       "bpm-changes=", "stops=", "lyrics=", "formats=",
+                       "output=", "keep="])
+  for opt, arg in opts:
+    if opt in ["-h", "--help"]: print_help()
+    elif opt in ["-n", "--songs"]: songs = int(arg)
+    elif opt in ["-d", "--difficulties"]: ndiffs = int(arg)
+    elif opt in ["-b", "--beats"]: beats = int(arg)
+    elif opt in ["-c", "--bpm-changes"]: changes = float(arg)
+    elif opt in ["-s", "--stops"]: stops = float(arg)
+    elif opt in ["-l", "--lyrics"]: nlyrics = int(arg)
+    elif opt in ["-f", "--formats"]: fmts = arg.split(",")
+    elif opt in ["-o", "--output"]: out = arg
+    elif opt in ["-k", "--keep"]: keep = arg
+
+  root = keep or tempfile.mkdtemp(prefix = "pydance-charts-")
+  try:
+    start = time.time()
+    files = generate(root, fmts, songs, ndiffs, beats, changes, stops,
+                     nlyrics)
+    print "Wrote %d songs in %.2f seconds." % (songs * len(fmts),
+                                               time.time() - start)
+    results = []
+    for fmt in fmts: results.extend(bench_format(fmt, files[fmt]))
+  finally:
+    if not keep: shutil.rmtree(root, True)
+
+  report(results)
+  if out:
+    f = file(out, "w")
+    if json: json.dump(results, f, indent = 1)
+    else: f.write(repr(results))
+    f.close()
+
+if __name__ == '__main__': main()
@@ -1,6 +1,8 @@
 # A generic configuration file parser
 
 import os
+import re
+import persist
 
 # master vs user:
 # the 'user' hash (~/.foorc) overrides the master hash (/etc/foorc),
@@ -37,6 +39,9 @@ class Config(object):
     if key in self.user: return self.user[key]
     else: return self.master.get(key, value)
 
+  def keys(self):
+    return list(set(self.master.keys()) | set(self.user.keys()))
+
   # Update the config data with a 'key value' filename.
   # If should_exist is true, raise exceptions if the file doesn't exist.
   # Otherwise, we silently ignore it.
@@ -61,12 +66,60 @@ class Config(object):
 
     fi.close()
 
+  # The file contents, with the values in the overrides dicts replacing
+  # the user ones.
+  def dump(self, *overrides):
+    user = dict(self.user)
+    for d in overrides: user.update(d)
+    keys = user.keys()
+    keys.sort()
+    lines = []
+    for key in keys:
+      if key not in self.master or self.master[key] != user[key]:
+        lines.append("%s %s\n" % (key, user[key]))
+    return "".join(lines)
+
   # Write the filename back out to disk.
   def write(self, filename):
-    fi = file(filename, "w")
-    keys = self.user.keys()
+    persist.atomic_write(filename, self.dump())
+
+  # Like write, but done soon by a background thread.
+  def save(self, filename, *overrides):
+    persist.save(filename, self.dump(*overrides))
+
+# A read-only snapshot of configuration values (Configs or dicts, later
+# ones overriding earlier ones), read as attributes - opts.assist rather
+# than mainconfig["assist"]. Looking things up in a Config checks two
+# dicts every time, so code that runs during a song takes a snapshot
+# when the song starts and reads that instead. '-' in keys becomes '_'.
+class Options(object):
+  __slots__ = ()
+  _classes = {} # sorted key tuple -> Options subclass with those slots
+
+  def __new__(cls, *sources):
+    values = {}
+    for src in sources:
+      for k in src.keys():
+        name = k.replace("-", "_")
+        if _identifier.match(name): values[name] = src[k]
+    keys = values.keys()
     keys.sort()
-    for key in keys:
-      if key not in self.master or self.master[key] != self.user[key]:
-        fi.write("%s %s\n" % (key, self.user[key]))
-    fi.close()
+    keys = tuple(keys)
+    klass = Options._classes.get(keys)
+    if klass is None:
+      klass = type("Options", (Options,), { "__slots__": keys })
+      Options._classes[keys] = klass
+    self = object.__new__(klass)
+    for k, v in values.items(): object.__setattr__(self, k, v)
+    return self
+
+  def get(self, key, value = None):
+    return getattr(self, key.replace("-", "_"), value)
+
+  def __setattr__(self, key, value):
+    raise AttributeError("options are read-only")
+
+  def __delattr__(self, key):
+    raise AttributeError("options are read-only")
+
+_identifier = re.compile("[A-Za-z_][A-Za-z0-9_]*$")
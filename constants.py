@@ -88,6 +88,7 @@ default_conf = {
   "stickycombo": 1,  "lowestcombo": 4, "stickyjudge": 1,
   "lyriccolor": "cyan/aqua",
   "onboardaudio": 0, "masteroffset": 0,
+  "audiorate": 48000.0 / 44128.0, # Clock correction if onboardaudio is on
   "explodestyle": 3, "vesacompat": 0, "fullscreen": 0,
   "sortmode": 0,
   "folders": 1,
@@ -95,7 +96,11 @@ default_conf = {
   "showbackground": 1, "bgbrightness": 127,
   "gratuitous": 1,
   "assist": 0,
-  "fpsdisplay": 1, "showlyrics": 1,
+  "fpsdisplay": 1, "showlyrics": 1, "maxfps": 120,
+  "inputrate": 1000, # times per second input is read while a frame waits
+  "savereplays": 0,
+  "recordframes": 0, # save every Nth frame while dancing, 0 is off
+  "profile": 0, # 1 saves frame timings for each song, 2 also shows them
   "showcombo": 1,
   "autofail": 1,
   "animation": 1,
@@ -158,6 +163,12 @@ game_config = dict([(k, mainconfig[k]) for k in
                     ["battle", "scoring", "combo", "grade", "judge",
                      "judgescale", "life", "secret", "lifebar", "onilives", "audiosync"]])
 
+# Queue the config, with the current game and player options, to be
+# saved to rc_path/pydance.cfg.
+def save_config():
+  mainconfig.save(os.path.join(rc_path, "pydance.cfg"),
+                  game_config, player_config)
+
 
 # The list of options that are safe to change between songs on a
 # playlist
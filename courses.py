@@ -26,6 +26,9 @@ class AbstractCourse(object):
     self.all_songs = all_songs
     self.recordkeys = recordkeys
     self.past_songs = []
+    # If true, error messages are kept in held_error rather than shown.
+    self.hold_errors = False
+    self.held_error = None
 
   def __len__(self): return len(self.songs)
 
@@ -43,6 +46,11 @@ class AbstractCourse(object):
     self.screen = self.player_configs = self.game_config = None
 
 
+  # Show an error message, or keep it to be shown later.
+  def _error(self, message):
+    if self.hold_errors: self.held_error = message
+    else: error.ErrorMessage(self.screen, message)
+
   # Sometimes we have a strange difficulty, like player's worst or a
   # range, or totally random. This checks if the song contains the
   # proper difficulty.
@@ -116,7 +124,7 @@ class AbstractCourse(object):
         if folder in self.all_songs:
           songs = [s for s in self.all_songs[folder].values() if (s,diff) not in self.past_songs]
         else:
-          error.ErrorMessage(self.screen, folder + _(" was not found."))
+          self._error(folder + _(" was not found."))
           raise StopIteration
 
       else:
@@ -127,7 +135,7 @@ class AbstractCourse(object):
       songs = [s for s in songs if (s,diff) not in self.past_songs and self._find_difficulty(s, diff)]
 
       if len(songs) == 0:
-        error.ErrorMessage(self.screen, _("No valid songs were found."))
+        self._error(_("No valid songs were found."))
         raise StopIteration
       else:
         song = random.choice(songs)
@@ -156,7 +164,7 @@ class AbstractCourse(object):
     if not fullname:
       if len(name[0]) > 1:
         name = _("Player's %s #%d") % (name[0].capitalize(), name[1])
-      error.ErrorMessage(self.screen, name + _("was not found."))
+      self._error(name + _("was not found."))
       raise StopIteration
 
     self.index += 1
@@ -234,8 +234,7 @@ class CourseSelector(InterfaceWindow):
     self._banner = ImageDisplay(self._course.banner, [373, 56])
     self._sprites.add([self._list, self._list_gfx, self._title,
                        self._coursetitle, self._banner])
-    self._screen.blit(self._bg, [0, 0])
-    pygame.display.update()
+    self.redraw()
     self.loop()
     music.fadeout(500)
     pygame.time.wait(500)
@@ -295,9 +294,8 @@ class CourseSelector(InterfaceWindow):
 
       elif ev == ui.OPTIONS:
         opts = options.OptionScreen(self._configs, self._config, self._screen)
-        self._screen.blit(self._bg, [0, 0])
+        self.redraw()
         self.update()
-        pygame.display.update()
         if opts.start_dancing:
           ev = ui.CONFIRM
           continue
@@ -315,8 +313,7 @@ class CourseSelector(InterfaceWindow):
                      self._config, self._game)
           course.done()
           music.fadeout(500) # The just-played song
-          self._screen.blit(self._bg, [0, 0])
-          pygame.display.update()
+          self.redraw()
           ui.ui.clear()
 
       elif ev == ui.CANCEL:
@@ -22,35 +22,203 @@ import records
 import ui
 import options
 import locale
+import songindex
+import frameprof
+import replay
+import bgchange
+import capture
 
 import os
+import sys
+import random
+import threading
 
 from fonttheme import FontTheme
 
+# The pause (in ms) between the end of one song and the start of the
+# next one, when there's no song info screen in between.
+SONG_GAP = 1000
+
+# How long (in ms) the fade from the previous screen to the song
+# background takes.
+FADE_TIME = 250
+
+# Judging runs at this many ticks per second, independent of the frame
+# rate. If drawing falls more than MAX_LOGIC_TICKS behind, the missed
+# ticks are skipped rather than run all at once.
+LOGIC_RATE = 200
+LOGIC_STEP = 1.0 / LOGIC_RATE
+MAX_LOGIC_TICKS = 20
+
+# Save the frame profile for a song, listing each player's modifiers.
+# The song only ends partway through a frame, so that's finished first.
+def dump_profile(prof, song, players, songtime):
+  prof.finish(songtime)
+  mods = []
+  for plr in players:
+    opts = ["%s %s" % (k, getattr(plr, k)) for k in sorted(player_config)]
+    mods.append("Player %d: %s" % (plr.pid + 1, ", ".join(opts)))
+  fn = prof.dump(song.title, "\n".join(mods))
+  print _("Saving a frame profile to"), fn
+
+# Load a song background and scale it to the screen size.
+def load_background(filename):
+  bg = pygame.image.load(filename)
+  if bg.get_size() == (320, 240): return pygame.transform.scale2x(bg)
+  else: return pygame.transform.scale(bg, [640, 480])
+
+# Parse a song (with its steps) and load its background in a separate
+# thread, so that it happens while the song info screen is up rather
+# than after it. Anything that draws or renders text stays in the main
+# thread, since SDL's video and font code isn't thread-safe.
+class SongLoader(threading.Thread):
+  def __init__(self, filename):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.filename = filename
+    self.song = None
+    self.background = None
+    self.bgtrack = None
+    self._exc_info = None
+    self.start()
+
+  def run(self):
+    try:
+      self.song = fileparsers.SongItem(self.filename)
+      if (mainconfig['showbackground'] > 0 and
+          self.song.info["movie"] is None):
+        if self.song.info["background"]:
+          self.background = load_background(self.song.info["background"])
+        else:
+          self.background = load_background(os.path.join(image_path,
+                                                         "bg.png"))
+        if self.song.bgchanges:
+          self.bgtrack = bgchange.BGTrack(self.song.bgchanges,
+                                          mainconfig['bgbrightness'])
+    except:
+      self._exc_info = sys.exc_info()
+
+  # Wait for the song to finish loading and return it. Errors raised
+  # while loading are raised again here.
+  def get(self):
+    self.join()
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self.song
+
+  # Stop the background change thread and drop its images, once the song
+  # has been played or won't be.
+  def stop(self):
+    self.join()
+    if self.bgtrack: self.bgtrack.stop()
+
+# Iterate over a playlist one song ahead; prefetch() finds the next song
+# and starts loading it, so it can be done while the current song plays.
+# Course and endless playlists hold back error messages while finding
+# songs, and they're shown when the song would have been needed.
+class PlaylistPrefetcher(object):
+  def __init__(self, playlist, screen):
+    self._playlist = playlist
+    self._iter = iter(playlist)
+    self._screen = screen
+    self._next = None
+    self._done = False
+    if hasattr(playlist, "hold_errors"): playlist.hold_errors = True
+
+  def __iter__(self): return self
+
+  def prefetch(self):
+    if self._next is None and not self._done:
+      try:
+        songfn, diff = self._iter.next()
+        self._next = (songfn, diff, SongLoader(songfn))
+      except StopIteration:
+        self._done = True
+
+  def next(self):
+    self.prefetch()
+    if self._next is None:
+      if getattr(self._playlist, "held_error", None):
+        error.ErrorMessage(self._screen, self._playlist.held_error)
+        self._playlist.held_error = None
+      raise StopIteration
+    entry = self._next
+    self._next = None
+    return entry
+
+  # Drop the song loaded ahead, if there is one.
+  def stop(self):
+    if self._next is not None:
+      self._next[2].stop()
+      self._next = None
+
 # A simple movie-playing sprite. It can only do MPEG1 though.
-class BGMovie(pygame.sprite.Sprite):
+# Frames per second of background movies.
+MOVIE_FPS = 29.97
+
+# Number of movie frames decoded ahead of the song.
+MOVIE_FRAMES = 3
+
+# A background movie, decoded on its own thread into a few spare frames
+# so decoding never holds up the dance loop. If the decoder falls behind
+# the song, it skips ahead rather than showing old frames.
+class BGMovie(threading.Thread):
   def __init__ (self, filename):
-    pygame.sprite.Sprite.__init__(self)
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
     self.filename = filename
-    self.image = pygame.surface.Surface([640, 480])
-    
     self.movie = pygame.movie.Movie(filename)
-    self.movie.set_display(self.image,[[0, 0], [640, 480]])
-    self.rect = self.image.get_rect()
-    self.rect.top = 0
-    self.rect.left = 0
-    self.oldframe = -1
-    self.changed = False
-    
-  def resetchange(self):
-    self.changed = False
-
-  def update(self,curtime):
-    curframe = int(curtime * 29.97)
-    if self.oldframe != curframe:
-      self.changed = True
-      self.movie.render_frame(curframe)
-      self.oldframe = curframe
+    self.image = pygame.Surface([640, 480]) # The frame being shown
+    self.dropped = 0
+    self._free = [pygame.Surface([640, 480]) for i in range(MOVIE_FRAMES)]
+    self._ready = [] # (frame number, surface), oldest first
+    self._wanted = 0
+    self._running = True
+    self._lock = threading.Lock()
+    self.start()
+
+  def run(self):
+    next = 0
+    while self._running:
+      self._lock.acquire()
+      wanted = self._wanted
+      if self._free: surface = self._free.pop()
+      else: surface = None
+      self._lock.release()
+
+      if surface is None:
+        pygame.time.wait(2)
+        continue
+
+      if next < wanted:
+        self.dropped += wanted - next
+        next = wanted
+      self.movie.set_display(surface, [[0, 0], [640, 480]])
+      self.movie.render_frame(next)
+
+      self._lock.acquire()
+      self._ready.append((next, surface))
+      self._lock.release()
+      next += 1
+
+  # Switch to the newest decoded frame due at the song time, and return
+  # True if there was one.
+  def update(self, curtime):
+    frame = int(curtime * MOVIE_FPS)
+    self._lock.acquire()
+    self._wanted = frame
+    due = [r for r in self._ready if r[0] <= frame]
+    if due:
+      self._free.append(self.image)
+      for r in due[:-1]: self._free.append(r[1])
+      self.image = due[-1][1]
+      self._ready = self._ready[len(due):]
+    self._lock.release()
+    return bool(due)
+
+  def stop(self):
+    self._running = False
+    self.join()
 
 # Display the current FPS and store the average FPS for the song.
 class FPSDisp(pygame.sprite.Sprite):
@@ -249,8 +417,7 @@ class SongInfoScreen(InterfaceWindow):
           self._player_opts[pid].set_text(self.opt_summary(pid))
           
         self.end = pygame.time.get_ticks() + 11000
-        self._screen.blit(self._bg, [0, 0])
-        pygame.display.update()
+        self.redraw()
         self.update()
         if opts.start_dancing:
           ev = ui.CONFIRM
@@ -294,7 +461,8 @@ class SongInfoScreen(InterfaceWindow):
       
       
 # Run through a playlist of songs and play each one until people quit.
-def play(screen, playlist, configs, songconf, playmode):
+# If a replay.Replay is given, it plays the steps instead of the players.
+def play(screen, playlist, configs, songconf, playmode, rep = None):
   numplayers = len(configs)
 
   game = games.GAMES[playmode]
@@ -314,42 +482,78 @@ def play(screen, playlist, configs, songconf, playmode):
     plr = Player(playerID, configs[playerID], songconf, game)
     players.append(plr)
 
-  for songfn, diff in playlist:
-    try: current_song = fileparsers.SongItem(songfn)
-    except None:
-      error.ErrorMessage(screen, _("There was an error loading ") +
-                         os.path.split(songfn)[1])
-      first = True
-      continue
-
+  last_end = None
+  entries = PlaylistPrefetcher(playlist, screen)
+  for songfn, diff, loader in entries:
     songs_played += 1
     prevscr = pygame.transform.scale(screen, (640,480))
-    songdata = steps.SongData(current_song, songconf)
 
     if display_songinfo:
-      if not SongInfoScreen(current_song, diff, playmode, songconf,
-                            configs, screen).proceed_to_song: break
+      # The info screen only needs what's in the song library, so it can
+      # be shown while the full song is still loading.
+      info_song = None
+      if songindex.library: info_song = songindex.library.song(songfn)
+      if info_song is None: info_song = loader.get()
+      proceed = SongInfoScreen(info_song, diff, playmode, songconf,
+                               configs, screen).proceed_to_song
+      current_song = loader.get()
+      songdata = steps.SongData(current_song, songconf)
+      if not proceed:
+        loader.stop()
+        break
       for playerID in range(numplayers):
         for opt, dummy in changeable_between:
           players[playerID].__dict__[opt] = configs[playerID][opt]
+    else:
+      current_song = loader.get()
+      songdata = steps.SongData(current_song, songconf)
+
+    # Shuffled and random steps depend on the seed, so replays save it.
+    if rep: seed = rep.seed
+    else: seed = random.randrange(1 << 30)
+    random.seed(seed)
 
     for pid, player in enumerate(players):
       player.set_song(current_song, diff[pid], songdata.lyricdisplay)
 
+    recorder = None
+    if rep: rep.rewind()
+    elif mainconfig["savereplays"]:
+      recorder = replay.Recorder(songfn, songdata.title, playmode, diff,
+                                 configs, songconf, seed)
+
     print _("Playing"), songfn
     print songdata.title.encode(STDOUT_ENCODING, "replace"), "by",
     print songdata.artist.encode(STDOUT_ENCODING, "replace")
 
-    if dance(screen, songdata, players, prevscr, first, game):
+    # Load the next song while this one is playing.
+    entries.prefetch()
+
+    if last_end is not None and not display_songinfo:
+      pygame.time.wait(max(0, last_end + SONG_GAP - pygame.time.get_ticks()))
+
+    failed = dance(screen, songdata, players, prevscr, first, game,
+                   loader.background, rep, recorder, loader.bgtrack)
+    loader.stop()
+    if recorder:
+      print _("Saving a replay to"), recorder.save()
+    if failed:
       first = False
       break # Failed
     first = False
+    last_end = pygame.time.get_ticks()
     if True in [p.escaped for p in players]:
       break
 
+  # The next song may have been loaded already, but it won't be played.
+  entries.stop()
+
   if mainconfig['grading'] and not first and songdata:
     grade = gradescreen.GradingScreen(screen, players, songdata.banner)
 
+  # Replays don't calibrate anything or set records.
+  if rep: return
+
   if songconf["audiosync"] == 2:
     old_offset = mainconfig["masteroffset"]
     new_offset = old_offset + players[0].stats.offset()
@@ -358,6 +562,13 @@ def play(screen, playlist, configs, songconf, playmode):
     # plays and avoid messing up the value based on a single "bad" play.
     mainconfig["masteroffset"] = (old_offset*2 + new_offset) // 3
 
+    # Steps getting steadily later or earlier through the song mean the
+    # sound card plays at a different rate than the song clock assumes.
+    drift = players[0].stats.drift()
+    if mainconfig["onboardaudio"] and drift is not None:
+      old_rate = mainconfig["audiorate"]
+      mainconfig["audiorate"] = (old_rate * 2 + old_rate * (1 + drift)) / 3
+
   # If we only play one song (all the way through), then it's safe to enter
   # a grade. This means course grades are going to get kind of messy,
   # and have to be handled by the course stuff rather than here.
@@ -370,8 +581,19 @@ def play(screen, playlist, configs, songconf, playmode):
         records.add(current_song.info["recordkey"], diff[p.pid],
                     playmode, -2, " ")
 
-def dance(screen, song, players, prevscr, ready_go, game):
+  records.save()
+  save_config()
+
+# bgimage is the song background, already loaded and scaled; it's
+# loaded here if it's None. inputs, if given, makes the steps instead of
+# the players: inputs.due(time) returns a list of (time, pad, direction)
+# tuples due by that song time, with the direction prefixed by "-" for
+# releases. recorder, if given, gets every step made. bgtrack is a
+# bgchange.BGTrack of timed background changes.
+def dance(screen, song, players, prevscr, ready_go, game, bgimage = None,
+          inputs = None, recorder = None, bgtrack = None):
   songFailed = False
+  opts = song.options
 
   # text group, e.g. judgings and combos
   tgroup =  RenderUpdates()
@@ -392,20 +614,18 @@ def dance(screen, song, players, prevscr, ready_go, game):
     ready_go_time = min(100, *[plr.ready for plr in players])
     tgroup.add(ReadyGoSprite(ready_go_time))
   
-  if mainconfig['showbackground'] > 0:
+  if opts.showbackground > 0:
     if backmovie is None:
-      bgkludge = pygame.image.load(song.background).convert()
-      bgkrect = bgkludge.get_rect()
-      if (bgkrect.size[0] == 320) and (bgkrect.size[1] == 240):
-        bgkludge = pygame.transform.scale2x(bgkludge)
-      else:
-        bgkludge = pygame.transform.scale(bgkludge, [640, 480])
-      bgkludge.set_alpha(mainconfig['bgbrightness'], RLEACCEL)
+      if bgimage is None: bgimage = load_background(song.background)
+      bgkludge = bgimage.convert()
+      bgkludge.set_alpha(opts.bgbrightness, RLEACCEL)
       
-      q = mainconfig['bgbrightness'] / 256.0
-      # FIXME
-      for i in range(0, 101, 5):
-        p = i / 100.0
+      q = opts.bgbrightness / 256.0
+      # The fade takes FADE_TIME no matter how fast the screen updates.
+      start = pygame.time.get_ticks()
+      p = 0
+      while p < 1:
+        p = min(1, (pygame.time.get_ticks() - start) / float(FADE_TIME))
         prevscr.set_alpha(256 * (1 - p) * q, RLEACCEL)
         screen.fill(colors.BLACK)
         screen.blit(prevscr, [0, 0])
@@ -419,15 +639,21 @@ def dance(screen, song, players, prevscr, ready_go, game):
   else:
     pygame.display.update()
 
-  if mainconfig["strobe"]: tgroup.add(Blinky(song.bpm))
+  if opts.strobe: tgroup.add(Blinky(song.bpm))
 
-  if mainconfig["fpsdisplay"]:
+  if opts.fpsdisplay:
     fpstext = FPSDisp()
     timewatch = TimeDisp()
     tgroup.add([fpstext, timewatch])
   else: fpstext = None
 
-  if mainconfig['showlyrics']:
+  if opts.profile:
+    prof = frameprof.FrameProfiler()
+    if opts.profile == 2:
+      tgroup.add(frameprof.ProfileDisplay(prof))
+  else: prof = None
+
+  if opts.showlyrics:
     lgroup.add(song.lyricdisplay.channels())
 
   fontfn, basesize = FontTheme.Dance_title_artist
@@ -444,20 +670,32 @@ def dance(screen, song, players, prevscr, ready_go, game):
   if song.crapout != 0:
     error.ErrorMessage(screen, _("The audio file for this song ") +
                        song.filename + _(" could not be found."))
+    if backmovie: backmovie.stop()
+    if bgtrack: bgtrack.stop()
     return False # The player didn't fail.
 
-  if mainconfig['assist']: music.set_volume(0.6)
+  if opts.assist: music.set_volume(0.6)
   else: music.set_volume(1.0)
 
   song.play()
   for plr in players: plr.start_song()
 
-  autofail = mainconfig['autofail']
+  autofail = opts.autofail
 
   screenshot = False
   ui.ui.clear()
 
+  logic_time = 0.0
+  compositor = FrameCompositor(screen, background)
+  maxfps = opts.maxfps
+  if opts.recordframes: recording = capture.Recording(opts.recordframes)
+  else: recording = None
+  sampler = ui.InputSampler(song.clock)
+  next_frame = pygame.time.get_ticks()
+
   while True:
+    if prof: prof.start()
+
     if autofail:
       songFailed = True
       for plr in players:
@@ -467,85 +705,106 @@ def dance(screen, song, players, prevscr, ready_go, game):
       if songFailed:
         song.kill()
 
+    curtime = song.clock.update()
     for plr in players: plr.get_next_events(song)
+    if prof: prof.mark("events")
 
     if song.is_over(): break
-    else: curtime = music.get_pos()/1000.0
 
     key = []
 
-    ev = ui.ui.poll_dance()
-
-    while ev[1] != ui.PASS:
-      if ev[1] == ui.CANCEL:
+    sampler.sample()
+    for pad, evid, when in sampler.drain():
+      if evid == ui.CANCEL:
         for p in players: p.escaped = True
+        if backmovie: backmovie.stop()
+        if bgtrack: bgtrack.stop()
+        if prof:
+          prof.mark("input")
+          dump_profile(prof, song, players, curtime)
         return False
-      elif ev[1] == ui.SCREENSHOT:
+      elif evid == ui.SCREENSHOT:
         screenshot = True
-      elif ev[1] == ui.LEFT: key.append((ev[0], 'l'))
-      elif ev[1] == ui.DOWNLEFT: key.append((ev[0], 'w'))
-      elif ev[1] == ui.UPLEFT: key.append((ev[0], 'k'))
-      elif ev[1] == ui.RIGHT: key.append((ev[0], 'r'))
-      elif ev[1] == ui.UPRIGHT: key.append((ev[0], 'z'))
-      elif ev[1] == ui.DOWNRIGHT: key.append((ev[0], 'g'))
-      elif ev[1] == ui.UP: key.append((ev[0], 'u'))
-      elif ev[1] == ui.DOWN: key.append((ev[0], 'd'))
-      elif ev[1] == ui.CENTER: key.append((ev[0], 'c'))
-      elif ev[1] == -ui.LEFT: key.append((ev[0], '-l'))
-      elif ev[1] == -ui.DOWNLEFT: key.append((ev[0], '-w'))
-      elif ev[1] == -ui.UPLEFT: key.append((ev[0], '-k'))
-      elif ev[1] == -ui.RIGHT: key.append((ev[0], '-r'))
-      elif ev[1] == -ui.UPRIGHT: key.append((ev[0], '-z'))
-      elif ev[1] == -ui.DOWNRIGHT: key.append((ev[0], '-g'))
-      elif ev[1] == -ui.UP: key.append((ev[0], '-u'))
-      elif ev[1] == -ui.DOWN: key.append((ev[0], '-d'))
-      elif ev[1] == -ui.CENTER: key.append((ev[0], '-c'))
-
-      ev = ui.ui.poll_dance()
-
-    for ev in key:
-      if game.double: pid = ev[0] / 2
-      else: pid = ev[0]
-      
+      elif evid in ui.dance_directions and pad >= 0:
+        # Keys mapped to menus too arrive again with pad -1; skip those.
+        key.append((min(when, curtime), pad, ui.dance_directions[evid]))
+
+    if inputs: key = inputs.due(curtime)
+    if recorder:
+      for ev in key: recorder.add(*ev)
+
+    for when, pad, dir in key:
+      if game.double: pid = pad / 2
+      else: pid = pad
+
       if pid >= 0 and pid < len(players):
-        if ev[1][0] != '-':
-          players[pid].handle_keydown(ev, curtime)
+        if dir[0] != '-':
+          players[pid].handle_keydown((pad, dir), when)
         else:
-          players[pid].handle_keyup((ev[0],ev[1][1:]), curtime)
+          players[pid].handle_keyup((pad, dir[1:]), when)
+    if prof: prof.mark("input")
+
+    ticks = 0
+    while logic_time + LOGIC_STEP <= curtime:
+      if ticks == MAX_LOGIC_TICKS:
+        logic_time = curtime
+        break
+      logic_time += LOGIC_STEP
+      for plr in players: plr.logic(logic_time)
+      ticks += 1
+    if prof: prof.mark("logic")
 
     rectlist = []
 
-    if backmovie:
-      backmovie.update(curtime)
-      if backmovie.changed or (fpstext.fps() > 30):
-        backmovie.resetchange()
-        screen.blit(backmovie.image, [0, 0])
+    # A new movie frame or background change redraws the whole screen,
+    # and is then what the sprites are cleared to.
+    new_bg = None
+    if backmovie and backmovie.update(curtime): new_bg = backmovie.image
+    elif bgtrack: new_bg = bgtrack.update(curtime)
+    if new_bg:
+      screen.blit(new_bg, [0, 0])
+      compositor.set_background(new_bg)
+
+    if prof: prof.mark("draw")
 
     for plr in players: rectlist.extend(plr.game_loop(curtime, screen))
+    if prof: prof.mark("players")
 
     lgroup.update(curtime)
     tgroup.update(curtime)
     rectlist.extend(tgroup.draw(screen))
     rectlist.extend(lgroup.draw(screen))
+    if prof: prof.mark("draw")
 
-    if backmovie is None: pygame.display.update(rectlist)
-    else: pygame.display.update()
+    compositor.update(rectlist, new_bg is not None)
+    sampler.sample()
+    if prof: prof.mark("update")
 
+    if recording: recording.frame(screen)
     if screenshot:
-      fn = os.path.join(rc_path, "screenshot.bmp")
-      print _("Saving a screenshot to"), fn
-      pygame.image.save(screen, fn)
+      capture.screenshot(screen)
       screenshot = False
 
-    if backmovie is None:
-      lgroup.clear(screen, background)
-      tgroup.clear(screen, background)
-      for plr in players: plr.clear_sprites(screen, background)
+    compositor.clear()
+    if prof:
+      prof.mark("clear")
+      prof.finish(curtime)
 
     if ((curtime > players[0].length - 1) and
         (songtext.zdir == 0) and (songtext.zoom > 0)):
       songtext.zout()
       grptext.zout()
 
+    # Spend the rest of the frame reading input, rather than drawing
+    # frames faster than the frame cap.
+    if maxfps:
+      next_frame = max(next_frame + 1000.0 / maxfps, pygame.time.get_ticks())
+      sampler.wait(next_frame)
+
+  if backmovie: backmovie.stop()
+  if bgtrack: bgtrack.stop()
   if fpstext: print _("Average FPS for this song was %d.") % fpstext.fps()
+  if prof: dump_profile(prof, song, players, curtime)
+  if recording and recording.dropped:
+    print _("%d recorded frames were dropped.") % recording.dropped
   return songFailed
@@ -98,6 +98,9 @@ class FakePlaylist(object):
     self.constraints = constraints
     self.numplayers = len(constraints)
     self.screen = screen
+    # If true, error messages are kept in held_error rather than shown.
+    self.hold_errors = False
+    self.held_error = None
 
   def __iter__(self):
     return self
@@ -110,9 +113,8 @@ class FakePlaylist(object):
 
   def next(self):
     if len(self.songs) == 0:
-      error.ErrorMessage(self.screen,
-                         _("The difficulty settings you chose result ") +
-                         _("in no songs being available to play."))
+      self._error(_("The difficulty settings you chose result ") +
+                  _("in no songs being available to play."))
       raise StopIteration
     elif len(self.working) == 0: self.working = self.songs[:]
     i = random.randint(0, len(self.working) - 1)
@@ -121,6 +123,11 @@ class FakePlaylist(object):
     return (song.filename,
             [c.diff(song.difficulty[self.mode]) for c in self.constraints])
 
+  # Show an error message, or keep it to be shown later.
+  def _error(self, message):
+    if self.hold_errors: self.held_error = message
+    else: error.ErrorMessage(self.screen, message)
+
 class Endless(InterfaceWindow):
   def __init__(self, songitems, courses, screen, gametype):
     InterfaceWindow.__init__(self, screen, "endless-bg.png");
@@ -178,8 +185,7 @@ class Endless(InterfaceWindow):
 
       if ev == ui.OPTIONS:
         opts = options.OptionScreen(self.player_configs, self.game_config, screen)
-        self._screen.blit(self._bg, [0, 0])
-        pygame.display.update()
+        self.redraw()
         if opts.start_dancing:
           ev = ui.CONFIRM
 
@@ -189,8 +195,7 @@ class Endless(InterfaceWindow):
                                         screen, gametype),
                    self.player_configs, self.game_config, gametype)
 
-        self._screen.blit(self._bg, [0, 0])
-        pygame.display.update()
+        self.redraw()
         music.load(os.path.join(sound_path, "menu.ogg"))
         music.play(4, 0.0)
         ui.ui.clear()
@@ -19,6 +19,7 @@ class GenericFile(object):
     self.steps = {}
     self.info = {}
     self.lyrics = []
+    self.bgchanges = []
     self.description = None
     self._need_steps = need_steps
 
@@ -63,6 +64,15 @@ class GenericFile(object):
           self.info["cdtitle"] = p
           break
 
+  # Add a background change to an image, given relative to the song's
+  # directory. Changes to files that don't exist (or to animations,
+  # which we don't support) are ignored.
+  def add_bgchange(self, time, name):
+    fn = os.path.join(os.path.split(self.filename)[0], name)
+    if (fn.lower()[-3:] in ["png", "jpg", "peg", "bmp"] and
+        os.path.isfile(fn)):
+      self.bgchanges.append((time, fn))
+
   # DWI has an insane number of time formats.
   def parse_time(self, string):
     offset = 0
@@ -144,8 +154,9 @@ class DanceFile(GenericFile):
         self.steps[line] = {}
       return DanceFile.GAMETYPE
 
-  # FIXME: We don't actually parse the background change data yet.
   def parse_bg(self, line, data):
+    parts = line.split()
+    self.add_bgchange(float(parts[0]), " ".join(parts[1:]))
     return DanceFile.BACKGROUND
 
   def parse_gametype(self, line, data):
@@ -530,6 +541,7 @@ class SMFile(MSDFile):
 
     self.bpms = []
     self.freezes = []
+    bgchanges = []
 
     for parts in lines:
 
@@ -573,6 +585,12 @@ class SMFile(MSDFile):
         rest = rest.replace(" ", "")
         self.freezes = [(float(beat), float(wait)) for beat, wait in
                      [change.split("=") for change in rest.split(",")]]
+      elif parts[0] == "BGCHANGES":
+        # beat=file=rate=..., but we only use the beat and the file.
+        for change in rest.split(","):
+          fields = change.split("=")
+          if len(fields) > 1:
+            bgchanges.append((float(fields[0]), fields[1]))
       elif parts[0] == "NOTES":
         if parts[1] in SMFile.gametypes:
           game = SMFile.gametypes[parts[1]]
@@ -587,11 +605,29 @@ class SMFile(MSDFile):
           if need_steps:
             self.steps[game][parts[3].upper()] = self.parse_steps(parts[6], game)
 
+    if "bpm" in self.info:
+      for beat, name in bgchanges:
+        self.add_bgchange(self.beat_time(beat), name)
+
     self.find_mixname()
     self.resolve_files_sanely()
     self.find_files_sanely()
     self.create_3panel_steps()
 
+  # The song time (in seconds) of a beat, from the BPM changes and
+  # stops. Beat 0 is at -OFFSET seconds.
+  def beat_time(self, beat):
+    time = -self.info.get("gap", 0) / 1000.0
+    bpm, last = self.info["bpm"], 0.0
+    for b, new_bpm in self.bpms:
+      if b >= beat: break
+      time += (b - last) * 60.0 / bpm
+      bpm, last = new_bpm, b
+    time += (beat - last) * 60.0 / bpm
+    for b, wait in self.freezes:
+      if b < beat: time += wait
+    return time
+
   def parse_steps(self, steps, gametype):
     stepdata = []
     if gametype in games.COUPLE: stepdata = [[], []]
@@ -772,6 +808,56 @@ class KSFFile(MSDFile):
     self.difficulty[mode][difficulty] = ratings.get(difficulty, 5)
     self.steps[mode][difficulty] = steps
 
+# Values many songs have in common - mix, artist, and difficulty names,
+# difficulty lists - are kept once rather than once per song. The type
+# is part of the key so a unicode string never comes back as a str.
+_shared = {}
+
+def shared(value):
+  return _shared.setdefault((type(value), value), value)
+
+# A song's metadata. It works like the dict it used to be (info["title"],
+# "gap" in info, info.get("banner")), but the keys every song has are
+# slots, a fraction of the size of a dict when there are thousands of
+# songs. Any other keys go in a dict that only exists if there are some.
+class SongInfo(object):
+  __slots__ = ("valid", "mix", "title", "subtitle", "artist", "author",
+               "endat", "preview", "startat", "revision", "gap", "bpm",
+               "bpmdisplay", "filename", "background", "banner", "md5sum",
+               "movie", "cdtitle", "recordkey", "_extra")
+
+  _keys = frozenset(__slots__[:-1])
+
+  def __init__(self, data):
+    self._extra = None
+    for k, v in data.items(): self[k] = v
+
+  def __getitem__(self, key):
+    if key in SongInfo._keys:
+      try: return getattr(self, key)
+      except AttributeError: raise KeyError(key)
+    elif self._extra and key in self._extra: return self._extra[key]
+    else: raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    if key in SongInfo._keys: setattr(self, key, value)
+    else:
+      if self._extra is None: self._extra = {}
+      self._extra[key] = value
+
+  def __contains__(self, key):
+    if key in SongInfo._keys: return hasattr(self, key)
+    else: return bool(self._extra) and key in self._extra
+
+  def get(self, key, value = None):
+    try: return self[key]
+    except KeyError: return value
+
+  def keys(self):
+    keys = [k for k in SongInfo._keys if hasattr(self, k)]
+    if self._extra: keys.extend(self._extra.keys())
+    return keys
+
 # Sort by difficulty rating, or by a preset list if equal.
 def sorted_diff_list(difflist):
   keys = difflist.keys()
@@ -781,6 +867,8 @@ def sorted_diff_list(difflist):
 
 # Encapsulates and abstracts the above classes
 class SongItem(object):
+  __slots__ = ("info", "steps", "lyrics", "bgchanges", "difficulty",
+               "diff_list", "filename", "description")
 
   formats = ((".dance", DanceFile),
              (".dwi", DWIFile),
@@ -857,19 +945,28 @@ class SongItem(object):
       self.info["recordkey"] = recordkey
 
     self.steps = song.steps
-    if song.lyrics: self.lyrics = song.lyrics
-    else: self.lyrics = []
-    self.difficulty = song.difficulty
+    self.lyrics = song.lyrics or ()
+    self.bgchanges = tuple(sorted(song.bgchanges))
     self.filename = filename
     self.description = song.description
 
     if self.info["mix"] == "Unknown": self.info["mix"] = "No Mix"
+    for k in ["mix", "artist", "author"]:
+      self.info[k] = shared(self.info[k])
+    self.info = SongInfo(self.info)
+
+    self.difficulty = {}
+    for game, diffs in song.difficulty.items():
+      self.difficulty[shared(game)] = dict([(shared(d), r)
+                                            for d, r in diffs.items()])
 
     for k, v in games.VERSUS2SINGLE.items():
       if v in self.difficulty and k not in self.difficulty:
         self.difficulty[k] = self.difficulty[v]
         self.steps[k] = self.steps[v]
 
+    # Modes filled in from other modes share their difficulty tables;
+    # nothing changes them once the song is loaded.
     if mainconfig["autogen"]:
       # Fill in non-defined game modes, if possible.
       for game in games.GAMES:
@@ -879,28 +976,29 @@ class SongItem(object):
 
         elif game in games.SINGLE:
           if "SINGLE" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["SINGLE"])
+            self.difficulty[game] = self.difficulty["SINGLE"]
           elif "5PANEL" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["5PANEL"])
+            self.difficulty[game] = self.difficulty["5PANEL"]
         
         elif game in games.VERSUS:
           if "VERSUS" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["VERSUS"])
+            self.difficulty[game] = self.difficulty["VERSUS"]
           elif "5VERSUS" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["5VERSUS"])
+            self.difficulty[game] = self.difficulty["5VERSUS"]
 
         elif game in games.DOUBLE:
           if "DOUBLE" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["DOUBLE"])
+            self.difficulty[game] = self.difficulty["DOUBLE"]
           elif "5DOUBLE" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["5DOUBLE"])
+            self.difficulty[game] = self.difficulty["5DOUBLE"]
 
         elif game in games.COUPLE:
           if "COUPLE" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["COUPLE"])
+            self.difficulty[game] = self.difficulty["COUPLE"]
           elif "5COUPLE" in self.difficulty:
-            self.difficulty[game] = dict(self.difficulty["5COUPLE"])
+            self.difficulty[game] = self.difficulty["5COUPLE"]
 
     self.diff_list = {}
-    for key in self.difficulty:    
-      self.diff_list[key] = sorted_diff_list(self.difficulty[key])
+    for key in self.difficulty:
+      self.diff_list[key] = shared(tuple(sorted_diff_list(
+        self.difficulty[key])))
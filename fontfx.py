@@ -2,6 +2,7 @@
 
 import pygame
 import random
+import animstrip
 from constants import *
 from fonttheme import FontTheme
 
@@ -213,6 +214,8 @@ class zztext(pygame.sprite.Sprite):
 
     self.baseimage.set_colorkey(self.baseimage.get_at([0, 0]), RLEACCEL)
     self.image = self.baseimage
+    # Frame i is the text zoomed to i / 32.
+    self._strip = animstrip.zoom_strip(self.baseimage, 33, 0, 1)
 
   def zin(self):
     self.zoom = 1
@@ -224,7 +227,7 @@ class zztext(pygame.sprite.Sprite):
       
   def update(self, time):
     if 32 > self.zoom > 0:
-      self.image = pygame.transform.rotozoom(self.baseimage, 0, self.zoom/32.0)
+      self.image = self._strip.frames[self.zoom]
       self.rect = self.image.get_rect()
       self.rect.center = self.cent
       self.zoom += self.zdir
@@ -0,0 +1,161 @@
+# Per-phase frame timing for the dance loop, to find out which songs and
+# modifiers make it drop frames. The last FRAMES frames are kept in ring
+# buffers, one per phase; frames over the budget are logged with the
+# song time and their slowest phase.
+
+import os
+import time
+import pygame
+
+from constants import *
+from fonttheme import FontTheme
+
+# The phases of a frame, in the order the dance loop runs them.
+PHASES = ["input", "events", "logic", "players", "draw", "update", "clear"]
+
+# Number of frames kept for the percentiles and histogram.
+FRAMES = 1024
+
+# A frame taking longer than this (in ms) is a stutter.
+BUDGET = 1000.0 / 60
+
+# Upper bounds (in ms) of the histogram buckets; the last is open.
+BUCKETS = [2, 4, 8, 12, 16, 20, 33, 50, 100]
+
+# Log at most this many stutters per song.
+MAX_STUTTERS = 200
+
+# Return the p-th percentile (0 - 100) of a sorted list.
+def percentile(values, p):
+  if not values: return 0.0
+  i = int(round((len(values) - 1) * p / 100.0))
+  return values[i]
+
+class FrameProfiler(object):
+  def __init__(self, size = FRAMES, budget = BUDGET):
+    self.size = size
+    self.budget = budget
+    self._times = dict([(p, [0.0] * size) for p in PHASES])
+    self._totals = [0.0] * size
+    self._index = 0
+    self.frames = 0
+    self.stutters = []
+    self.stutter_count = 0
+    self._current = dict([(p, 0.0) for p in PHASES])
+    self._start = self._last = time.time()
+
+  # Start timing a new frame.
+  def start(self):
+    for p in PHASES: self._current[p] = 0.0
+    self._start = self._last = time.time()
+
+  # Charge the time since the last mark (or the frame start) to a phase.
+  def mark(self, phase):
+    now = time.time()
+    self._current[phase] += (now - self._last) * 1000
+    self._last = now
+
+  # Finish the frame, and store it in the ring buffers.
+  def finish(self, songtime):
+    total = (self._last - self._start) * 1000
+    i = self._index
+    for p in PHASES: self._times[p][i] = self._current[p]
+    self._totals[i] = total
+    self._index = (i + 1) % self.size
+    self.frames += 1
+
+    if total > self.budget:
+      self.stutter_count += 1
+      if len(self.stutters) < MAX_STUTTERS:
+        worst = max(PHASES, key = self._current.get)
+        self.stutters.append((songtime, total, worst, self._current[worst]))
+
+  def _recent(self, values):
+    return values[:min(self.frames, self.size)]
+
+  # (p50, p95, p99, max) in ms for a phase, or the whole frame if phase
+  # is None, over the buffered frames.
+  def percentiles(self, phase = None):
+    if phase is None: values = self._recent(self._totals)
+    else: values = self._recent(self._times[phase])
+    values = sorted(values)
+    if not values: return (0.0, 0.0, 0.0, 0.0)
+    return (percentile(values, 50), percentile(values, 95),
+            percentile(values, 99), values[-1])
+
+  # Frame counts per BUCKETS entry, plus one for slower frames.
+  def histogram(self):
+    counts = [0] * (len(BUCKETS) + 1)
+    for t in self._recent(self._totals):
+      for i, limit in enumerate(BUCKETS):
+        if t <= limit:
+          counts[i] += 1
+          break
+      else: counts[-1] += 1
+    return counts
+
+  def summary(self):
+    lines = ["%-8s %7s %7s %7s %7s" % ("phase", "p50", "p95", "p99", "max")]
+    for p in PHASES + [None]:
+      lines.append("%-8s %7.2f %7.2f %7.2f %7.2f" %
+                   ((p or "frame",) + self.percentiles(p)))
+    lines.append("")
+    lines.append("Frame times (ms):")
+    counts = self.histogram()
+    lower = 0
+    for limit, count in zip(BUCKETS + [None], counts):
+      if limit is None: label = "> %d" % lower
+      else: label = "%d - %d" % (lower, limit)
+      lines.append("%10s %6d" % (label, count))
+      lower = limit
+    lines.append("")
+    lines.append("%d of %d frames over %.1f ms." %
+                 (self.stutter_count, self.frames, self.budget))
+    for songtime, total, phase, ms in self.stutters:
+      lines.append("  %8.3fs %7.2f ms (%s %.2f ms)" %
+                   (songtime, total, phase, ms))
+    return "\n".join(lines)
+
+  # Write the summary for a song to rc_path/profiles, and return the
+  # file name.
+  def dump(self, title, modifiers = ""):
+    path = os.path.join(rc_path, "profiles")
+    if not os.path.isdir(path): os.mkdir(path)
+    # Titles can be unicode; keep the file name ASCII, and write UTF-8.
+    if isinstance(title, unicode): title = title.encode("utf-8")
+    name = "".join([c for c in title if c < "\x80" and
+                    (c.isalnum() or c in "-_")])
+    fn = os.path.join(path, "%s-%d.txt" % (name or "song", int(time.time())))
+    f = file(fn, "w")
+    f.write("%s\n%s\n\n" % (title, modifiers))
+    f.write(self.summary())
+    f.write("\n")
+    f.close()
+    return fn
+
+# Shows the p95 time of each phase over the buffered frames, in the top
+# left corner. Redrawn once a second.
+class ProfileDisplay(pygame.sprite.Sprite):
+  def __init__(self, profiler):
+    pygame.sprite.Sprite.__init__(self)
+    self._prof = profiler
+    self._font = FontTheme.Dance_FPS_display
+    self._oldtime = -10000000
+    self.image = pygame.surface.Surface([1, 1])
+    self.rect = self.image.get_rect()
+
+  def update(self, time):
+    if time - self._oldtime < 1: return
+    self._oldtime = time
+    lines = ["%s %.1f" % (p, self._prof.percentiles(p)[1]) for p in PHASES]
+    lines.append("slow %d" % self._prof.stutter_count)
+    images = [self._font.render(l, True, [160, 160, 160]) for l in lines]
+    h = sum([i.get_height() for i in images])
+    w = max([i.get_width() for i in images])
+    self.image = pygame.Surface([w, h], SRCALPHA, 32)
+    y = 0
+    for i in images:
+      self.image.blit(i, [0, y])
+      y += i.get_height()
+    self.rect = self.image.get_rect()
+    self.rect.topleft = [4, 60]
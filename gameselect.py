@@ -229,8 +229,7 @@ class MainWindow(InterfaceWindow):
                                     MODES.get((VALUES[0][indices[0]],
                                                VALUES[1][indices[1]])))
           active = 0
-          self._screen.blit(self._bg, [0, 0])
-          pygame.display.update()
+          self.redraw()
         else:
           active += 1
           if active == 1: self._oldimage = self._image._image # FIXME
@@ -2,9 +2,12 @@
 # These handle loading the various graphics themes for pydance.
 
 import os
+import zlib
 import games
 import zipfile
+import animstrip
 import dircache
+import cPickle as pickle
 
 from cStringIO import StringIO
 
@@ -12,6 +15,13 @@ from listener import Listener
 
 from constants import *
 
+# Converted arrow frames are cached in this directory, as a BMP atlas
+# and a pickled index per theme and size.
+ATLAS_PATH = os.path.join(rc_path, "cache")
+
+# Frames per row in an atlas.
+ATLAS_COLUMNS = 16
+
 # Wrapper classes for loading files from themes.
 # Eventually, we can use ZipFile + StringIO to make it load from zip files.
 class ThemeFile(object):
@@ -86,12 +96,40 @@ class ThemeFile(object):
 
   is_zip_theme = classmethod(is_zip_theme)
 
+  # ThemeFiles that have been loaded, by path and size.
+  _loaded = {}
+
+  # Get the ThemeFile for a theme, shared by everyone using that theme
+  # at that size, so its frames are only made once.
+  def load(cls, filename, size):
+    key = (filename, size)
+    if key not in cls._loaded: cls._loaded[key] = cls(filename, size)
+    return cls._loaded[key]
+
+  load = classmethod(load)
+
   def __init__(self, filename, size):
     self.path = filename
     self.size = size
     self.zip = None
     if not os.path.isdir(filename):
       self.zip = zipfile.ZipFile(filename)
+      self._names = set(self.zip.namelist())
+      self._mtime = os.path.getmtime(filename)
+    else:
+      self._names = set(os.listdir(filename))
+      self._mtime = max([os.path.getmtime(os.path.join(filename, n))
+                         for n in self._names] + [os.path.getmtime(filename)])
+
+    # (type, dir, color) -> (frames, beatcount, frames per beat) for
+    # arrows; beatcount is None for arrows that aren't animated.
+    self._frames = {}
+    self._lifebar = None
+    self._atlas_fn = os.path.join(ATLAS_PATH, "%s-%d-%08x" %
+                                  ("".join([c for c in os.path.basename(filename)
+                                            if c.isalnum() or c in "-_"]),
+                                   size, zlib.crc32(filename) & 0xffffffff))
+    self._load_atlas()
 
   # Get an image from the theme.
   def get_image(self, image_name):
@@ -105,8 +143,7 @@ class ThemeFile(object):
 
   # Check to see if an image is in the theme.
   def has_image(self, image_name):
-    if self.zip: return image_name in self.zip.namelist()
-    else: return os.path.exists(os.path.join(self.path, image_name))
+    return image_name in self._names
 
   # Get an arrow based on its type/direction/color.
   # If the desired arrow coloring wasn't found, fall back to the default
@@ -143,6 +180,123 @@ class ThemeFile(object):
               break
     return self.get_image(fn), rotate, realnum
 
+  # Get the frames of an arrow, chopped up and rotated, as a tuple
+  # (frames, beatcount, frames per beat).
+  def get_frames(self, type, dir, color):
+    key = (type, dir, color)
+    if key not in self._frames:
+      self._frames[key] = self._make_frames(type, dir, color)
+    return self._frames[key]
+
+  def _make_frames(self, type, dir, color):
+    image, rotate, realnum = self.get_arrow(type, dir, color)
+    # This arrow is animated
+    if image.get_width() != self.size or image.get_height() != self.size:
+      w = image.get_width()
+      h = image.get_height()
+      if w / self.size * self.size != w or h / self.size * self.size != h:
+        raise RuntimeError("Theme image is not evenly divisible: %dx%d."%(w,h))
+
+      # Chop up the image.
+      frames = []
+      for i in range(w / self.size):
+        for j in range(h / self.size):
+          s = pygame.Surface([self.size, self.size])
+          s.blit(image, [-i * self.size, -j * self.size])
+          s = pygame.transform.rotate(s, rotate)
+          s.set_colorkey(s.get_at([0, 0]), RLEACCEL)
+          frames.append(s)
+      return frames, w / self.size, h / self.size
+    else:
+      image = pygame.transform.rotate(image, rotate)
+      image.set_colorkey(image.get_at([0, 0]), RLEACCEL)
+      return [image], None, None
+
+  # Make the frames of every arrow used by a game, and cache them on
+  # disk if they weren't all loaded from there.
+  def preload(self, game):
+    count = len(self._frames)
+    for dir in game.dirs:
+      for cnum in range(4): self.get_frames("c", dir, cnum)
+      self.get_frames("n", dir, 0)
+      self.get_frames("s", dir, 4)
+    if len(self._frames) != count: self._save_atlas()
+
+  # Read the cached frames, if they were made from this version of the
+  # theme.
+  def _load_atlas(self):
+    try:
+      index = pickle.load(file(self._atlas_fn + ".idx", "rb"))
+      if index["mtime"] != self._mtime or index["path"] != self.path: return
+      atlas = pygame.image.load(self._atlas_fn + ".bmp").convert()
+    except (IOError, OSError, EOFError, KeyError, pickle.UnpicklingError,
+            pygame.error):
+      return
+
+    for key, (first, count, beatcount, fpb) in index["frames"].items():
+      frames = []
+      for i in range(first, first + count):
+        s = pygame.Surface([self.size, self.size])
+        s.blit(atlas, [0, 0], self._atlas_rect(i))
+        s.set_colorkey(s.get_at([0, 0]), RLEACCEL)
+        frames.append(s)
+      self._frames[key] = (frames, beatcount, fpb)
+
+  def _atlas_rect(self, i):
+    return [(i % ATLAS_COLUMNS) * self.size, (i / ATLAS_COLUMNS) * self.size,
+            self.size, self.size]
+
+  def _save_atlas(self):
+    keys = self._frames.keys()
+    keys.sort()
+    total = sum([len(self._frames[k][0]) for k in keys])
+    rows = (total + ATLAS_COLUMNS - 1) / ATLAS_COLUMNS
+    atlas = pygame.Surface([ATLAS_COLUMNS * self.size, rows * self.size])
+    index = { "path": self.path, "mtime": self._mtime, "frames": {} }
+    i = 0
+    for k in keys:
+      frames, beatcount, fpb = self._frames[k]
+      index["frames"][k] = (i, len(frames), beatcount, fpb)
+      for f in frames:
+        # Fill with the colorkey, so the transparent pixels stay that color.
+        r = self._atlas_rect(i)
+        atlas.fill(f.get_colorkey(), r)
+        atlas.blit(f, r)
+        i += 1
+
+    try:
+      if not os.path.isdir(ATLAS_PATH): os.mkdir(ATLAS_PATH)
+      pygame.image.save(atlas, self._atlas_fn + ".bmp")
+      pickle.dump(index, file(self._atlas_fn + ".idx", "wb"), 2)
+    except (IOError, OSError, pygame.error):
+      print "W: Unable to cache theme frames in", self._atlas_fn
+
+  # Lifebars are 204x28 images; return lists of full and empty frames.
+  def get_lifebar(self):
+    if self._lifebar: return self._lifebar
+    try:
+      full = self.get_image("lifebar-full.png").convert()
+      empty = self.get_image("lifebar-empty.png").convert()
+    except RuntimeError:
+      img = self.get_image("lifebar.png").convert()
+      full = pygame.Surface([204, img.get_height()])
+      empty = pygame.Surface([204, img.get_height()])
+      full.blit(img, [0, 0])
+      empty.blit(img, [-204, 0])
+
+    f = []
+    e = []
+    for y in range(0, full.get_height(), 28):
+      new_f = pygame.Surface([204, 28])
+      new_e = pygame.Surface([204, 28])
+      new_f.blit(full, [0, -y])
+      new_e.blit(empty, [0, -y])
+      f.append(new_f)
+      e.append(new_e)
+
+    self._lifebar = (f, e)
+    return self._lifebar
+
 # An even higher-level interface than ThemeFile, that sets up the sprites
 # for many of the images.
 class GFXTheme(object):
@@ -161,7 +315,8 @@ class GFXTheme(object):
     if self.path == None:
       raise RuntimeError("E: Cannot load theme '%s/%s'." % (size, name))
 
-    self.theme_data = ThemeFile(self.path, self.size)
+    self.theme_data = ThemeFile.load(self.path, self.size)
+    self.theme_data.preload(game)
 
   # FIXME: Can probably be moved to __init__ and stored as members.
   def arrows(self, pid):
@@ -177,28 +332,7 @@ class GFXTheme(object):
     return arrs, arrfx
 
   def get_lifebar(self):
-    # Lifebars are 204x28 images.
-    try:
-      full = self.theme_data.get_image("lifebar-full.png").convert()
-      empty = self.theme_data.get_image("lifebar-empty.png").convert()
-    except RuntimeError:
-      img = self.theme_data.get_image("lifebar.png").convert()
-      full = pygame.Surface([204, img.get_height()])
-      empty = pygame.Surface([204, img.get_height()])
-      full.blit(img, [0, 0])
-      empty.blit(img, [-204, 0])
-
-    f = []
-    e = []
-    for y in range(0, full.get_height(), 28):
-      new_f = pygame.Surface([204, 28])
-      new_e = pygame.Surface([204, 28])
-      new_f.blit(full, [0, -y])
-      new_e.blit(empty, [0, -y])
-      f.append(new_f)
-      e.append(new_e)
-
-    return f, e
+    return self.theme_data.get_lifebar()
 
 # The scrolling arrows for this game mode.
 class ArrowSet(object):
@@ -223,31 +357,15 @@ class Arrow(object):
   def __init__(self, theme, type, dir, color, left):
     self.left = left
     self.dir = dir
-    self._image, rotate, realnum = theme.get_arrow(type, dir, color)
-    # This arrow is animated
-    if (self._image.get_width() != theme.size or
-        self._image.get_height() != theme.size):
-      w = self._image.get_width()
-      h = self._image.get_height()
-      frames = (h * w) / theme.size
-      if w / theme.size * theme.size != w or h / theme.size * theme.size != h:
-        raise RuntimeError("Theme image is not evenly divisible: %dx%d."%(w,h))
-
-      # Chop up the image.
-      self._images = []
-      for i in range(w / theme.size):
-        for j in range(h / theme.size):
-          s = pygame.Surface([theme.size, theme.size])
-          s.blit(self._image, [-i * theme.size, -j * theme.size])
-          s = pygame.transform.rotate(s, rotate)
-          s.set_colorkey(s.get_at([0, 0]), RLEACCEL)
-          self._images.append(s)
-      self._beatcount = w / theme.size
-      self._fpb = h / theme.size # frames per beat
+    # The frames are shared with every other Arrow of this theme.
+    frames, beatcount, fpb = theme.get_frames(type, dir, color)
+    if beatcount is not None: # This arrow is animated
+      self._images = frames
+      self._beatcount = beatcount
+      self._fpb = fpb # frames per beat
       self._image = None
     else:
-      self._image = pygame.transform.rotate(self._image, rotate)
-      self._image.set_colorkey(self._image.get_at([0, 0]), RLEACCEL)
+      self._image = frames[0]
 
     if not mainconfig["animation"] and not self._image and type == "c":
       self._image = self._images[0]
@@ -300,6 +418,18 @@ class TopArrow(Listener, pygame.sprite.Sprite):
     if self._pressed: self.image = self.sarrow.get_image(beat)
     else: self.image = self.narrow.get_image(beat)
 
+# Frames in a step explosion, and how long (in seconds) it lasts.
+FX_FRAMES = 12
+FX_TIME = 0.2
+
+# Explosions grow faster for every this many steps in the combo.
+FX_COMBO_STEP = 64
+
+# Frames in one turn of a held arrow's explosion, and how long (in
+# seconds) the turn takes.
+FX_HOLD_FRAMES = 24
+FX_HOLD_TURN = 360 / 230.0
+
 class ArrowFX(Listener, pygame.sprite.Sprite):
   def __init__ (self, direction, ypos, pid, theme, game):
     pygame.sprite.Sprite.__init__(self)
@@ -313,8 +443,6 @@ class ArrowFX(Listener, pygame.sprite.Sprite):
 
     self.baseimg = Arrow(theme, "n", direction, 0, 0).get_images()[-1]
     self.baseimg = self.baseimg.convert()
-    self.tintimg = pygame.Surface(self.baseimg.get_size())
-    self.tintimg.blit(self.baseimg, [0, 0])
 
     self.blackbox = pygame.surface.Surface([game.width] * 2)
     self.blackbox.set_colorkey(self.blackbox.get_at([0, 0]))
@@ -329,6 +457,27 @@ class ArrowFX(Listener, pygame.sprite.Sprite):
 
     style = mainconfig['explodestyle']
     self.rotating, self.scaling = style & 1, style & 2
+
+    # The arrow tinted for each rating.
+    self.tinted = {}
+    for rating, color in self.colors.items():
+      img = pygame.Surface(self.baseimg.get_size(), 0, 16)
+      img.blit(self.baseimg, [0, 0])
+      tinter = pygame.surface.Surface(self.baseimg.get_size())
+      tinter.fill(color)
+      tinter.set_alpha(127)
+      img.blit(tinter, [0, 0])
+      img.set_colorkey(img.get_at([0, 0]))
+      self.tinted[rating] = img.convert()
+
+    # Explosion strips, by (rating, spin direction, combo group), or
+    # (rating, spin direction, None) for holds. The strips for no combo
+    # are made now; others when they're first needed.
+    self._strips = {}
+    if self.scaling or self.rotating:
+      for rating in self.tinted:
+        for d in (1, -1): self._strip(rating, d, 0)
+
     self.stepped(self.pid, self.dir, -1, -1, "V", 0)
     
   def holding(self, yesorno):
@@ -340,33 +489,57 @@ class ArrowFX(Listener, pygame.sprite.Sprite):
 
     self.combo = combo
     self.presstime = time
-    self.tintimg = pygame.Surface(self.baseimg.get_size(), 0, 16)
-    self.tintimg.blit(self.baseimg, [0, 0])
-    tinter = pygame.surface.Surface(self.baseimg.get_size())
-    tinter.fill(self.colors.get(tinttype, [0, 0, 255]))
-    tinter.set_alpha(127)
-    self.tintimg.blit(tinter, [0, 0])
-    self.tintimg.set_colorkey(self.tintimg.get_at([0, 0]))
-    self.tintimg = self.tintimg.convert()
+    self.rating = tinttype
+    self.tintimg = self.tinted[tinttype]
     if self.direction == 1: self.direction = -1
     else: self.direction = 1
 
+  # Scale and/or rotate a tinted arrow, depending on the explosion style.
+  def _transform(self, image, scale, angle):
+    if self.scaling:
+      newsize = [max(0, int(x*scale)) for x in image.get_size()]
+      image = pygame.transform.scale(image, newsize)
+    if self.rotating:
+      image = pygame.transform.rotate(image, angle)
+    return image
+
+  # Get the explosion strip for a rating, spin direction, and combo
+  # group (None for a held arrow). Only the strips for no combo and the
+  # current combo group are kept.
+  def _strip(self, rating, direction, group):
+    key = (rating, direction, group)
+    if key not in self._strips:
+      if group:
+        for k in self._strips.keys():
+          if k[2] and k[2] != group: del(self._strips[k])
+
+      image = self.tinted[rating]
+      if group is None: # Held arrows are 1.54 times as big, and turn.
+        frames = FX_HOLD_FRAMES
+        if not self.rotating: frames = 1
+        make = lambda p: self._transform(image, 1.54, 360.0 * p * direction)
+      else:
+        frames = FX_FRAMES
+        growth = 4.0 * (1.0 + group * FX_COMBO_STEP / 256.0)
+        make = lambda p: self._transform(image, 1.0 + FX_TIME * p * growth,
+                                         FX_TIME * p * 230.0 * direction)
+      self._strips[key] = animstrip.AnimStrip(frames, make)
+    return self._strips[key]
+
   def update(self, time):
     steptimediff = time - self.presstime
     
     if (steptimediff < 0.2) or self.holdtype:
       self.displaying = 1
-      self.image = self.tintimg
-      if self.scaling:
-        if self.holdtype:
-          scale = 1.54
-        else:
-          scale = 1.0 + (steptimediff * 4.0) * (1.0+(self.combo/256.0))
-        newsize = [max(0, int(x*scale)) for x in self.image.get_size()]
-        self.image = pygame.transform.scale(self.image, newsize)
-      if self.rotating:
-        angle = steptimediff * 230.0 * self.direction
-        self.image = pygame.transform.rotate(self.image, angle)
+      if not (self.scaling or self.rotating):
+        self.image = self.tintimg
+      elif self.holdtype:
+        strip = self._strip(self.rating, self.direction, None)
+        self.image = strip.get((steptimediff % FX_HOLD_TURN) / FX_HOLD_TURN)
+      else:
+        strip = self._strip(self.rating, self.direction,
+                            self.combo / FX_COMBO_STEP)
+        self.image = strip.get(steptimediff / FX_TIME)
       if self.holdtype == 0:
         tr = 224-int(1024.0*steptimediff)
       else:
@@ -4,6 +4,7 @@ import pygame
 import announcer
 import colors
 import fontfx
+import animstrip
 import ui
 import locale
 
@@ -52,6 +53,9 @@ class BannerFadeIn(pygame.sprite.Sprite):
       alp = int(256 * (1 - ((self._end - time) / 3000.0)))
       self.image.set_alpha(alp)
 
+# Frames in the grade's spin-in.
+GRADE_FRAMES = 60
+
 # Display a rotating grade graphic.
 class GradeSprite(pygame.sprite.Sprite):
   def __init__(self, center, rating):
@@ -66,19 +70,25 @@ class GradeSprite(pygame.sprite.Sprite):
     self._center = center
     self.rect = self._image.get_rect()
     self.rect.center = center
+    # Spins in from 1000 degrees and nothing to full size over 3 seconds.
+    self._strip = animstrip.AnimStrip(GRADE_FRAMES, self._make_frame)
 
-  def update(self, time):
-    if time < self._end:
-      angle = (self._end - time) / 3.0
-      zoom = (1 - (self._end - time) / 3000.0)
-      img = pygame.transform.rotozoom(self._image, angle, zoom).convert()
+  # The frame p of the way through the animation, cut to the image size.
+  def _make_frame(self, p):
+    if p < 1:
+      img = pygame.transform.rotozoom(self._image, 1000 * (1 - p),
+                                      max(0.001, p)).convert()
     else:
       img = self._image
-    self.image = pygame.Surface(self._size)
+    image = pygame.Surface(self._size)
     r = img.get_rect()
-    r.center = self.image.get_rect().center
-    self.image.blit(img, r)
-    self.image.set_colorkey(self.image.get_at([0, 0]))
+    r.center = image.get_rect().center
+    image.blit(img, r)
+    image.set_colorkey(image.get_at([0, 0]))
+    return image
+
+  def update(self, time):
+    self.image = self._strip.get(1 - (self._end - time) / 3000.0)
     self.rect = self.image.get_rect()
     self.rect.center = self._center
 
@@ -6,6 +6,8 @@ import pygame
 import colors
 import fontfx
 import random
+import ui
+import capture
 
 
 from constants import *
@@ -73,6 +75,7 @@ class TextDisplay(pygame.sprite.Sprite):
     self.rect.midleft = self._midleft
 
   def set_text(self, text):
+    if text == self._text: return
     self._text = text
     self._render()
 
@@ -87,6 +90,7 @@ class BPMDisplay(pygame.sprite.Sprite):
     self._render()
     self._color = [255, 255, 255]
     self._bpm_range = [0, 1] # normally [min, range]
+    self.next_update = None
 
   def _render(self):
     if self._bpm:
@@ -154,6 +158,12 @@ class BPMDisplay(pygame.sprite.Sprite):
         self._color = [255 * math.sqrt(p), 255 * math.sqrt(1 - p), 0]
       self._render()
 
+    if len(self._bpms) == 0:
+      if self._bpm_idx: self.next_update = self._last_update + 50
+      else: self.next_update = None
+    elif len(self._bpms) > 1: self.next_update = self._last_update + 2000
+    else: self.next_update = self._last_update + 3000
+
 # Scroll an image looping vertically, from the course selection course list.
 class ScrollingImage(pygame.sprite.Sprite):
   def __init__(self, image, topleft, height):
@@ -186,6 +196,7 @@ class ScrollingImage(pygame.sprite.Sprite):
       y %= self._image.get_height()
       self.image.blit(self._image, [0, -y])
       self.image.blit(self._image, [0, self._image.get_height() - y])
+      self.dirty = True
 
 # Display an image.
 class ImageDisplay(pygame.sprite.Sprite):
@@ -321,6 +332,7 @@ class ActiveIndicator(pygame.sprite.Sprite):
 
     self.rect = self.image.get_rect()
     self.rect.topleft = topleft
+    self._alpha = None
 
   # Extract the left 5px, right 5px, and middle parts of an image.
   def _left_mid_right(self, img):
@@ -337,8 +349,13 @@ class ActiveIndicator(pygame.sprite.Sprite):
                          
   def move(self, pt): self.rect.topleft = pt
 
+  # The alpha is rounded to multiples of 8, so the indicator is only
+  # redrawn about ten times a second.
   def update(self, time):
-    self.image.set_alpha(int(255 * (0.3 + (math.sin(time / 720.0)**2 / 3.0))))
+    alpha = int(255 * (0.3 + (math.sin(time / 720.0)**2 / 3.0))) / 8 * 8
+    if alpha != self._alpha:
+      self._alpha = alpha
+      self.image.set_alpha(alpha)
 
 # Box to indicate the current difficulty level and rating.
 class DifficultyBox(pygame.sprite.Sprite):
@@ -387,14 +404,11 @@ class ListBox(pygame.sprite.Sprite):
     self._needs_update = True
     self._render()
 
+  # Items are only rendered when they scroll into view, so setting a long
+  # list (e.g. every song when folders are off) is cheap.
   def set_items(self, items):
-    c2 = [c / 8 for c in self._color]
-    self._items = []
-
-    for i in items:
-      txt = fontfx.render_outer(i, self._w - 7, self._font)
-      img = fontfx.shadow(txt, self._font, self._color)
-      self._items.append(img)
+    self._items = items
+    self._images = {}
     self._idx = self._oldidx = 0 - self._count / 2 # Reset index to 0.
     self._needs_update = True
 
@@ -431,7 +445,7 @@ class ListBox(pygame.sprite.Sprite):
     for i, y in zip(range(self._count + 2),
                     range(-self._h / 2, self._h * (self._count + 1), self._h)):
       idx = (self._idx + i - 1) % len(self._items)
-      t = self._items[idx]
+      t = self._item(idx)
       r = t.get_rect()
       r.centery = y + self._offset
       r.left = 5
@@ -439,9 +453,19 @@ class ListBox(pygame.sprite.Sprite):
     self.rect = self.image.get_rect()
     self.rect.topleft = self._topleft
 
+  def _item(self, idx):
+    if idx not in self._images:
+      txt = fontfx.render_outer(self._items[idx], self._w - 7, self._font)
+      self._images[idx] = fontfx.shadow(txt, self._font, self._color)
+    return self._images[idx]
+
 # Display the whole banner + surrounding text, with the slowly
 # rotating color.
 class BannerDisplay(pygame.sprite.Sprite):
+  # Boxes by color, shared between all banner displays. The color only
+  # changes in small steps, so the same boxes come around again.
+  _boxes = {}
+
   def __init__(self, center):
     pygame.sprite.Sprite.__init__(self)
     self.isfolder = False
@@ -452,6 +476,9 @@ class BannerDisplay(pygame.sprite.Sprite):
     self._delta = 5
     self._idx = 1
     self._bpmdisplay = BPMDisplay(FontTheme.BannerDisp_BPM, [60, 180])
+    self._bpmimage = None
+    self._needs_update = False
+    self.next_update = None
 
   def set_song(self, song):
     c1 = [255, 255, 255]
@@ -487,9 +514,19 @@ class BannerDisplay(pygame.sprite.Sprite):
     self._cdtitle = song.cdtitle
     self._r_cd = self._cdtitle.get_rect()
     self._r_cd.center = [290, 180]
+    self._needs_update = True
+
+  def _box(self):
+    color = tuple(self._color)
+    if color not in BannerDisplay._boxes:
+      if len(BannerDisplay._boxes) > 256: BannerDisplay._boxes.clear()
+      BannerDisplay._boxes[color] = make_box(self._color, [350, 350])
+    return BannerDisplay._boxes[color]
 
   def _render(self):
-    self.image = make_box(self._color, [350, 350])
+    self._needs_update = False
+    self._bpmimage = self._bpmdisplay.image
+    self.image = self._box().copy()
     self.image.blit(self._banner, self._r_b)
     self.image.set_clip()
 
@@ -513,7 +550,14 @@ class BannerDisplay(pygame.sprite.Sprite):
         if self._color[self._idx]: self._delta = -3
         else: self._delta = 3
       self._color[self._idx] += self._delta
-    self._render()
+      self._needs_update = True
+
+    if self._bpmdisplay.image is not self._bpmimage: self._needs_update = True
+    if self._needs_update: self._render()
+
+    self.next_update = self._next_update
+    if self._bpmdisplay.next_update is not None:
+      self.next_update = min(self.next_update, self._bpmdisplay.next_update)
 
 # Wrap some text in a sprite.
 class WrapTextDisplay(pygame.sprite.Sprite):
@@ -533,14 +577,103 @@ class WrapTextDisplay(pygame.sprite.Sprite):
     self.rect.topleft = self._topleft
 
   def set_text(self, text):
+    if text == self._text: return
     self._text = text
     self._needs_update = True
 
   def update(self, time):
-    if self._needs_update: self._render()
+    if self._needs_update:
+      self._needs_update = False
+      self._render()
+
+# The longest time (in ms) an idle window sleeps before updating its
+# sprites again. Sprites that will change sooner than that can say when
+# by setting next_update.
+IDLE_WAIT = 100
+
+# Merge overlapping rectangles, so no area is redrawn twice.
+def coalesce_rects(rects):
+  merged = []
+  for r in rects:
+    r = pygame.Rect(r)
+    if r.width <= 0 or r.height <= 0: continue
+    i = r.collidelist(merged)
+    while i != -1:
+      r.union_ip(merged.pop(i))
+      i = r.collidelist(merged)
+    merged.append(r)
+  return merged
+
+# Lanes are this wide, like arrow columns; rects in the same lane that
+# are at most LANE_GAP pixels apart vertically are merged.
+LANE_WIDTH = 64
+LANE_GAP = 4
+
+# Merge the rects in each lane into vertical runs, and then merge any
+# that still overlap.
+def merge_lanes(rects, bounds):
+  lanes = {}
+  for r in rects:
+    r = pygame.Rect(r).clip(bounds)
+    if r.width <= 0 or r.height <= 0: continue
+    lanes.setdefault(r.left // LANE_WIDTH, []).append(r)
+
+  merged = []
+  for lane in lanes.values():
+    lane.sort(key = lambda r: r.top)
+    cur = lane[0]
+    for r in lane[1:]:
+      if (r.top <= cur.bottom + LANE_GAP and r.left < cur.right and
+          r.right > cur.left):
+        cur.union_ip(r)
+      else:
+        merged.append(cur)
+        cur = r
+    merged.append(cur)
+  return coalesce_rects(merged)
+
+# Collects the rects sprites were drawn to in a frame, updates the
+# display for them, and puts the background back under them afterwards,
+# once per merged rect. If the merged rects cover more than FULL_UPDATE
+# of the screen, the whole screen is updated and restored instead.
+class FrameCompositor(object):
+  FULL_UPDATE = 0.4
+
+  def __init__(self, screen, background):
+    self._screen = screen
+    self._bg = background
+    self._bounds = screen.get_rect()
+    self._area = float(self._bounds.width * self._bounds.height)
+    self._rects = []
+
+  # The surface sprites are cleared to, e.g. a background movie frame.
+  def set_background(self, background):
+    self._bg = background
+
+  # Update the screen where sprites were drawn, or all of it if full.
+  def update(self, rects, full = False):
+    self._rects = merge_lanes(rects, self._bounds)
+    covered = sum([r.width * r.height for r in self._rects])
+    if full or covered > self._area * self.FULL_UPDATE:
+      self._rects = None
+      pygame.display.update()
+    else: pygame.display.update(self._rects)
+
+  def clear(self):
+    if self._rects is None: self._screen.blit(self._bg, [0, 0])
+    else:
+      for r in self._rects: self._screen.blit(self._bg, r, r)
+    self._rects = []
 
 # The base UI screen class. A sprite list, and a background image.
+# The screen is only redrawn where sprites change. A sprite has changed
+# when its image, rect, or alpha is different from the last time it was
+# drawn, or if it sets its "dirty" attribute (for sprites that draw into
+# the same image).
 class InterfaceWindow(object):
+  # The window that last drew to the screen.
+  _owner = None
+
   def __init__(self, screen, bg_fn):
     self._screen = screen
     self._bg = pygame.image.load(os.path.join(image_path, bg_fn)).convert()
@@ -549,23 +682,78 @@ class InterfaceWindow(object):
     self._callbacks = {} #FIXME: TODO
     self._clock = pygame.time.Clock()
     self._time_bonus = 0
+    self._drawn = {} # sprite -> (image, rect, alpha) when last drawn
+    InterfaceWindow._owner = self
 
-  def update(self, screenshot = False):
-    self._sprites.update(pygame.time.get_ticks() + self._time_bonus)
-    pygame.display.update(self._sprites.draw(self._screen))
-
-    if screenshot:
-      fn = os.path.join(rc_path, "screenshot.bmp")
-      print "Saving a screenshot to", fn
-      pygame.image.save(self._screen, fn)
+  # Redraw the whole screen, e.g. after coming back from another screen.
+  def redraw(self):
+    self._screen.blit(self._bg, [0, 0])
+    pygame.display.update()
+    self._drawn = {}
+    InterfaceWindow._owner = self
 
-    self._sprites.clear(self._screen, self._bg)
-    self._clock.tick(45)
+  def update(self, screenshot = False):
+    time = pygame.time.get_ticks() + self._time_bonus
+    self._sprites.update(time)
+    sprites = self._sprites.sprites()
+
+    if InterfaceWindow._owner is not self:
+      # Something else drew over us.
+      self._screen.blit(self._bg, [0, 0])
+      self._drawn = {}
+      self._changed(sprites)
+      dirty = [self._screen.get_rect()]
+      InterfaceWindow._owner = self
+    else: dirty = coalesce_rects(self._changed(sprites))
+
+    if dirty:
+      for r in dirty: self._screen.blit(self._bg, r, r)
+      for s in sprites:
+        for i in s.rect.collidelistall(dirty):
+          self._screen.set_clip(dirty[i])
+          self._screen.blit(s.image, s.rect)
+      self._screen.set_clip()
+      pygame.display.update(dirty)
+
+    if screenshot: capture.screenshot(self._screen)
+
+    if dirty or not ui.ui.idle(): self._clock.tick(45)
+    else: self._sleep(sprites, time)
     return False
 
+  # Return the old and new areas of the sprites that changed since they
+  # were last drawn, and of sprites that were removed.
+  def _changed(self, sprites):
+    dirty = []
+    drawn = {}
+    for s in sprites:
+      state = (s.image, tuple(s.rect), s.image.get_alpha())
+      old = self._drawn.pop(s, None)
+      if old != state or getattr(s, "dirty", False):
+        if old: dirty.append(old[1])
+        dirty.append(state[1])
+        s.dirty = False
+      drawn[s] = state
+    dirty.extend([old[1] for old in self._drawn.values()])
+    self._drawn = drawn
+    return dirty
+
+  # Nothing changed; wait for input, or until a sprite needs updating.
+  def _sleep(self, sprites, time):
+    wake = time + IDLE_WAIT
+    for s in sprites:
+      t = getattr(s, "next_update", None)
+      if t is not None: wake = min(wake, t)
+    wake -= self._time_bonus
+    while pygame.time.get_ticks() < wake and not pygame.event.peek():
+      pygame.time.wait(min(10, wake - pygame.time.get_ticks()))
+
 NO_BANNER = os.path.join(image_path, "no-banner.png")
 
 class AbstractItemDisplay(object):
+  __slots__ = ("_song", "info", "filename", "banner", "isfolder", "folder",
+               "clip", "cdtitle")
+
   no_banner = make_box(size = [256, 80])
   tmp = pygame.image.load(NO_BANNER)
   tmp.set_colorkey(tmp.get_at([0, 0]))
@@ -591,18 +779,29 @@ class AbstractItemDisplay(object):
       self.cdtitle = pygame.image.load(self.info["cdtitle"])
     else: self.cdtitle = pygame.Surface([0, 0])
 
+  # Drop the loaded images; they'll be loaded again by the next render.
+  def unrender(self):
+    self.banner = self.clip = None
+
 class SongItemDisplay(AbstractItemDisplay):
+  __slots__ = ("difficulty", "diff_list", "danceitems")
+
   def __init__(self, song, game):
     AbstractItemDisplay.__init__(self, song)
     self.difficulty = song.difficulty[game]
     self.diff_list = song.diff_list[game]
     self.danceitems = {}
 
+# The difficulty table is the song's, shared, so only diff is this dance's.
 class DanceItemDisplay(AbstractItemDisplay):
+  __slots__ = ("difficulty", "diff_list", "diff", "songitem")
+
+  _diff_lists = {} # diff -> (diff,), shared by every dance
+
   def __init__(self, song, game, diff):
     AbstractItemDisplay.__init__(self, song)
-    self.difficulty = {diff:song.difficulty[game][diff]}
-    self.diff_list = [diff]
+    self.difficulty = song.difficulty[game]
+    self.diff_list = DanceItemDisplay._diff_lists.setdefault(diff, (diff,))
     self.diff = diff
     self.songitem = None
 
@@ -37,3 +37,52 @@ class Listener(object):
 
   # Received when the BPM of the song changes. The new BPM is given.
   def change_bpm(self, pid, curtime, bpm): pass
+
+# Calls each hook only on the listeners that override it, in the order
+# they were added. A listener that only wants the stepped, ok_hold and
+# broke_hold events for one pid and direction (like the top arrows) can
+# be added with that route, and then doesn't see the others at all.
+class Dispatcher(object):
+  def __init__(self):
+    self._listeners = [] # (listener, route) pairs
+    self._subscribers = {}
+
+  def add(self, listener, route = None):
+    self._listeners.append((listener, route))
+    self._subscribers = {}
+
+  def extend(self, listeners):
+    for l in listeners: self.add(l)
+
+  # The bound hook methods to call for an event with a route (pid, dir),
+  # or for every listener if route is None.
+  def subscribers(self, hook, route = None):
+    key = (hook, route)
+    if key not in self._subscribers:
+      base = Listener.__dict__[hook]
+      self._subscribers[key] = [
+        getattr(l, hook) for l, r in self._listeners
+        if (route is None or r is None or r == route) and
+        getattr(getattr(type(l), hook, None), "im_func", None) is not base]
+    return self._subscribers[key]
+
+  def ok_hold(self, pid, curtime, dir, whichone):
+    for f in self.subscribers("ok_hold", (pid, dir)):
+      f(pid, curtime, dir, whichone)
+
+  def broke_hold(self, pid, curtime, dir, whichone):
+    for f in self.subscribers("broke_hold", (pid, dir)):
+      f(pid, curtime, dir, whichone)
+
+  # combo is a function returning the current combo; it's called for
+  # each listener, since the combo listener changes it partway through.
+  def stepped(self, pid, dir, curtime, etime, rating, combo):
+    for f in self.subscribers("stepped", (pid, dir)):
+      f(pid, dir, curtime, etime, rating, combo())
+
+  def set_song(self, pid, bpm, difficulty, count, holds, feet):
+    for f in self.subscribers("set_song"):
+      f(pid, bpm, difficulty, count, holds, feet)
+
+  def change_bpm(self, pid, curtime, bpm):
+    for f in self.subscribers("change_bpm"): f(pid, curtime, bpm)
@@ -1,20 +1,28 @@
+import bisect
 import pygame
 import colors
 
 from constants import *
 from fonttheme import FontTheme
 
+# Number of rendered lyric lines kept per channel, and how many lines
+# past the current one are rendered ahead of time.
+CACHE_SIZE = 6
+AHEAD = 2
+
+# Lyrics are only rendered when they're about to be shown, one line per
+# frame, so nothing is rendered if lyrics are turned off.
 class LyricChannel(pygame.sprite.Sprite):
   def __init__(self, top, color):
     pygame.sprite.Sprite.__init__(self)
     self._lyrics = []
     self._times = []
-    self._prender = []
-    self._lasttime = -1000
+    self._rendered = {} # index -> image
+    self._blank = pygame.surface.Surface([0, 0])
 
-    self.image = pygame.surface.Surface([0, 0])
+    self.image = self._blank
 
-    self._oldlyric = -1
+    self._current = -1
     self._color = color
     self._darkcolor = colors.darken_div(color)
     self._top = top
@@ -22,37 +30,58 @@ class LyricChannel(pygame.sprite.Sprite):
     self.rect = self.image.get_rect()
     self.rect.top = self._top
     self.rect.centerx = 320
-       
+
   def addlyric(self, time, lyric):
-    self._lyrics.append(lyric)
-    self._times.append(time)
- 
-    image1 = FontTheme.Dance_lyrics_display.render(lyric, True, self._darkcolor)
-    image2 = FontTheme.Dance_lyrics_display.render(lyric, True, self._color)
-    rimage = pygame.Surface(image1.get_size())
-    rimage.fill([64, 64, 64])
-    rimage.blit(image1, [-2, -2])
-    rimage.blit(image1, [2, 2])
-    rimage.blit(image2, [0, 0])
-    rimage.set_colorkey(rimage.get_at([0, 0]), RLEACCEL)
+    i = bisect.bisect_right(self._times, time)
+    self._times.insert(i, time)
+    self._lyrics.insert(i, lyric)
+    self._rendered = {}
 
-    self._prender.append(rimage)
+  def _render(self, i):
+    if i not in self._rendered:
+      lyric = self._lyrics[i]
+      image1 = FontTheme.Dance_lyrics_display.render(lyric, True, self._darkcolor)
+      image2 = FontTheme.Dance_lyrics_display.render(lyric, True, self._color)
+      rimage = pygame.Surface(image1.get_size())
+      rimage.fill([64, 64, 64])
+      rimage.blit(image1, [-2, -2])
+      rimage.blit(image1, [2, 2])
+      rimage.blit(image2, [0, 0])
+      rimage.set_colorkey(rimage.get_at([0, 0]), RLEACCEL)
+      self._rendered[i] = rimage
+      if len(self._rendered) > CACHE_SIZE:
+        # Drop the line furthest from the current one.
+        far = max(self._rendered, key = lambda j: abs(j - self._current))
+        del(self._rendered[far])
+    return self._rendered[i]
 
   def update(self, curtime):
-    current = -1
-    timediff = curtime - self._lasttime
-    for i in self._times:
-      if curtime >= i:
-        current = self._times.index(i)
-        self._lasttime = i
- 
-    if current != self._oldlyric:
-      self.image = self._prender[current]
+    # Usually the time only moves forward, a little; if it moved back,
+    # find the current lyric again.
+    current = self._current
+    if current >= 0 and curtime < self._times[current]:
+      current = bisect.bisect_right(self._times, curtime) - 1
+    else:
+      while (current + 1 < len(self._times) and
+             self._times[current + 1] <= curtime):
+        current += 1
+
+    if current != self._current:
+      self._current = current
+      if current == -1: self.image = self._blank
+      else: self.image = self._render(current)
       self.rect = self.image.get_rect()
       self.rect.top = self._top
       self.rect.centerx = 320
-     
+    else:
+      # Render one upcoming line per frame.
+      for i in range(current + 1, min(current + 1 + AHEAD, len(self._times))):
+        if i not in self._rendered:
+          self._render(i)
+          break
+
     if current != -1:
+      timediff = curtime - self._times[current]
       holdtime = len(self._lyrics[current]) * 0.045
       alp = 255
       if timediff > holdtime:
@@ -61,8 +90,6 @@ class LyricChannel(pygame.sprite.Sprite):
 
       self.image.set_alpha(int(alp))
 
-    self._oldlyric = current
-
 class Lyrics(object):
   def __init__(self, clrs):
     self._channels = {}
@@ -238,6 +238,9 @@ def do(screen, songdata):
         [_("Arrow Effects"), rotate_index_opt,
          ('explodestyle', (_('none'), _('rotate'), _('scale'), _('rotate & scale')))],
         [_("Backgrounds"), onoff_opt, ('showbackground',)],
+        [_("Frame Limit"), tuple_opt, ('maxfps',
+                                    [(60, "60"), (85, "85"), (120, "120"),
+                                     (0, _("None"))])],
         [_("Brightness"), tuple_opt, ('bgbrightness',
                                    [(32, _('very dark')),
                                     (64, _('dark')),
@@ -253,10 +256,14 @@ def do(screen, songdata):
         ),
        (_("Interface Options"),
         [_("Save Input"), onoff_opt, ('saveinput',)],
+        [_("Save Replays"), onoff_opt, ('savereplays',)],
         [_("Song Previews"), tuple_opt, ('previewmusic',
                                       [(0, "Off"), (1, "On"), (2, "Safe")])],
         [_("Folders"), onoff_opt, ("folders",)],
         [_("Timer Display"), onoff_opt, ('fpsdisplay',)],
+        [_("Frame Profiler"), tuple_opt, ('profile',
+                                       [(0, _("Off")), (1, _("Save")),
+                                        (2, _("Save & Show"))])],
         [_("Song Info Screen"), tuple_opt, ('songinfoscreen',
                                          zip([0, 1, 2],
                                              [_("Never"), _("Multi-song Only"), _("Always")]))],
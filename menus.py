@@ -56,6 +56,7 @@ class MenuItem(object):
       else: return ev # Shouldn't happen
     elif callable(self.callbacks.get(ev)):
       text, subtext = self.callbacks[ev](*self.args)
+      save_config()
       if text != None: self.text = text #str(text)
       if subtext != None: self.subtext = subtext #str(subtext)
       self.render()
@@ -0,0 +1,99 @@
+# Write-behind saving of config, records, and input mappings. save()
+# only queues the data; a thread writes it a moment later, so nothing
+# that handles input or draws frames ever waits for the disk. Saving the
+# same file again before it's written replaces the queued data, so a
+# burst of changes is one write.
+#
+# Files are written to a temporary file that is then renamed over the
+# old one, so a crash never leaves a half-written file behind.
+
+import os
+import time
+import threading
+
+# Seconds to wait after a save() for more saves to the same files.
+DELAY = 1.0
+
+# Write data to filename atomically.
+def atomic_write(filename, data, mode = "w"):
+  tmp = filename + ".tmp"
+  f = file(tmp, mode)
+  try:
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+  finally: f.close()
+  # Windows can't rename over an existing file.
+  if os.name == "nt" and os.path.exists(filename): os.remove(filename)
+  os.rename(tmp, filename)
+
+class Writer(threading.Thread):
+  def __init__(self):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self._pending = {} # filename -> (data, mode)
+    self._order = [] # filenames in the order they were first queued
+    self._lock = threading.Condition()
+    self._busy = False
+    self.start()
+
+  def save(self, filename, data, mode = "w"):
+    self._lock.acquire()
+    if filename not in self._pending: self._order.append(filename)
+    self._pending[filename] = (data, mode)
+    self._lock.notify()
+    self._lock.release()
+
+  # Write everything queued so far, waiting for the thread if it is
+  # writing already.
+  def flush(self):
+    self._lock.acquire()
+    while self._busy: self._lock.wait()
+    order, pending = self._take()
+    self._lock.release()
+    self._write(order, pending)
+
+  # Must be called with the lock held.
+  def _take(self):
+    order, pending = self._order, self._pending
+    self._order, self._pending = [], {}
+    return order, pending
+
+  def _write(self, order, pending):
+    for fn in order:
+      data, mode = pending[fn]
+      try: atomic_write(fn, data, mode)
+      except (IOError, OSError), e:
+        print _("W: Unable to write %s") % fn
+        print e
+
+  def run(self):
+    while True:
+      self._lock.acquire()
+      while not self._pending: self._lock.wait()
+      self._lock.release()
+      time.sleep(DELAY) # let more saves arrive
+
+      self._lock.acquire()
+      self._busy = True
+      order, pending = self._take()
+      self._lock.release()
+
+      self._write(order, pending)
+
+      self._lock.acquire()
+      self._busy = False
+      self._lock.notifyAll()
+      self._lock.release()
+
+_writer = None
+
+# Queue data to be written to filename soon.
+def save(filename, data, mode = "w"):
+  global _writer
+  if _writer is None: _writer = Writer()
+  _writer.save(filename, data, mode)
+
+# Write everything that has been queued, before exiting.
+def flush():
+  if _writer is not None: _writer.flush()
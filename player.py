@@ -9,6 +9,7 @@ import combos
 import grades
 import judge
 import stats
+import animstrip
 
 from constants import *
 
@@ -16,7 +17,8 @@ from util import toRealTime
 from gfxtheme import GFXTheme
 from announcer import Announcer
 
-from listener import Listener
+from listener import Listener, Dispatcher
+from config import Options
 
 from pygame.sprite import RenderUpdates, RenderClear
 
@@ -129,14 +131,18 @@ class HoldJudgeDisp(Listener, pygame.sprite.Sprite):
         self.image.blit(s, [x, 0])
         self.slotold[i] = s
 
+# Frames in the zoom-out of a step judgement.
+JUDGE_FRAMES = 12
+
+# Seconds the zoom-out takes.
+JUDGE_ZOOM_TIME = 0.2
+
 class JudgingDisp(Listener, pygame.sprite.Sprite):
   def __init__(self, playernum, game):
     pygame.sprite.Sprite.__init__(self)
 
     self._sticky = mainconfig['stickyjudge']
-    self._needsupdate = True
     self._laststep = 0
-    self._oldzoom = -1
     self._bottom = 320
     self._centerx = game.sprite_center + (playernum * game.player_offset)
         
@@ -167,38 +173,38 @@ class JudgingDisp(Listener, pygame.sprite.Sprite):
     boo.set_colorkey(boo.get_at([0, 0]), RLEACCEL)
     miss.set_colorkey(miss.get_at([0, 0]), RLEACCEL)
 
-    self._images = { "V": marvelous, "P": perfect, "G": great,
-                     "O": okay, "B": boo, "M": miss }
-    
+    images = { "V": marvelous, "P": perfect, "G": great,
+               "O": okay, "B": boo, "M": miss }
+
+    # Each judgement zooms from full size to 60% over JUDGE_ZOOM_TIME.
+    self._strips = {}
+    for rating, img in images.items():
+      self._strips[rating] = animstrip.zoom_strip(img, JUDGE_FRAMES, 1, 0.6,
+                                                  colorkey = True)
+    self._strip = None
+
     self.image = self._space
-    self._baseimage = self._space
+    self.rect = self.image.get_rect()
 
   def stepped(self, pid, dir, curtime, etime, rating, combo):
     if rating is None: return
 
     self._laststep = curtime
     self._rating = rating
-    self._baseimage = self._images.get(rating, self._space)
+    self._strip = self._strips.get(rating)
 
   def update(self, curtime):
     self._laststep = min(curtime, self._laststep)
     steptimediff = curtime - self._laststep
 
-    zoomzoom = 1 - min(steptimediff, 0.2) * 2
-
-    if zoomzoom != self._oldzoom:
-      self._oldzoom = zoomzoom
-      self._needsupdate = True
-      if (steptimediff > 0.36) and not self._sticky:
-        self.image = self._space
+    if self._strip: image = self._strip.get(steptimediff / JUDGE_ZOOM_TIME)
+    else: image = self._space
 
-    if self._needsupdate:
-      self.image = pygame.transform.rotozoom(self._baseimage, 0, zoomzoom)
+    if image is not self.image:
+      self.image = image
       self.rect = self.image.get_rect()
       self.rect.centerx = self._centerx
       self.rect.bottom = self._bottom
-      self.image.set_colorkey(self.image.get_at([0, 0]), RLEACCEL)
-      self._needsupdate = False
 
 class Player(object):
 
@@ -209,6 +215,8 @@ class Player(object):
     self.failed = False
     self.escaped = False
     self.states = {}
+    self._config = config
+    self._songconf = songconf
 
     self.__dict__.update(config)
 
@@ -235,18 +243,21 @@ class Player(object):
     self.stats = stats.Stats()
     self.announcer = Announcer(mainconfig["djtheme"])
 
-    self.listeners = [self.combos, self.score, self.grade, self.lifebar,
-                      self.judging_disp, self.stats, self.announcer]
+    # The top arrows and their effects only want their own steps.
+    self.listeners = Dispatcher()
+    self.listeners.extend([self.combos, self.score, self.grade, self.lifebar,
+                           self.judging_disp, self.stats, self.announcer])
 
     if not game.double:
       self.judge = judge.judges[songconf["judge"]](self.pid, songconf)
-      self.listeners.append(self.judge)
+      self.listeners.add(self.judge)
       arr, arrfx = self.theme.toparrows(self.top, self.pid)
       self.toparr = arr
       self.toparrfx = arrfx
-      self.listeners.extend(arr.values() + arrfx.values())
+      for a in arr.values() + arrfx.values():
+        self.listeners.add(a, (a.pid, a.dir))
       self.holdtext = HoldJudgeDisp(self.pid, self, self.game)
-      self.listeners.append(self.holdtext)
+      self.listeners.add(self.holdtext)
     else:
       Judge = judge.judges[songconf["judge"]]
       self.judge = [Judge(self.pid * 2, songconf),
@@ -258,18 +269,21 @@ class Player(object):
                      self.theme.arrows(self.pid * 2 + 1)]
       self.toparr = [arr1, arr2]
       self.toparrfx = [arrfx1, arrfx2]
-      self.listeners.extend(arr1.values() + arr2.values() +
-                            arrfx1.values() + arrfx2.values())
+      for a in (arr1.values() + arr2.values() +
+                arrfx1.values() + arrfx2.values()):
+        self.listeners.add(a, (a.pid, a.dir))
       self.holdtext = [HoldJudgeDisp(self.pid * 2, self, self.game),
                        HoldJudgeDisp(self.pid * 2 + 1, self, self.game)]
       self.listeners.extend(self.holdtext)
 
   def set_song(self, song, diff, lyrics):
     self.difficulty = diff
+    # Everything during the song reads these, not mainconfig.
+    self.options = Options(mainconfig, self._songconf, self._config)
 
     offset = 0
     if self.audiosync > 0:
-      offset = mainconfig['masteroffset']
+      offset = self.options.masteroffset
 
     if self.game.double:
       self.holding = [[-1] * len(self.game.dirs), [-1] * len(self.game.dirs)]
@@ -296,7 +310,7 @@ class Player(object):
 
       args = (self.pid, self.bpm, diff, count, total_holds,
               self.steps[0].feet)
-      for l in self.listeners: l.set_song(*args)
+      self.listeners.set_song(*args)
 
     else:
       self.holding = [-1] * len(self.game.dirs)
@@ -311,7 +325,7 @@ class Player(object):
 
       args = (self.pid, self.bpm, diff, self.steps.totalarrows,
               holds, self.steps.feet)
-      for l in self.listeners: l.set_song(*args)
+      self.listeners.set_song(*args)
 
   def start_song(self):
     self.toparr_group = RenderUpdates()
@@ -320,7 +334,7 @@ class Player(object):
     self.text_group.add([self.score, self.lifebar, self.judging_disp])
     self.text_group.add(self.holdtext)
 
-    if mainconfig["showcombo"]: self.text_group.add(self.combos)
+    if self.options.showcombo: self.text_group.add(self.combos)
 
     if self.game.double:
       self.arrow_group = [OrderedRenderUpdates(),
@@ -329,7 +343,7 @@ class Player(object):
       for i in range(2):
         self.steps[i].play()
         for d in self.game.dirs:
-          if mainconfig["explodestyle"] > -1:
+          if self.options.explodestyle > -1:
             self.toparrfx[i][d].add(self.fx_group)
           if not self.dark: self.toparr[i][d].add(self.toparr_group)
       self.sprite_groups = [self.toparr_group, self.arrow_group[0],
@@ -339,7 +353,7 @@ class Player(object):
       self.steps.play()
       self.arrow_group = OrderedRenderUpdates()
       for d in self.game.dirs:
-        if mainconfig["explodestyle"] > -1: self.toparrfx[d].add(self.fx_group)
+        if self.options.explodestyle > -1: self.toparrfx[d].add(self.fx_group)
         if not self.dark: self.toparr[d].add(self.toparr_group)
       self.sprite_groups = [self.toparr_group, self.arrow_group,
                             self.fx_group, self.text_group]
@@ -356,7 +370,7 @@ class Player(object):
                             self.judge)
 
   def _get_next_events(self, song, arrow_grp, arrow_gfx, steps, judge):
-    evt = steps.get_events()
+    evt = steps.get_events(song.clock.now())
     if evt is not None:
       events, nevents, time, bpm = evt
       for ev in events:
@@ -390,11 +404,13 @@ class Player(object):
 
       arrow_grp.add(newsprites)
 
-  def check_sprites(self, curtime, curbeat, arrows, steps, fx_data, judge):
+  def check_misses(self, curtime, judge):
     misses = judge.expire_arrows(curtime)
     for d in misses:
-      for l in self.listeners:
-        l.stepped(self.pid, d, curtime, -1, "M", self.combos.combo)
+      self.listeners.stepped(self.pid, d, curtime, -1, "M",
+                             self.current_combo)
+
+  def check_sprites(self, curtime, curbeat, arrows, steps, fx_data, judge):
     for rating, dir, time in fx_data:
       if (rating == "V" or rating == "P" or rating == "G"):
         for spr in arrows.sprites():
@@ -433,15 +449,17 @@ class Player(object):
               if (spr.endtime == timef1 and spr.dir == dir):
                 if spr.broken_at(curtime, judge):
                   args = (pid, curtime, dir, current_hold)
-                  for l in self.listeners: l.broke_hold(*args)
+                  self.listeners.broke_hold(*args)
                 break
       else:
         if holding[dir_idx] > -1:
           if judge.holdsub.get(holding[dir_idx]) != -1:
             args = (pid, curtime, dir, holding[dir_idx])
-            for l in self.listeners: l.ok_hold(*args)
+            self.listeners.ok_hold(*args)
             holding[dir_idx] = -1
 
+  def current_combo(self): return self.combos.combo
+
   def handle_keydown(self, ev, time):
     ev = ev[0], self.game.dirmap.get(ev[1], ev[1])
     if ev[1] not in self.game.dirs: return
@@ -451,13 +469,13 @@ class Player(object):
     if self.game.double:
       pid = ev[0] & 1
       rating, dir, etime = self.judge[pid].handle_key(ev[1], time)
-      for l in self.listeners:
-        l.stepped(ev[0], dir, time, etime, rating, self.combos.combo)
+      self.listeners.stepped(ev[0], dir, time, etime, rating,
+                             self.current_combo)
       self.fx_data[pid].append((rating, dir, etime))
     else:
       rating, dir, etime = self.judge.handle_key(ev[1], time)
-      for l in self.listeners:
-        l.stepped(ev[0], dir, time, etime, rating, self.combos.combo)
+      self.listeners.stepped(ev[0], dir, time, etime, rating,
+                             self.current_combo)
       self.fx_data.append((rating, dir, etime))
 
   def handle_keyup(self, ev, time):
@@ -472,12 +490,31 @@ class Player(object):
 
     if newbpm != self.bpm:
       self.bpm = newbpm
-      for l in self.listeners: l.change_bpm(pid, time, newbpm)
+      self.listeners.change_bpm(pid, time, newbpm)
         
-  def clear_sprites(self, screen, bg):
-    for g in self.sprite_groups: g.clear(screen, bg)
+  # Judging that has to happen whether or not a frame is drawn: missed
+  # arrows, held and broken holds, and BPM changes. The dance loop runs
+  # this at a fixed rate, so judging doesn't depend on the frame rate.
+  def logic(self, time):
+    if self.game.double:
+      for i in range(2):
+        self.check_holds(self.pid * 2 + i, time, self.arrow_group[i],
+                         self.steps[i], self.judge[i], self.toparrfx[i],
+                         self.holding[i])
+        self.check_bpm_change(self.pid * 2 + i, time, self.steps[i],
+                              self.judge[i])
+        self.check_misses(time, self.judge[i])
+    else:
+      self.check_holds(self.pid, time, self.arrow_group, self.steps,
+                       self.judge, self.toparrfx, self.holding)
+      self.check_bpm_change(self.pid, time, self.steps, self.judge)
+      self.check_misses(time, self.judge)
 
-  def game_loop(self, time, screen):    
+    if self.lifebar.gameover == lifebars.FAILED and not self.failed:
+      self.failed = True
+
+  # Move and draw the sprites for the current time, once per frame.
+  def game_loop(self, time, screen):
     if self.game.double:
       for i in range(2):
         if len(self.steps[i].lastbpmchangetime) == 0:
@@ -491,12 +528,7 @@ class Player(object):
               oldbpmsub = bpmsub
             else: break
           cur_beat += (time - oldbpmsub[0]) / (60.0 / oldbpmsub[1])
-            
-        self.check_holds(self.pid * 2 + i, time, self.arrow_group[i],
-                         self.steps[i], self.judge[i], self.toparrfx[i],
-                         self.holding[i])
-        self.check_bpm_change(self.pid * 2 + i, time, self.steps[i],
-                              self.judge[i])
+
         self.check_sprites(time, cur_beat, self.arrow_group[i],
                            self.steps[i], self.fx_data[i], self.judge[i])
 
@@ -513,17 +545,12 @@ class Player(object):
           else: break
         cur_beat += (time - oldbpmsub[0]) / (60.0 / oldbpmsub[1])
 
-      self.check_holds(self.pid, time, self.arrow_group, self.steps,
-                       self.judge, self.toparrfx, self.holding)
-      self.check_bpm_change(self.pid, time, self.steps, self.judge)
       self.check_sprites(time, cur_beat, self.arrow_group, self.steps,
                          self.fx_data, self.judge)
 
 
     self.fx_group.update(time)
     self.text_group.update(time)
-    if self.lifebar.gameover == lifebars.FAILED and not self.failed:
-      self.failed = True
 
     rects = []
     for g in self.sprite_groups: rects.extend(g.draw(screen))
@@ -1,4 +1,5 @@
 #!/bin/sh
 
-python /usr/lib/python2.3/profile.py pydance.py > /dev/null
-mv ~/.pydance/pydance.log Profile-`date +%s`
+# For per-frame timings while dancing, turn on the frame profiler in the
+# interface options instead; it saves them to ~/.pydance/profiles.
+python -m cProfile -o Profile-`date +%s` pydance.py > /dev/null
@@ -18,6 +18,7 @@ def print_help():
   print _(" -f, --filename     load and play a step file")
   print _(" -m, --mode         the mode to play the file in (default SINGLE)")
   print _(" -d, --difficulty   the difficult to play the file (default BASIC)")
+  print _(" -r, --replay       play back a saved replay")
   raise SystemExit
 
 def print_version():
@@ -40,7 +41,11 @@ import pygame
 import courses
 import colors
 import records
+import persist
+import capture
+import songindex
 import menudriver
+import replay
 
 from fileparsers import SongItem
 from pygame.mixer import music
@@ -74,6 +79,16 @@ def play_and_quit(fn, mode, difficulty):
              [player_config] * pc, game_config, mode)
   raise SystemExit
 
+# Play back a saved replay, and then quit.
+def replay_and_quit(fn):
+  rep = replay.Replay(fn)
+  screen = set_display_mode()
+  pygame.display.set_caption("pydance " + VERSION)
+  pygame.mouse.set_visible(0)
+  dance.play(screen, [(rep.filename, rep.difficulties)],
+             rep.players, rep.songconf, rep.mode, rep)
+  raise SystemExit
+
 # Pass a list of files to a constructor (Ctr) that takes the filename
 # as the first argument, and the args tuple as the rest.
 def load_files(screen, files, type, Ctr, args):
@@ -125,15 +140,18 @@ def main():
   mode = "SINGLE"
   difficulty = "BASIC"
   test_file = None
+  replay_file = None
   for opt, arg in getopt(sys.argv[1:],
-                         "hvf:d:m:", ["help", "version", "filename=",
-                                      "difficulty=", "mode="])[0]:
+                         "hvf:d:m:r:", ["help", "version", "filename=",
+                                        "difficulty=", "mode=", "replay="])[0]:
     if opt in ["-h", _("--help")]: print_help()
     elif opt in ["-v", _("--version")]: print_version()
     elif opt in ["-f", _("--filename")]: test_file = arg
     elif opt in ["-m", _("--mode")]: mode = arg
     elif opt in ["-d", _("--difficulty")]: difficulty = arg
+    elif opt in ["-r", _("--replay")]: replay_file = arg
 
+  if replay_file: replay_and_quit(replay_file)
   if test_file: play_and_quit(test_file, mode, difficulty)
 
   song_list = []
@@ -185,6 +203,7 @@ def main():
                    (song_dict, record_dict))
   crs.extend(courses.make_players(song_dict, record_dict))
   records.verify(record_dict)
+  songindex.build(songs)
 
   # Let the GC clean these up if it needs to.
   song_list = None
@@ -205,10 +224,10 @@ def main():
 
   # Clean up shit.
   music.stop()
+  capture.flush()
   pygame.quit()
-  mainconfig.update(game_config)
-  mainconfig.update(player_config)
-  mainconfig.write(os.path.join(rc_path, "pydance.cfg"))
-  records.write()
+  save_config()
+  records.save()
+  persist.flush()
 
 if __name__ == '__main__': main()
@@ -2,6 +2,7 @@
 
 from constants import *
 import cPickle as pickle
+import persist
 import grades
 import games
 
@@ -11,6 +12,10 @@ try: records = pickle.load(file(record_fn, "rb"))
 except: records = {}
 bad_records = {}
 
+# Counts the new best ranks added this session, so sorted lists that
+# use them know when to sort again.
+version = 0
+
 # Before starting, move any records we don't know about into a different hash,
 # so we don't try to load them for player's {best,worst}.
 # Do store them however, so when the songs appear again they'll be valid.
@@ -35,28 +40,38 @@ def verify(recordkeys):
 # done in the song selector.
 
 def add(recordkey, diff, game, rank, name):
+  global version
   game = games.VERSUS2SINGLE.get(game, game)
   t = (recordkey, diff, game)
   if t in records:
     if rank > records[t][0]:
       records[t] = (rank, name, records[t][2] + 1)
+      version += 1
       return True
     else:
       records[t] = records[t][:2] + (records[t][2] + 1,)
       return False
   else:
     records[t] = (rank, name, 1)
+    version += 1
     return True
 
 def get(recordkey, diff, game):
   game = games.VERSUS2SINGLE.get(game, game)
   return records.get((recordkey, diff, game), (-1, ""))
 
-def write():
+def _dump():
   r = {}
   r.update(bad_records)
   r.update(records)
-  pickle.dump(r, file(record_fn, "wb"), 2)
+  return pickle.dumps(r, 2)
+
+def write():
+  persist.atomic_write(record_fn, _dump(), "wb")
+
+# Like write, but done soon by a background thread.
+def save():
+  persist.save(record_fn, _dump(), "wb")
 
 # Highest scores
 def best(index, diffs, game):
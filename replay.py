@@ -0,0 +1,89 @@
+# Recording and playback of everything the players pressed during a
+# song. A replay file starts with MAGIC, a version byte, and a pickled
+# header saying which song, mode, difficulties, and options were played;
+# then comes one EVENT record per press or release, with its song time.
+#
+# Played back, a replay sends the same presses at the same song times
+# to the players, so it gets the same score.
+
+import os
+import time
+import struct
+import cPickle as pickle
+
+from constants import *
+
+MAGIC = "PYDR"
+VERSION = 1
+EXTENSION = ".rep"
+
+# Song time, pad, 1 for a press or 0 for a release, and direction.
+EVENT = "<dBBc"
+EVENT_SIZE = struct.calcsize(EVENT)
+
+class Recorder(object):
+  # seed is what the random number generator was seeded with before the
+  # steps were made, for shuffled and random steps.
+  def __init__(self, filename, title, playmode, diffs, configs, songconf,
+               seed):
+    # Titles can be unicode; they're kept as UTF-8.
+    if isinstance(title, unicode): title = title.encode("utf-8")
+    self.header = { "filename": filename, "title": title,
+                    "mode": playmode, "difficulties": list(diffs),
+                    "players": [dict(c) for c in configs],
+                    "songconf": dict(songconf), "seed": seed }
+    self._events = []
+
+  # Record a press or release (direction prefixed by "-").
+  def add(self, time, pad, dir):
+    if dir[0] == "-": press, dir = 0, dir[1:]
+    else: press = 1
+    self._events.append(struct.pack(EVENT, time, pad, press, dir))
+
+  # Write the replay to rc_path/replays, and return the file name.
+  def save(self):
+    path = os.path.join(rc_path, "replays")
+    if not os.path.isdir(path): os.mkdir(path)
+    # Only ASCII in the file name, so it can be opened and printed in
+    # any locale.
+    name = "".join([c for c in self.header["title"] if c < "\x80" and
+                    (c.isalnum() or c in "-_")])
+    fn = os.path.join(path, "%s-%d%s" % (name or "song", int(time.time()),
+                                         EXTENSION))
+    header = pickle.dumps(self.header, 2)
+    f = file(fn, "wb")
+    f.write(MAGIC + struct.pack("<BI", VERSION, len(header)))
+    f.write(header)
+    f.write("".join(self._events))
+    f.close()
+    return fn
+
+# A saved replay. It can be passed as the inputs to dance.dance.
+class Replay(object):
+  def __init__(self, filename):
+    data = file(filename, "rb").read()
+    if data[:len(MAGIC)] != MAGIC:
+      raise RuntimeError(_("%s is not a pydance replay.") % filename)
+    pos = len(MAGIC)
+    version, size = struct.unpack("<BI", data[pos:pos + 5])
+    if version != VERSION:
+      raise RuntimeError(_("%s is from another version of pydance.") % filename)
+    pos += 5
+    self.__dict__.update(pickle.loads(data[pos:pos + size]))
+    pos += size
+
+    self._events = []
+    for i in range(pos, len(data) - EVENT_SIZE + 1, EVENT_SIZE):
+      when, pad, press, dir = struct.unpack(EVENT, data[i:i + EVENT_SIZE])
+      if not press: dir = "-" + dir
+      self._events.append((when, pad, dir))
+    self._idx = 0
+
+  def rewind(self): self._idx = 0
+
+  def due(self, time):
+    start = self._idx
+    while (self._idx < len(self._events) and
+           self._events[self._idx][0] <= time):
+      self._idx += 1
+    return self._events[start:self._idx]
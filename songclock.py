@@ -0,0 +1,104 @@
+# A smoothed clock for the song being played.
+#
+# pygame.mixer.music.get_pos() only moves once per audio buffer, so
+# reading it directly makes arrows jitter and rounds judging to the
+# buffer length. The song clock runs off the millisecond system timer
+# instead, and follows the mixer: it estimates how fast the mixer runs
+# against the timer from recent mixer readings, moves a little towards
+# the mixer position each time it changes, ignores readings that are
+# too far off, and only jumps if the mixer stays far off.
+
+import pygame
+from pygame.mixer import music
+
+# Number of mixer readings used to estimate the mixer rate.
+RATE_SAMPLES = 64
+
+# Don't estimate a rate from fewer readings than this.
+MIN_RATE_SAMPLES = 8
+
+# The fraction of the difference to the mixer position corrected for
+# each mixer reading.
+SLEW = 0.1
+
+# Readings further off than this (in ms) are ignored...
+OUTLIER = 100
+
+# ...unless there are this many in a row, in which case the mixer really
+# moved, and the clock jumps to it.
+MAX_OUTLIERS = 5
+
+class SongClock(object):
+  def __init__(self):
+    self.start()
+
+  # Start following a song that has just started playing. The clock
+  # runs correction times faster than the mixer; this is for sound
+  # cards that play at a different rate than they claim to.
+  def start(self, correction = 1.0):
+    self.correction = correction
+    self.rate = 1.0 # Mixer ms per timer ms
+    self._base_ticks = pygame.time.get_ticks()
+    self._base_pos = 0.0
+    self._samples = []
+    self._last_pos = None
+    self._outliers = 0
+    self._now = 0.0
+
+  # The mixer position expected at a given time.
+  def _predict(self, ticks):
+    return self._base_pos + (ticks - self._base_ticks) * self.rate
+
+  # Read the timer and mixer, and return the new song time. This should
+  # be called once per frame; everything else uses now().
+  def update(self):
+    ticks = pygame.time.get_ticks()
+    pos = music.get_pos()
+    if pos >= 0 and pos != self._last_pos:
+      self._last_pos = pos
+      self._sample(ticks, pos)
+    self._now = max(self._now,
+                    self._predict(ticks) * self.correction / 1000.0)
+    return self._now
+
+  # The song time (in seconds) as of the last update.
+  def now(self): return self._now
+
+  # The song time right now, without reading the mixer or moving the
+  # clock; for timestamping input between updates.
+  def peek(self):
+    return max(self._now, self._predict(pygame.time.get_ticks()) *
+               self.correction / 1000.0)
+
+  def _sample(self, ticks, pos):
+    err = pos - self._predict(ticks)
+    if self._samples and abs(err) > OUTLIER:
+      self._outliers += 1
+      if self._outliers < MAX_OUTLIERS: return
+      self._samples = []
+      self._now = 0.0
+
+    self._outliers = 0
+    if not self._samples:
+      self._base_ticks, self._base_pos = ticks, float(pos)
+      self._samples.append((ticks, pos))
+      return
+
+    self._samples.append((ticks, pos))
+    if len(self._samples) > RATE_SAMPLES: self._samples.pop(0)
+    if len(self._samples) >= MIN_RATE_SAMPLES:
+      self.rate = min(1.1, max(0.9, self._slope()))
+
+    predicted = self._predict(ticks)
+    self._base_ticks = ticks
+    self._base_pos = predicted + SLEW * (pos - predicted)
+
+  # Least-squares slope of mixer position against timer ticks.
+  def _slope(self):
+    n = float(len(self._samples))
+    mt = sum([t for t, p in self._samples]) / n
+    mp = sum([p for t, p in self._samples]) / n
+    num = sum([(t - mt) * (p - mp) for t, p in self._samples])
+    den = sum([(t - mt) ** 2 for t, p in self._samples])
+    if den == 0: return self.rate
+    return num / den
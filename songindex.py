@@ -0,0 +1,303 @@
+# Folder and sort indexes for the song selector. The index is built once,
+# when the song library is loaded, and kept up to date as songs are added,
+# so entering the song selector or changing the sort mode never has to
+# look at every song again.
+
+import re
+import bisect
+import records
+import util
+
+from constants import *
+from interface import SongItemDisplay, DanceItemDisplay
+from fileparsers import shared
+
+# Sort keys, given a song or dance and the game mode.
+SORTS = {
+  "subtitle": lambda x, g: x.info["subtitle"].lower(),
+  "title": lambda x, g: (x.info["title"].lower(), SORTS["subtitle"](x, g)),
+  "artist": lambda x, g: (x.info["artist"].lower(), SORTS["title"](x, g)),
+  "bpm": lambda x, g: (x.info["bpm"], SORTS["title"](x, g)),
+  "mix": lambda x, g: (x.info["mix"], SORTS["title"](x, g)),
+  "rating": lambda x, g: (x.difficulty[x.diff_list[0]], SORTS["rank"](x, g)),
+  "difficulty": lambda x, g: (util.difficulty_sort_key(x.diff_list[0]), SORTS["rating"](x, g)),
+  "rank": lambda x, g: -records.get(x.info["recordkey"], x.diff_list[0], g)[0],
+  }
+
+# Sorts whose keys include the player's records, so they're sorted again
+# when a new record is set.
+RANKED_SORTS = ["rating", "difficulty"]
+
+SORT_DANCES = {
+  "mix":False,
+  "title":False,
+  "artist":False,
+  "bpm":False,
+  "rating":True,
+  "difficulty":True
+  }
+
+# Dance sort names define sorting formats which are tied to dance data in songs;
+# therefore they can only be used if subfolders are allowed as each song may
+# appear in multiple folders.
+SORT_NAMES = ["mix", "title", "artist", "bpm", "rating", "difficulty"]
+NUM_SORTS = len(SORT_NAMES)
+
+BPM_RANGES = ((0, 50), (50, 100), (100, 121), (110, 120), (120, 130),
+              (130, 140), (140, 150), (150, 160), (160, 170), (170, 180),
+              (180, 190), (190, 200), (200, 225), (225, 250), (250, 275),
+              (275, 299.99999999))
+BPM_LABELS = [(rng, "%3d - %3d" % rng) for rng in BPM_RANGES]
+
+# Return the folder labels a song belongs to for each song (not dance)
+# sort. A song can end up in more than one BPM folder.
+def song_folders(s):
+  folders = [("mix", s.info["mix"]),
+             ("title", shared(s.info["title"][0].capitalize())),
+             ("artist", shared(s.info["artist"][0].capitalize()))]
+  for rng, label in BPM_LABELS:
+    if rng[0] < s.info["bpm"] <= rng[1]:
+      folders.append(("bpm", label))
+  if s.info["bpm"] >= 300: folders.append(("bpm", "300+"))
+  return folders
+
+def dance_folders(d):
+  return [("difficulty", util.unify_difficulty(d.diff)),
+          ("rating", shared("%2d" % d.difficulty[d.diff]))]
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Split a title, artist, or search query into lowercase words.
+def words(text):
+  if not isinstance(text, unicode):
+    try: text = text.decode("utf-8")
+    except UnicodeError: text = text.decode("iso-8859-1")
+  return WORD_RE.findall(text.lower())
+
+# Maps word prefixes to songs, for type-ahead search on the title,
+# subtitle, artist, and mix. Words are indexed by their first PREFIX_LEN
+# letters; longer query words are checked against the candidates' words.
+PREFIX_LEN = 3
+
+class SearchIndex(object):
+  def __init__(self):
+    self._prefixes = {}
+    self._words = {}
+
+  def add(self, songs):
+    for s in songs:
+      wds = []
+      for key in ("title", "subtitle", "artist", "mix"):
+        if s.info[key]: wds.extend(words(s.info[key]))
+      self._words[s] = wds
+      for w in wds:
+        for i in range(1, min(len(w), PREFIX_LEN) + 1):
+          self._prefixes.setdefault(w[:i], set()).add(s)
+
+  # Return the set of songs that have a word starting with each word
+  # in the query.
+  def find(self, query):
+    qwords = words(query)
+    if not qwords: return set()
+    # Longer words have smaller candidate sets, so start with them.
+    qwords.sort(key = len, reverse = True)
+    hits = None
+    for q in qwords:
+      found = self._prefixes.get(q[:PREFIX_LEN], ())
+      if hits is None: hits = set(found)
+      else: hits.intersection_update(found)
+      if len(q) > PREFIX_LEN:
+        hits = set([s for s in hits
+                    if [w for w in self._words[s] if w.startswith(q)]])
+      if not hits: break
+    return hits
+
+# A list that stays sorted by a key function. Keys are computed once per
+# item, and single items are inserted with a bisect rather than a re-sort.
+# The items list is updated in place, so callers can hold on to it.
+class SortedList(object):
+  def __init__(self, key):
+    self._key = key
+    self._keys = []
+    self._count = 0
+    self._positions = None
+    self.items = []
+
+  def __len__(self): return len(self.items)
+
+  # A mapping from each item to its index in the list.
+  def positions(self):
+    if self._positions is None:
+      self._positions = dict([(x, i) for i, x in enumerate(self.items)])
+    return self._positions
+
+  def add(self, items):
+    if len(items) == 1:
+      # The insertion count breaks ties, so items themselves are never
+      # compared and equal keys keep their insertion order.
+      k = (self._key(items[0]), self._count)
+      i = bisect.bisect_right(self._keys, k)
+      self._keys.insert(i, k)
+      self.items.insert(i, items[0])
+    else:
+      decorated = zip(self._keys, self.items)
+      decorated.extend([((self._key(x), self._count + i), x)
+                        for i, x in enumerate(items)])
+      decorated.sort()
+      self._keys[:] = [d[0] for d in decorated]
+      self.items[:] = [d[1] for d in decorated]
+    self._count += len(items)
+    self._positions = None
+
+  # Sort again, computing every key anew.
+  def resort(self):
+    items = self.items[:]
+    del self._keys[:]
+    del self.items[:]
+    self._count = 0
+    self.add(items)
+
+# The display items, folders, and sorted lists for a single game mode.
+class GameIndex(object):
+  def __init__(self, game, songs, finder):
+    self.game = game
+    self._finder = finder
+    self._displays = {}
+    self.songs = []
+    self.dances = []
+    self.valid_songs = []
+    self.valid_dances = []
+    self._sorted = {}
+    self._folders = {}
+    self._folder_names = {}
+    self._records = records.version
+    for name in SORT_NAMES:
+      self._sorted[name] = SortedList(self._key(name))
+      self._folders[name] = {}
+    self.add(songs)
+
+  def _key(self, name):
+    return lambda x: SORTS[name](x, self.game)
+
+  # Sort the lists that depend on records again, if any have been set
+  # since they were sorted.
+  def _check_records(self):
+    if self._records != records.version:
+      self._records = records.version
+      for name in RANKED_SORTS:
+        self._sorted[name].resort()
+        for lst in self._folders[name].values(): lst.resort()
+
+  # Add SongItems to the index. Songs without steps for this game mode
+  # are ignored.
+  def add(self, songs):
+    new_songs = []
+    new_dances = []
+    for s in songs:
+      if self.game not in s.difficulty: continue
+      sd = SongItemDisplay(s, self.game)
+      for diff in s.diff_list[self.game]:
+        d = DanceItemDisplay(s, self.game, diff)
+        sd.danceitems[diff] = d
+        d.songitem = sd
+        new_dances.append(d)
+      new_songs.append(sd)
+      self._displays[s] = sd
+
+    self.songs.extend(new_songs)
+    self.dances.extend(new_dances)
+    self.valid_songs.extend([s for s in new_songs if s.info["valid"]])
+    self.valid_dances.extend([d for d in new_dances if d.info["valid"]])
+
+    buckets = {}
+    for items, folders in ((new_songs, song_folders),
+                           (new_dances, dance_folders)):
+      for s in items:
+        for name, label in folders(s):
+          s.folder[name] = label
+          buckets.setdefault((name, label), []).append(s)
+
+    for (name, label), items in buckets.items():
+      if label not in self._folders[name]:
+        self._folders[name][label] = SortedList(self._key(name))
+        self._folder_names.pop(name, None)
+      self._folders[name][label].add(items)
+
+    for name in SORT_NAMES:
+      if SORT_DANCES[name]: items = new_dances
+      else: items = new_songs
+      if items: self._sorted[name].add(items)
+
+  # Every song (or dance, depending on the sort) in sorted order.
+  def sorted(self, sort_name):
+    self._check_records()
+    return self._sorted[sort_name].items
+
+  # The songs (or dances) matching a search query, in sorted order.
+  def search(self, query, sort_name):
+    self._check_records()
+    items = [self._displays[s] for s in self._finder.find(query)
+             if s in self._displays]
+    if SORT_DANCES[sort_name]:
+      items = [d for s in items for d in s.danceitems.values()]
+    items.sort(key = self._sorted[sort_name].positions().get)
+    return items
+
+  # The sorted contents of a single folder.
+  def folder(self, sort_name, label):
+    self._check_records()
+    return self._folders[sort_name][label].items
+
+  def folder_size(self, sort_name, label):
+    return len(self._folders[sort_name][label])
+
+  # The folder labels for a sort, in display order.
+  def folder_names(self, sort_name):
+    if sort_name not in self._folder_names:
+      lst = self._folders[sort_name].keys()
+      lst.sort(lambda x, y: cmp(x.lower(), y.lower()))
+      self._folder_names[sort_name] = lst
+    return self._folder_names[sort_name]
+
+# The indexes for a whole song library; the per-mode indexes are made the
+# first time a mode is played and then kept for the rest of the session.
+class SongIndex(object):
+  def __init__(self, songs):
+    self.source = songs
+    self.songs = list(songs)
+    self.finder = SearchIndex()
+    self.finder.add(self.songs)
+    self._games = {}
+    self._filenames = None
+
+  def add(self, songs):
+    self.songs.extend(songs)
+    self.finder.add(songs)
+    self._filenames = None
+    for gi in self._games.values(): gi.add(songs)
+
+  # Return the SongItem loaded from a file, or None if it's not in the
+  # library.
+  def song(self, filename):
+    if self._filenames is None:
+      self._filenames = dict([(s.filename, s) for s in self.songs])
+    return self._filenames.get(filename)
+
+  def get(self, game):
+    if game not in self._games:
+      self._games[game] = GameIndex(game, self.songs, self.finder)
+    return self._games[game]
+
+library = None
+
+# Build the index for the song library; called once all songs are loaded.
+def build(songs):
+  global library
+  library = SongIndex(songs)
+  return library
+
+# Return the index for a list of songs, building it if the library index
+# wasn't made from that list.
+def for_songs(songs):
+  if library is None or library.source is not songs: build(songs)
+  return library
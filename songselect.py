@@ -11,6 +11,7 @@ import random
 import options
 import error
 import util
+import songindex
 
 from constants import *
 from interface import *
@@ -18,36 +19,11 @@ from pygame.mixer import music
 from fonttheme import FontTheme
 
 from i18n import *
-
-SORTS = {
-  "subtitle": lambda x: x.info["subtitle"].lower(),
-  "title": lambda x: (x.info["title"].lower(), SORTS["subtitle"](x)),
-  "artist": lambda x: (x.info["artist"].lower(), SORTS["title"](x)),
-  "bpm": lambda x: (x.info["bpm"], SORTS["title"](x)),
-  "mix": lambda x: (x.info["mix"], SORTS["title"](x)),
-  "rating": lambda x: (x.difficulty[x.diff_list[0]], SORTS["rank"](x)),
-  "difficulty": lambda x: (util.difficulty_sort_key(x.diff_list[0]), SORTS["rating"](x)),
-  "rank": lambda x: -records.get(x.info["recordkey"],x.diff_list[0],game)[0],
-  }
-
-SORT_DANCES = {
-  "mix":False,
-  "title":False,
-  "artist":False,
-  "bpm":False,
-  "rating":True,
-  "difficulty":True
-  }
+from songindex import SORT_DANCES, SORT_NAMES, NUM_SORTS
 
 TEXTS = [_("subtitle"),_("title"),_("artist"),_("bpm"),_("mix"),
          _("rating"),_("difficulty"),_("rank")]
 
-# Dance sort names define sorting formats which are tied to dance data in songs;
-# therefore they can only be used if subfolders are allowed as each song may
-# appear in multiple folders.
-SORT_NAMES = ["mix", "title", "artist", "bpm", "rating", "difficulty"]
-NUM_SORTS = len(SORT_NAMES)
-
 SS_HELP = [
   _("Up / Down: Change song selection"),
   _("Left / Right: Change difficulty setting"),
@@ -56,6 +32,7 @@ SS_HELP = [
   _("Tab / Select: Go to a random song"),
   _("F1 / Start: Go to the options screen"),
   _("F11: Toggle fullscreen - S: Change the sort mode"),
+  _("Type a title, artist or mix to search for a song"),
   ]
 
 class FolderDisplay(object):
@@ -155,48 +132,28 @@ class SongSelect(InterfaceWindow):
   def __init__(self, songs, courses, screen, game):
 
     InterfaceWindow.__init__(self, screen, "newss-bg.png")
-    songs = [s for s in songs if s.difficulty.has_key(game)]
-    
-    if len(songs) == 0:
+    self._library = songindex.for_songs(songs).get(game)
+
+    if len(self._library.songs) == 0:
       error.ErrorMessage(screen, _("You don't have any songs for the game mode (")
                          + game + _(") that you selected.")) #TODO: format using % for better i18n
       return
 
-
-    # Construct a mapping between songs displays and dance displays.
-    songs_and_dances = [(SongItemDisplay(s, game),
-                         [DanceItemDisplay(s, game, diff) for diff in s.diff_list[game]])
-                        for s in songs]
-
-    for (s,ds) in songs_and_dances:
-      for d in ds:
-        s.danceitems[d.diff]=d
-        d.songitem=s
-
-    self._songs = [s[0] for s in songs_and_dances]
-    self._dances = reduce(lambda x,y: x+y[1],songs_and_dances,[])
-
     self._index = 0
     self._game = game
     self._config = dict(game_config)
-    self._all_songs = self._songs
-    self._all_dances = self._dances
-    self._all_valid_songs = [s for s in self._songs if s.info["valid"]]
-    self._all_valid_dances = [d for d in self._dances if d.info["valid"]]
+    self._query = u"" # Current search, or empty if not searching
 
     self._list = ListBox(FontTheme.SongSel_list,
                          [255, 255, 255], 26, 16, 220, [408, 56])
     # please use set constructions after python 2.4 is adopted
     sort_name = self._update_songitems()
 
-    if mainconfig["folders"]:
-      self._create_folders()
+    self._folders = mainconfig["folders"]
+    if self._folders:
       self._create_folder_list()
     else:
-      self._folders = None
       self._base_text = sort_name.upper()
-
-      self._songitems.sort(key=SORTS[sort_name])
       self._list.set_items([s.info["title"] for s in self._songitems])
 
     self._preview = SongPreview()
@@ -240,15 +197,17 @@ class SongSelect(InterfaceWindow):
     self._title = TextDisplay('SongSel_sort_mode', [210, 28], [414, 27])
     self._sprites.add(self._diff_widgets +
                       [self._banner, self._list, self._title])
-    self._screen.blit(self._bg, [0, 0])
-    pygame.display.update()
+    self.redraw()
+    ui.ui.text_input = self._query
     self.loop()
+    ui.ui.text_input = None
     music.fadeout(500)
     pygame.time.wait(500)
     # FIXME Does this belong in the menu code? Probably.
     music.load(os.path.join(sound_path, "menu.ogg"))
     music.set_volume(1.0)
     music.play(4, 0.0)
+    for s in self._library.songs + self._library.dances: s.unrender()
     player_config.update(self._configs[0]) # Save p1's settings
     game_config.update(self._config) # save game settings
 
@@ -257,7 +216,11 @@ class SongSelect(InterfaceWindow):
     self._list.set_index(self._index)
     self._title.set_text(self._base_text + " - %d/%d" % (self._index + 1,
                                                          len(self._songitems)))
-    while not (ev == ui.CANCEL and (not self._folders or self._song.isfolder)):
+    while not (ev == ui.CANCEL and not self._query and
+               (not self._folders or self._song.isfolder)):
+      searched = ui.ui.text_input != self._query
+      if searched: self._search(ui.ui.text_input)
+
       # Inactive player. If the event isn't set to ui.PASS, we try to use
       # the pid later, which will be bad.
       if pid >= len(self._diff_names):
@@ -313,10 +276,11 @@ class SongSelect(InterfaceWindow):
             error.ErrorMessage(screen, _("You don't have any songs here that ") +
                                _("are marked \"valid\" for random selection."))
       elif ev == ui.OPTIONS:
+        ui.ui.text_input = None
         opts = options.OptionScreen(self._configs, self._config, self._screen)
-        self._screen.blit(self._bg, [0, 0])
+        ui.ui.text_input = self._query
+        self.redraw()
         self.update()
-        pygame.display.update()
         if opts.start_dancing:
           ev = ui.CONFIRM
           continue
@@ -325,7 +289,10 @@ class SongSelect(InterfaceWindow):
         s = self._songitems[self._index]
         mainconfig["sortmode"] = (mainconfig["sortmode"] + 1) % NUM_SORTS
         sort_name = self._update_songitems()
-        if self._folders:
+        if self._query:
+          self._song = self._find_resorted()
+          self._search(self._query)
+        elif self._folders:
           if s.isfolder:
             self._create_folder_list()
           else:
@@ -335,7 +302,6 @@ class SongSelect(InterfaceWindow):
         else:
           s = self._find_resorted()
           self._base_text = _(sort_name).upper()
-          self._songitems.sort(key=SORTS[sort_name])
           self._index = self._songitems.index(s)
           self._list.set_items([s.info["title"] for s in self._songitems])
 
@@ -345,12 +311,17 @@ class SongSelect(InterfaceWindow):
           self._index = 0
         else:
           music.fadeout(500)
+          ui.ui.text_input = None
           dance.play(self._screen, [(self._song.filename, self._diff_names)],
                      self._configs, self._config, self._game)
           music.fadeout(500) # The just-played song
-          self._screen.blit(self._bg, [0, 0])
-          pygame.display.update()
+          self.redraw()
           ui.ui.clear()
+          ui.ui.text_input = self._query
+
+      elif ev == ui.CANCEL and self._query:
+        ui.ui.text_input = u""
+        self._search(u"")
 
       elif ev == ui.CANCEL:
         # first: get the parent folder of the active song
@@ -376,33 +347,33 @@ class SongSelect(InterfaceWindow):
           self._diff_names[i] = self._diff_names[pid]
           self._pref_diff_names[i] = self._diff_names[pid]
 
-      if ev in [ui.CANCEL, ui.UP, ui.DOWN, ui.RANDOM, ui.CONFIRM, ui.SORT]:
+      if searched or ev in [ui.CANCEL, ui.UP, ui.DOWN, ui.RANDOM, ui.CONFIRM, ui.SORT]:
         self._preview.preview(self._song)
         self._banner.set_song(self._song)
 
-      if ev in [ui.CANCEL, ui.UP, ui.DOWN, ui.RANDOM, ui.CONFIRM, ui.SORT]:
+      if searched or ev in [ui.CANCEL, ui.UP, ui.DOWN, ui.RANDOM, ui.CONFIRM, ui.SORT]:
         if ev == ui.UP: self._list.set_index(self._index, -1)
         elif ev == ui.DOWN: self._list.set_index(self._index, 1)
         else: self._list.set_index(self._index, 0) # don't animate
         self._title.set_text(self._base_text + " - %d/%d" % (self._index + 1,
                                                              len(self._songitems)))
 
-      if ev in [ui.UP, ui.DOWN, ui.RANDOM, ui.SORT, ui.CONFIRM]:
+      if searched or ev in [ui.UP, ui.DOWN, ui.RANDOM, ui.SORT, ui.CONFIRM]:
         if not self._song.isfolder:
           for pl, dname in enumerate(self._diff_names):
             name = self._pref_diff_names[pl]
             if name in self._song.diff_list:
                self._diff_names[pl] = name
-            elif self._unify_difficulties(name) in self._song.diff_list:
-               self._diff_names[pl] = self._unify_difficulties(name)
+            elif util.unify_difficulty(name) in self._song.diff_list:
+               self._diff_names[pl] = util.unify_difficulty(name)
             else: 
               # if both name and the song's difficulty list can be indexed:
               # find the nearest defined difficulty
               if  (name in util.DIFFICULTY_LIST or
-                  self._unify_difficulties(name) in util.DIFFICULTY_LIST) and \
+                  util.unify_difficulty(name) in util.DIFFICULTY_LIST) and \
                   reduce(lambda a,b: a and b in util.DIFFICULTY_LIST, 
                          self._song.diff_list , True ):
-                name = self._unify_difficulties(name)
+                name = util.unify_difficulty(name)
                 namei = util.DIFFICULTY_LIST.index(name)
                 diffi = [util.DIFFICULTY_LIST.index(d) for 
                                         d in self._song.diff_list]
@@ -413,7 +384,7 @@ class SongSelect(InterfaceWindow):
                 difflen = len(self._song.diff_list)
                 self._diff_names[pl] = self._song.diff_list[difflen/2]
           
-      if ev in [ui.UP, ui.DOWN, ui.LEFT, ui.RIGHT, ui.RANDOM, ui.CONFIRM]:
+      if searched or ev in [ui.UP, ui.DOWN, ui.LEFT, ui.RIGHT, ui.RANDOM, ui.CONFIRM]:
         if not self._song.isfolder:
           for i, name in enumerate(self._diff_names):
             rank = records.get(self._song.info["recordkey"],
@@ -431,90 +402,11 @@ class SongSelect(InterfaceWindow):
     InterfaceWindow.update(self)
     self._preview.update(pygame.time.get_ticks())
 
-  # Gets rid of superfluous/misspelled difficulties for sorting purposes.
-  # Return the difficulty if it's ok, however map S-MANIAC to SMANIAC.
-  # Return an existing difficulty if at least the first three characters 
-  # are the same.
-  def _unify_difficulties(self, difficulty):
-    diff = difficulty.upper()
-    if not diff in util.DIFFICULTY_LIST:
-      diffs = [d for d in util.DIFFICULTY_LIST \
-                               if d.startswith(diff[:2])]
-      if len(diffs)>0: diff = diffs[0]
-      else: diff = "other"
-    if diff=="S-MANIAC": diff = "SMANIAC" # see constants.DIFF_COLORS
-    return diff
-    
-  def _create_folders(self):
-    mixes = {}
-    artists = {}
-    titles = {}
-    bpms = {}
-    difficulties = {}
-    ratings = {}
-
-    for s in self._all_songs:
-      if s.info["mix"] not in mixes: mixes[s.info["mix"]] = []
-      mixes[s.info["mix"]].append(s)
-      s.folder["mix"] = s.info["mix"]
-
-      label = s.info["title"][0].capitalize()
-      if label not in titles: titles[label] = []
-      titles[label].append(s)
-      s.folder["title"] = label
-
-      label = s.info["artist"][0].capitalize()
-      if label not in artists: artists[label] = []
-      artists[label].append(s)
-      s.folder["artist"] = label
-
-      for rng in ((0, 50), (50, 100), (100, 121), (110, 120), (120, 130),
-                  (130, 140), (140, 150), (150, 160), (160, 170), (170, 180),
-                  (180, 190), (190, 200), (200, 225), (225, 250), (250, 275),
-                  (275, 299.99999999)):
-        if rng[0] < s.info["bpm"] <= rng[1]:
-          label = "%3d - %3d" % rng
-          if not label in bpms: bpms[label] = []
-          bpms[label].append(s)
-          s.folder["bpm"] = label
-      if s.info["bpm"] >= 300:
-        if "300+" not in bpms: bpms["300+"] = []
-        bpms["300+"].append(s)
-        s.folder["bpm"] = "300+"
-    for s in self._all_dances:
-      difficulty = self._unify_difficulties(s.diff_list[0])
-      label = difficulty
-      if not label in difficulties: difficulties[label]=[]
-      difficulties[label].append(s)
-      # s.folder["difficulty"] is only initialised here.
-      if "difficulty" in s.folder.keys():
-        # min() can't handle arbitrary comparators, so:
-        if util.difficulty_sort(s.folder["difficulty"], label)<=0 :
-          s.folder["difficulty"] = s.folder["difficulty"]
-        else: s.folder["difficulty"] = label
-      else:
-        s.folder["difficulty"] = label
-
-      rating = s.difficulty.values()[0]
-      label = "%2d" % rating
-      if not label in ratings: ratings[label]=[]
-      ratings[label].append(s)
-      # s.folder["rating"] is only initialised here.
-      if "rating" in s.folder.keys():
-        s.folder["rating"] = min(s.folder["rating"], label) 
-      else:
-        s.folder["rating"] = label
-        
-    self._folders = { "mix": mixes, "title": titles, "artist": artists,
-                      "bpm": bpms, "rating": ratings, "difficulty": difficulties }
-
   def _create_folder_list(self):
     sort_name = SORT_NAMES[mainconfig["sortmode"]]
-    lst = self._folders[sort_name].keys()
-    lst.sort(lambda x, y: cmp(x.lower(), y.lower()))
     new_songs = [FolderDisplay(folder, sort_name,
-                               len(self._folders[sort_name][folder])) for
-                 folder in lst]
+                               self._library.folder_size(sort_name, folder))
+                 for folder in self._library.folder_names(sort_name)]
     self._songitems = new_songs
     self._list.set_items([s.info["title"] for s in self._songitems])
     self._base_text = _("Sort by %s") % _(sort_name).capitalize()
@@ -522,24 +414,44 @@ class SongSelect(InterfaceWindow):
   def _create_song_list(self, folder):
     # folder contains a sorting criterion value in string format
     sort_name = SORT_NAMES[mainconfig["sortmode"]]
-    songlist = self._folders[sort_name][folder]
-    
-    songlist.sort(key=SORTS[sort_name])
-    
-    self._songitems = songlist
+    self._songitems = self._library.folder(sort_name, folder)
     self._list.set_items([s.info["title"] for s in self._songitems])
     if self._folders: self._base_text = folder_name(folder, sort_name)
 
+  # Show the songs matching query in the list, or go back to the normal
+  # list (opened at the current song) if the query is empty.
+  def _search(self, query):
+    self._query = query
+    sort_name = SORT_NAMES[mainconfig["sortmode"] % NUM_SORTS]
+    if query:
+      results = self._library.search(query, sort_name)
+      if results:
+        self._songitems = results
+        self._base_text = _("Search: %s") % query
+        self._list.set_items([s.info["title"] for s in self._songitems])
+      else:
+        self._base_text = _("Search: %s (no matches)") % query
+    else:
+      self._update_songitems()
+      if self._song.isfolder:
+        self._create_folder_list()
+      elif self._folders:
+        self._create_song_list(self._song.folder[sort_name])
+      else:
+        self._base_text = _(sort_name).upper()
+        self._list.set_items([s.info["title"] for s in self._songitems])
+
+    if self._song in self._songitems:
+      self._index = self._songitems.index(self._song)
+    else: self._index = 0
+
   def _update_songitems(self):
     sort_name = SORT_NAMES[mainconfig["sortmode"] % NUM_SORTS]
+    self._songitems = self._library.sorted(sort_name)
     if SORT_DANCES[sort_name]:
-      self._songitems = self._dances
-      self._all_songitems = self._all_dances
-      self._all_valid_songitems = self._all_valid_dances
+      self._all_valid_songitems = self._library.valid_dances
     else:
-      self._songitems = self._songs
-      self._all_songitems = self._all_songs
-      self._all_valid_songitems = self._all_valid_songs
+      self._all_valid_songitems = self._library.valid_songs
 
     return sort_name
 
@@ -12,6 +12,7 @@ class Stats(Listener):
     self.steps = { "V": 0, "P": 0, "G": 0, "O": 0, "B": 0, "M": 0 }
     self.early = self.late = self.ontime = 0
     self._times = []
+    self._when = []
 
   def stepped(self, pid, dir, curtime, etime, rating, combo):
     if rating is None: return
@@ -26,6 +27,7 @@ class Stats(Listener):
 
     if rating != "M" and rating != None:
       self._times.append(etime - curtime)
+      self._when.append(etime)
 
   def times(self):
     s = sum(self._times)
@@ -39,6 +41,18 @@ class Stats(Listener):
     avg = s / len(self._times)
     return int(avg*1000)
 
+  # How much the step offset changes per second of song time, or None
+  # if there were too few steps to tell.
+  def drift(self):
+    if len(self._times) < 20: return None
+    n = float(len(self._times))
+    mw = sum(self._when) / n
+    mt = sum(self._times) / n
+    den = sum([(w - mw)**2 for w in self._when])
+    if den == 0: return None
+    return sum([(w - mw) * (t - mt) for w, t in
+                zip(self._when, self._times)]) / den
+
   def ok_hold(self, pid, time, dir, whichone):
     self.hold_count += 1
     self.good_holds += 1
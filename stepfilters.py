@@ -170,8 +170,8 @@ def little(steps, mod):
       if beat % mod != 0:
         s[1:] = [0] * (len(s) - 1)
       for i in holds[:]:
-        if old_s[i] & 1:
-          s[i] |= 1
+        if old_s[i + 1] & 1:
+          s[i + 1] |= 1
           holds.remove(i)
       beat += s[0]
       for i,si in enumerate(s[1:]):
@@ -261,8 +261,8 @@ class RemoveJumps(Transform):
   def _transform(self, s):
     if s[0] not in NOT_STEPS:
       step = s[1:]
-      for i,s in enumerate(step):
-        if s & 2 and i not in self._holds: self._holds.append(i)
+      for i,si in enumerate(step):
+        if si & 2 and i not in self._holds: self._holds.append(i)
 
       if step.count(0) < len(step) - 1:
         if self._side and not self._holds: step.reverse()
@@ -273,8 +273,8 @@ class RemoveJumps(Transform):
         if self._side and not self._holds: step.reverse()
         self._side ^= 1
 
-      for i,s in enumerate(step):
-        if s & 1 and not s & 2 and i in self._holds:
+      for i,si in enumerate(step):
+        if si & 1 and not si & 2 and i in self._holds:
           self._holds.remove(i)
 
       return [s[0]] + step
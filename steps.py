@@ -6,6 +6,8 @@ import games
 import stepfilters
 
 from lyrics import Lyrics
+from songclock import SongClock
+from config import Options
 from util import toRealTime
 from constants import *
 
@@ -44,10 +46,6 @@ class Steps(object):
     self.soffset = self.offset * 1000
     self.bpm = song.info["bpm"]
 
-    if mainconfig['onboardaudio']:
-      self.offset = int(self.offset * 48000.0/44128.0)
-      self.bpm = self.bpm * 48000.0/44128.0
-
     self.lastbpmchangetime = []
     self.totalarrows = 0
     self.ready = None
@@ -253,11 +251,12 @@ class Steps(object):
     self.event_idx = self.nevent_idx = 0
     self.playingbpm = self.bpm
 
-  def get_events(self):
+  # Return the events that are due at the given song time.
+  def get_events(self, time):
     events, nevents = [], []
     idx = self.event_idx
     nidx = self.nevent_idx
-    time = self.curtime = float(music.get_pos())/1000.0
+    self.curtime = time
     while (idx < len(self.events) and
            self.events[idx].when <= time + 2 * toRealTime(self.events[idx].bpm, 1)):
       events.append(self.events[idx])
@@ -288,14 +287,17 @@ class SongData(object):
     self.soffset = song.info["gap"] * 1000
 
     self.crapout = 0
+    self.clock = SongClock()
 
     self.__dict__.update(config)
+    # The global and song options, as they are when the song starts.
+    self.options = Options(mainconfig, config)
 
     try:
         # if user used some internationalization in the configuration file,
 	# so in mainconfig["lyriccolor"], maybe there is invalid colors
 	# TODO: not save translated colors in the config file, only English
-        clrs = [colors.color[_(c)] for c in mainconfig["lyriccolor"].split("/")]
+        clrs = [colors.color[_(c)] for c in self.options.lyriccolor.split("/")]
     except:
         clrs = ["cyan","aqua"]
 
@@ -314,13 +316,15 @@ class SongData(object):
 
   def play(self):
     music.play(0, self.startat)
+    if self.options.onboardaudio: self.clock.start(self.options.audiorate)
+    else: self.clock.start()
 
   def kill(self):
     music.stop()
 
   def is_over(self):
     if not music.get_busy(): return True
-    elif self.endat and music.get_pos() > self.endat * 1000:
+    elif self.endat and self.clock.now() > self.endat:
       music.stop()
       return True
     else: return False
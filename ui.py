@@ -24,6 +24,10 @@ import pygame
 from copy import copy, deepcopy
 from collections import deque
 import os
+import time
+import select
+import threading
+import persist
 from constants import *
 
 import i18n
@@ -76,20 +80,34 @@ LEARN_GENERIC_BUTTON_INDEPENDENT = .5
 
 # Unfortunately the old SDL version that pygame uses does not give us events when
 # controllers are plugged in or removed. So in order to support hotplugging we have
-# to reinit the events system regularly. Because that risks losing events, we
-# only do that if we have not received any events for a certain amount of time.
-# Because losing events during dancing must be avoided at all costs and because it
-# is less likely that someone would un/plug controllers during a dance, the wait
-# time during dancing is very high. The reason we do it during dancing at all is
-# that if someone pulls out the controller during the dance on a keyboardless system
-# he would have to wait for the complete song to finish before he could interact
-# with the machine again. That could be several minutes.
+# to reinit the events system when the set of devices changes. Where the device
+# nodes can be watched (Linux), a DeviceWatcher thread flags when controllers
+# come or go. Because a reinit risks losing events, it is
+# only done by poll(), never by poll_dance(), so a change seen during a dance is
+# handled after the dance.
+# Elsewhere we have to reinit regularly, but only if we have not received any
+# events for a certain amount of time, and never during a dance.
 # When the reinit has been triggered by the expiration of the *_NO_EVENT_TIME, we
 # poll for new devices every *_INTERVAL until we see the first event.
 POLL_REINIT_CONTROLLERS_AFTER_NO_EVENT_TIME = 3000
 POLL_REINIT_CONTROLLERS_INTERVAL = 2000
-POLL_DANCE_REINIT_CONTROLLERS_AFTER_NO_EVENT_TIME = 20000
-POLL_DANCE_REINIT_CONTROLLERS_INTERVAL = 5000
+
+# The pygame event type posted by DeviceWatcher.
+DEVICES_CHANGED = pygame.USEREVENT
+
+# The directories whose entries are the attached input devices.
+DEVICE_DIRS = ("/dev/input", "/dev/input/by-id")
+
+# Seconds between checks of DEVICE_DIRS if inotify is not available. With inotify
+# this is only how often the watcher checks if it should stop.
+DEVICE_POLL_INTERVAL = 2.0
+
+# Seconds to wait after the first inotify event for the rest of the device nodes
+# of a controller to appear, so that plugging in a controller posts one event.
+DEVICE_SETTLE_TIME = 0.5
+
+# inotify_add_watch() mask: IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_MASK = 0x40 | 0x80 | 0x100 | 0x200
 
 
 # If no output change occurs for this many milliseconds, UI.poll() will start
@@ -121,6 +139,15 @@ dance_events = {
   "CENTER": CENTER,
 }
 
+# Maps the evid of a dance event to the direction letter used by the
+# dance code, and -evid to the letter prefixed with "-" for releases.
+dance_directions = {}
+for evid, letter in ((LEFT, 'l'), (DOWNLEFT, 'w'), (UPLEFT, 'k'),
+                     (RIGHT, 'r'), (UPRIGHT, 'z'), (DOWNRIGHT, 'g'),
+                     (UP, 'u'), (DOWN, 'd'), (CENTER, 'c')):
+  dance_directions[evid] = letter
+  dance_directions[-evid] = '-' + letter
+
 # These events do not have a prefix in the config file and
 # have a pid -1 associated with them when used in pydance input events.
 # Note that "P1_UP" is not the same as "UP". On a dance pad, the up arrow
@@ -413,6 +440,20 @@ class EventPlumbing(object):
     # when clone() is used to create a copy if this plumbing.
     self.menuing_disabled = False
 
+    # The network compiled by _compile(), or None if it has to be (re)compiled.
+    # Maps an input index to a pair (bit, rules) where bit is the input's bit in
+    # self._pressed and rules is a list of pairs (chord, output_valves). chord is
+    # the bitmask of all inputs that have to be pressed for output_valves to get
+    # pressure from this input.
+    self._table = None
+
+    # Maps every input index to its bit in the chord bitmasks. Indexes keep their
+    # bit when the table is recompiled, so that self._pressed stays valid.
+    self._bits = {}
+
+    # Bitmask of the inputs that are currently pressed.
+    self._pressed = 0
+
     self.container = container
     for line in blueprint.splitlines():
       line = line.strip().upper()
@@ -493,6 +534,7 @@ class EventPlumbing(object):
       except (KeyError,IndexError):
         self._make_index_valid(inputs)
         self.container[inputs].append(valve)
+        self._table = None
 
     else: # multi-button input => need to use EventForkValve
       try:
@@ -524,19 +566,93 @@ class EventPlumbing(object):
         for i in inputs:
           self.container[i].append(fork)
 
+    self._table = None
+
   def plus(self, index):
+    '''
+    Presses input index. Instead of passing pressure through the EventForkValves,
+    this looks up the rules for index in the compiled table and gives pressure
+    directly to the EventValves of every chord that is now completely pressed.
+    This has the same effect as EventForkValve.plus() followed by EventValve.plus().
+    '''
+    if self._table is None: self._compile()
     try:
-      for fork in self.container[index]:
-        fork.plus()
-    except (KeyError,IndexError):
-      pass
+      bit, rules = self._table[index]
+    except KeyError:
+      return
+    pressed = self._pressed | bit
+    if pressed == self._pressed: return
+    self._pressed = pressed
+    for chord, outputs in rules:
+      if pressed & chord == chord:
+        for v in outputs: # inlined EventValve.plus()
+          if v.enabled and v.pressure == 0:
+            v.evlist.append(v.open)
+          v.pressure += 1
 
   def minus(self, index):
+    ''' Releases input index. See plus(). '''
+    if self._table is None: self._compile()
     try:
-      for fork in self.container[index]:
-        fork.minus()
+      bit, rules = self._table[index]
+    except KeyError:
+      return
+    pressed = self._pressed
+    if not pressed & bit: return
+    self._pressed = pressed & ~bit
+    for chord, outputs in rules:
+      if pressed & chord == chord:
+        for v in outputs: # inlined EventValve.minus()
+          v.pressure -= 1
+          if v.enabled and v.pressure == 0:
+            v.evlist.append(v.closed)
+
+  def _compile(self):
+    '''
+    Flattens the network into self._table. Every EventForkValve becomes a rule whose
+    chord holds all of the fork's inputs, and EventValves connected directly to an
+    input become a rule whose chord is only that input's bit. The rules keep the order
+    of the valves in the container, so events come out in the same order as from the
+    network. They refer to the EventValves themselves, so visitors that change valves
+    (e.g. PIDTransposer) need no recompiling. Only add() and replace_valve() do.
+    '''
+    try:
+      iter = self.container.keys()
+      iter.sort()
+    except AttributeError:
+      iter = range(len(self.container))
+
+    forks = {} # maps each EventForkValve to the chord of its inputs
+    for idx in iter:
+      if len(self.container[idx]) == 0: continue
+      if idx not in self._bits:
+        self._bits[idx] = 1 << len(self._bits)
+      for x in self.container[idx]:
+        if type(x) == EventForkValve:
+          forks[x] = forks.get(x, 0) | self._bits[idx]
+
+    table = {}
+    for idx in iter:
+      if len(self.container[idx]) == 0: continue
+      bit = self._bits[idx]
+      rules = []
+      for x in self.container[idx]:
+        if type(x) == EventForkValve:
+          rules.append((forks[x], tuple(x.output_valves)))
+        elif len(rules) > 0 and rules[-1][0] == bit:
+          rules[-1] = (bit, rules[-1][1] + (x,))
+        else:
+          rules.append((bit, (x,)))
+      table[idx] = (bit, rules)
+
+    self._table = table
+
+  def has_input(self, index):
+    '''Returns True if input index is connected to any valve of this network.'''
+    try:
+      return len(self.container[index]) > 0
     except (KeyError,IndexError):
-      pass
+      return False
 
   def reset(self):
     '''
@@ -553,6 +669,8 @@ class EventPlumbing(object):
       for x in lst:
         x.reset()
 
+    self._pressed = 0
+
   def transpose_player(self, adder):
     '''Adds adder to all EventValves' pid >=0 , wrapping around at MAX_PLAYERS.'''
     self.visit(PIDTransposer(adder))
@@ -569,20 +687,19 @@ class EventPlumbing(object):
     It is necessary to clone() an EventPlumbing before using its plus()/minus().
     '''
     c = deepcopy(self)
+    c._table = None
     if self.menuing_disabled: c.menu_controls_enabled(False)
     return c
 
   def save_to_disk(self):
-    '''If this plumbing has a filename set and mainconfig["saveinput"], this plumbing is stored to disk.'''
+    '''
+    If this plumbing has a filename set and mainconfig["saveinput"], this plumbing is
+    queued to be stored to disk by the persist thread, so this is safe to call while
+    handling input.
+    '''
     if self.filename is not None and mainconfig["saveinput"]:
-      try:
-        with open(os.path.join(input_d_path, self.filename), "w") as f:
-          f.write(self.header)
-          f.write("\n")
-          f.write(repr(self))
-      except:
-        print _("W: Unable to write input configuration file %s") % (self.filename,)
-        print sys.exc_info()[1]
+      persist.save(os.path.join(input_d_path, self.filename),
+                   "%s\n%s" % (self.header, repr(self)))
 
   def visit(self, visitor):
     '''
@@ -634,6 +751,8 @@ class EventPlumbing(object):
 
         k += 1
 
+    self._table = None
+
   def __repr__(self):
      pbs = PlumbingStringer(self.is_keyboard)
      self.visit(pbs)
@@ -958,6 +1077,89 @@ class Controller(object):
     self.generic_buttons = {}
     self.num_pressed = 0
 
+def inotify_watch(dirs):
+  '''
+  Returns an inotify file descriptor watching dirs for entries being created and
+  removed, or None if inotify is not available or none of dirs could be watched.
+  '''
+  try:
+    import ctypes, ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+    fd = libc.inotify_init()
+  except (ImportError, OSError, AttributeError):
+    return None
+  if fd < 0:
+    return None
+
+  watched = 0
+  for d in dirs:
+    if libc.inotify_add_watch(fd, d, INOTIFY_MASK) >= 0:
+      watched += 1
+  if watched == 0:
+    os.close(fd)
+    return None
+  return fd
+
+class DeviceWatcher(threading.Thread):
+  '''
+  Watches DEVICE_DIRS for input devices being attached or removed. For each change
+  it sets changed, which poll() checks and clears, and posts a DEVICES_CHANGED
+  pygame event to wake up anything waiting for events. Uses inotify if available,
+  otherwise lists the directories every DEVICE_POLL_INTERVAL seconds.
+  '''
+  def __init__(self):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.changed = False
+    # constants blocks every event type that isn't input.
+    pygame.event.set_allowed(DEVICES_CHANGED)
+    self._fd = inotify_watch(DEVICE_DIRS)
+    self._state = self._listing()
+    self._running = True
+    self.start()
+
+  def _listing(self):
+    state = []
+    for d in DEVICE_DIRS:
+      try:
+        lst = os.listdir(d)
+        lst.sort()
+      except OSError:
+        lst = []
+      state.append(lst)
+    return state
+
+  def _drain(self):
+    while select.select([self._fd], [], [], 0)[0]:
+      os.read(self._fd, 4096)
+
+  def run(self):
+    while self._running:
+      if self._fd is None:
+        time.sleep(DEVICE_POLL_INTERVAL)
+      else:
+        try:
+          if not select.select([self._fd], [], [], DEVICE_POLL_INTERVAL)[0]:
+            continue
+          time.sleep(DEVICE_SETTLE_TIME)
+          self._drain()
+        except (select.error, OSError):
+          os.close(self._fd)
+          self._fd = None
+          continue
+
+      state = self._listing()
+      if state != self._state and self._running:
+        self._state = state
+        self.changed = True
+        try:
+          pygame.event.post(pygame.event.Event(DEVICES_CHANGED))
+        except pygame.error:
+          pass
+
+  def stop(self):
+    self._running = False
+
 class UI(object):
   '''
   Receives raw user input from pygame.event and translates
@@ -990,6 +1192,9 @@ class UI(object):
     # the EventPlumbing used for keyboard inputs.
     self.keyboard_plumbing = get_plumbing("keyboard", 0)
 
+    # None, or the text typed so far if text input is enabled. See _take_text().
+    self.text_input = None
+
     # list of Controller objects. Array index matches pygame's joystick id.
     self.controllers = []
 
@@ -999,6 +1204,11 @@ class UI(object):
     # Used by _can_skip_init_controllers()
     self._init_controllers_state = {}
 
+    # Watches for new devices, or None if we have to poll for them.
+    self.device_watcher = None
+    if os.path.isdir(DEVICE_DIRS[0]):
+      self.device_watcher = DeviceWatcher()
+
     self.learn_sound = pygame.mixer.Sound(os.path.join(sound_path, "assist-l.ogg"))
     self.learn_sound.set_volume(.345)
     self.plug_in_sound = pygame.mixer.Sound(os.path.join(sound_path, "clicked.ogg"))
@@ -1086,7 +1296,7 @@ class UI(object):
     self.controllers[joy].plumbing.visit(GenericButtonsFixup(joy))
     self.controllers[joy].reset()
 
-  def poll(self, autorepeat = True, reinit_time = POLL_REINIT_CONTROLLERS_AFTER_NO_EVENT_TIME, reinit_interval = POLL_REINIT_CONTROLLERS_INTERVAL):
+  def poll(self, autorepeat = True, reinit_time = POLL_REINIT_CONTROLLERS_AFTER_NO_EVENT_TIME, reinit_interval = POLL_REINIT_CONTROLLERS_INTERVAL, hotplug = True):
     '''
     Returns a pair (pid, evid) or (pid, -evid) where
       * pid is the player id the event belongs to (0..MAX_PLAYERS-1) or -1 if it is
@@ -1101,6 +1311,9 @@ class UI(object):
     If autorepeat == True and no events occur for REPEAT_INITIAL_DELAY, outputs that
     are being held and are in the REPEATABLE set will be repeated every REPEAT_DELAY ms.
 
+    If hotplug == True, controllers are reinitialized when devices have changed (or,
+    without a DeviceWatcher, after reinit_time ms without events).
+
     During dancing, the special function poll_dance() is used instead of this one.
     '''
     ticks = pygame.time.get_ticks()
@@ -1110,11 +1323,15 @@ class UI(object):
       if len(events) > 0:
         self.last_pygame_events_time = ticks
         self.pump(events)
-      else:
+      elif hotplug and self.device_watcher is None:
         if ticks > self.last_pygame_events_time + reinit_time:
           self.last_pygame_events_time = ticks - reinit_time + reinit_interval
           self.init_controllers()
 
+    if hotplug and self.device_watcher and self.device_watcher.changed:
+      self.device_watcher.changed = False
+      self.init_controllers()
+
     # discard generic button events
     while len(self.event_buffer) > 0 and (
           self.event_buffer[0][1] >= GENERIC_BUTTON or self.event_buffer[0][1] <= -GENERIC_BUTTON):
@@ -1134,9 +1351,11 @@ class UI(object):
   def poll_dance(self):
     '''
     Similar to poll() but filters out some events you don't want during the dance part.
-    In particular it does not have any auto-repeat functionality.
+    In particular it does not have any auto-repeat functionality, and it never
+    reinitializes the controllers, because that could lose events. Device changes are
+    handled by the next poll() after the dance.
     '''
-    return self.poll(False, POLL_DANCE_REINIT_CONTROLLERS_AFTER_NO_EVENT_TIME, POLL_DANCE_REINIT_CONTROLLERS_INTERVAL)
+    return self.poll(False, hotplug = False)
 
   def repeat_output(self):
     '''
@@ -1176,6 +1395,12 @@ class UI(object):
           return
         pygame.time.wait(20)
 
+  def idle(self):
+    '''Returns True if no input is pending and no key, button or direction is held,
+    i.e. poll() will return PASS until there is new input.'''
+    return (len(self.event_buffer) == 0 and not pygame.event.peek() and
+            True not in self.key_state and self.count_open_valves() == 0)
+
   def wait(self, delay = 20):
     '''Like poll() but if no input is available, waits with poll interval delay ms until an input
     is available and returns it.'''
@@ -1195,6 +1420,10 @@ class UI(object):
     for event in events:
       if event.type == pygame.QUIT:
         self.event_buffer.append((-1,QUIT))
+      elif event.type == DEVICES_CHANGED:
+        pass # poll() checks device_watcher.changed
+      elif event.type == pygame.KEYDOWN and self._take_text(event):
+        pass
       elif event.type == pygame.KEYDOWN:
         if event.key < len(self.key_state) and not self.key_state[event.key]:
           self.key_state[event.key] = True
@@ -1229,6 +1458,30 @@ class UI(object):
       self.last_valve_change_time = pygame.time.get_ticks()
       self._handle_generic_buttons(num_events)
 
+  def _take_text(self, event):
+    '''
+    If text input is enabled, adds the character typed with KEYDOWN event to
+    text_input and returns True. Typing only starts with a letter or digit whose
+    key is not mapped in the keyboard plumbing. After that every printable key
+    is taken, and Backspace deletes the last character. Keys pressed together
+    with Ctrl, Alt or Meta are never taken.
+    Returns False if the event should be handled as a normal key press.
+    '''
+    if self.text_input is None: return False
+    if getattr(event, "mod", 0) & (pygame.KMOD_CTRL | pygame.KMOD_ALT | pygame.KMOD_META):
+      return False
+    char = getattr(event, "unicode", u"")
+    if event.key == pygame.K_BACKSPACE:
+      if not self.text_input: return False
+      self.text_input = self.text_input[:-1]
+    elif self.text_input and char >= u" " and char != u"\x7f":
+      self.text_input += char
+    elif char.isalnum() and not self.keyboard_plumbing.has_input(event.key):
+      self.text_input += char
+    else:
+      return False
+    return True
+
   def _handle_axis(self, joy, axis, state):
     '''
     Update state (boolean) of axis for controller joy and pump into plumbing if it changed.
@@ -1318,6 +1571,42 @@ class UI(object):
     return skip and count > 0 # the count > 0 check tests if the directories did even exist
 
 
+class InputSampler(object):
+  '''
+  Collects the input events for the dance loop as triples (pid, evid, time), where time
+  is the song time at which the event was seen. The dance loop calls sample() at several
+  points in each frame and wait() instead of sleeping off the rest of a frame, which
+  samples every 1000/mainconfig["inputrate"] ms. So the time of a step, and the order of
+  presses and releases, do not depend on the frame rate.
+  This runs on the dance loop's thread because SDL only lets the thread that set the
+  video mode read pygame events.
+  '''
+  def __init__(self, clock):
+    self.clock = clock
+    self.events = deque()
+    self.interval = max(1, 1000 / max(1, mainconfig["inputrate"]))
+
+  def sample(self):
+    ev = ui.poll_dance()
+    if ev[1] == PASS: return
+    now = self.clock.peek()
+    while ev[1] != PASS:
+      self.events.append((ev[0], ev[1], now))
+      ev = ui.poll_dance()
+
+  def wait(self, ticks):
+    ''' Samples until pygame.time.get_ticks() reaches ticks. '''
+    self.sample()
+    while pygame.time.get_ticks() < ticks:
+      pygame.time.wait(self.interval)
+      self.sample()
+
+  def drain(self):
+    ''' Returns the events sampled since the last drain(), oldest first. '''
+    events = []
+    while self.events: events.append(self.events.popleft())
+    return events
+
 read_plumbing_templates()
 ui = UI()
 
@@ -25,16 +25,38 @@ DIFFICULTY_LIST = ["BEGINNER","EASY","LIGHT","BASIC","PARA",
                    "HARDCORE","CHALLENGE","ONI","SMANIAC",
                    "S-MANIAC","CRAZY","EXPERT"]
 
+# Map difficulty names to their position in DIFFICULTY_LIST, so sorting
+# doesn't have to do a list.index for every comparison.
+DIFFICULTY_INDEX = dict([(d, i) for i, d in enumerate(DIFFICULTY_LIST)])
+
 def difficulty_sort(a, b):
-  if a in DIFFICULTY_LIST and b in DIFFICULTY_LIST:
-    return cmp(DIFFICULTY_LIST.index(a), DIFFICULTY_LIST.index(b))
-  elif a in DIFFICULTY_LIST: return -1
-  elif b in DIFFICULTY_LIST: return 1
+  ia = DIFFICULTY_INDEX.get(a)
+  ib = DIFFICULTY_INDEX.get(b)
+  if ia is not None and ib is not None: return cmp(ia, ib)
+  elif ia is not None: return -1
+  elif ib is not None: return 1
   else: return cmp(a, b)
 
 def difficulty_sort_key(k):
-  try: return DIFFICULTY_LIST.index(k)
-  except ValueError: return len(DIFFICULTY_LIST)
+  return DIFFICULTY_INDEX.get(k, len(DIFFICULTY_LIST))
+
+# Gets rid of superfluous/misspelled difficulties for sorting purposes.
+# Return the difficulty if it's ok, however map S-MANIAC to SMANIAC.
+# Return an existing difficulty if at least the first two characters
+# are the same. Results are remembered, since there are only a handful
+# of distinct difficulty names in any library.
+_unified_difficulties = {}
+def unify_difficulty(difficulty):
+  if difficulty in _unified_difficulties:
+    return _unified_difficulties[difficulty]
+  diff = difficulty.upper()
+  if not diff in DIFFICULTY_INDEX:
+    diffs = [d for d in DIFFICULTY_LIST if d.startswith(diff[:2])]
+    if len(diffs)>0: diff = diffs[0]
+    else: diff = "other"
+  if diff=="S-MANIAC": diff = "SMANIAC" # see constants.DIFF_COLORS
+  _unified_difficulties[difficulty] = diff
+  return diff
 
 # Return the subtitle of a song...
 def find_subtitle(title):